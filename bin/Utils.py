@@ -1,4 +1,8 @@
 import os, errno
+import json
+from collections import namedtuple
+import numpy as np
+
 def createdirectorynotexist(fname):
     """Create a directory if the directory does not exist.
        @param: fname is the full file path name
@@ -30,4 +34,141 @@ def outputmap(matrix, header, outfile):
     createdirectorynotexist(outfile)
     with open(outfile, 'w') as w:
         w.writelines(header)
-    matrix.to_csv(path_or_buf=outfile, sep=' ', index=False, header=False, mode = 'a') #append
\ No newline at end of file
+    matrix.to_csv(path_or_buf=outfile, sep=' ', index=False, header=False, mode = 'a') #append
+
+AsciiGridHeader = namedtuple('AsciiGridHeader',
+    ['ncols', 'nrows', 'xll', 'yll', 'cellsize', 'nodata'])
+
+def _isnumber(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+def readasciiheader(f):
+    """Parse the header of an ascii grid and leave f positioned at the
+       first line of data. Both the ESRI header (ncols, nrows, xllcorner,
+       yllcorner, cellsize, NODATA_value) and the GRASS r.out.ascii header
+       (north, south, east, west, rows, cols, null) are understood.
+       @param: f is a file object opened in 'rb' mode.
+       @output: AsciiGridHeader, nodata is None if the header has none.
+    """
+    tags = {}
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        words = line.replace(':', ' ').split()
+        if not words:
+            if not line: # end of file
+                break
+            continue
+        if _isnumber(words[0]):
+            f.seek(pos)
+            break
+        tags[words[0].lower()] = words[1]
+
+    ncols = int(tags.get('ncols', tags.get('cols', 0)))
+    nrows = int(tags.get('nrows', tags.get('rows', 0)))
+    if 'cellsize' in tags:
+        cellsize = float(tags['cellsize'])
+        xll = float(tags.get('xllcorner', tags.get('xllcenter', 0)))
+        yll = float(tags.get('yllcorner', tags.get('yllcenter', 0)))
+    else:
+        xll = float(tags.get('west', 0))
+        yll = float(tags.get('south', 0))
+        cellsize = (float(tags.get('east', xll)) - xll) / max(ncols, 1)
+    nodata = tags.get('nodata_value', tags.get('null'))
+    if nodata is not None:
+        nodata = float(nodata)
+    return AsciiGridHeader(ncols, nrows, xll, yll, cellsize, nodata)
+
+def readasciigrid(fname, dtype=None, nullval=None):
+    """Read an ascii grid (as written by r.out.ascii) into a flat array.
+       The body is decoded by numpy directly, without building a DataFrame.
+       @param: fname is the ascii map to be read.
+               dtype is the numpy dtype of the output. If None, the values
+                     are read as float and downcast to int64 when every
+                     value is integral (the same inference as pd.read_csv).
+               nullval, if not None, replaces every NODATA cell.
+       @output: (AsciiGridHeader, 1-D numpy array of nrows*ncols values)
+    """
+    with open(fname, 'rb') as f:
+        header = readasciiheader(f)
+        arr = np.fromfile(f, dtype=np.float64 if dtype is None else dtype, sep=' ')
+
+    if header.ncols and header.nrows and len(arr) != header.ncols*header.nrows:
+        raise ValueError('%s has %d values, expected %d x %d' %
+                         (fname, len(arr), header.nrows, header.ncols))
+    if nullval is not None and header.nodata is not None:
+        arr[arr == header.nodata] = nullval
+    if dtype is None and np.array_equal(arr, np.floor(arr)):
+        arr = arr.astype(np.int64)
+    return header, arr
+
+def sidecarname(fname):
+    """Return the (.npy, .json) binary sidecar names of an ascii map,
+       e.g. "Data/pop_att.txt" -> ("Data/pop_att.npy", "Data/pop_att.json").
+    """
+    base = os.path.splitext(fname)[0]
+    return base + '.npy', base + '.json'
+
+def writesidecar(fname, arr, header):
+    """Save a raster as a dtype-preserving .npy next to fname, plus a small
+       .json header with the extent, nodata value and min/max of valid cells.
+       @param: fname is the ascii map (or its basename) the sidecar stands for.
+               arr is the raster (any shape, saved as nrows x ncols).
+               header is an AsciiGridHeader.
+    """
+    npyname, jsonname = sidecarname(fname)
+    createdirectorynotexist(npyname)
+    arr = np.asarray(arr).reshape(header.nrows, header.ncols)
+    valid = arr if header.nodata is None else arr[arr != header.nodata]
+    meta = header._asdict()
+    meta['dtype'] = arr.dtype.str
+    meta['min'] = valid.min().item() if valid.size else None
+    meta['max'] = valid.max().item() if valid.size else None
+    np.save(npyname, arr)
+    with open(jsonname, 'w') as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+
+def gridsource(fname):
+    """Return the file readgrid reads for fname: its .npy sidecar if
+       there is an up-to-date one, fname itself otherwise.
+    """
+    npyname, jsonname = sidecarname(fname)
+    if not (os.path.exists(npyname) and os.path.exists(jsonname)):
+        return fname
+    if os.path.exists(fname) and os.path.getmtime(fname) > os.path.getmtime(npyname):
+        return fname # the ascii map was re-exported after the sidecar
+    return npyname
+
+def readsidecar(fname):
+    """Read the binary sidecar of fname written by writesidecar.
+       The .npy is memory mapped, not copied.
+       @output: (AsciiGridHeader, 1-D numpy array), or None if fname
+                has no up-to-date sidecar.
+    """
+    npyname, jsonname = sidecarname(fname)
+    if gridsource(fname) != npyname:
+        return None
+    with open(jsonname, 'r') as f:
+        meta = json.load(f)
+    header = AsciiGridHeader(*[meta[k] for k in AsciiGridHeader._fields])
+    return header, np.load(npyname, mmap_mode='r').reshape(-1)
+
+def readgrid(fname, dtype=None, nullval=None):
+    """Read a raster map, preferring its binary sidecar over the ascii map.
+       Takes the same arguments and returns the same (header, array) as
+       readasciigrid. If dtype is None, the sidecar dtype is kept.
+    """
+    sidecar = readsidecar(fname)
+    if sidecar is None:
+        return readasciigrid(fname, dtype, nullval)
+
+    header, arr = sidecar
+    if nullval is not None and header.nodata is not None:
+        arr = np.where(arr == header.nodata, nullval, arr)
+    if dtype is not None:
+        arr = arr.astype(dtype)
+    return header, np.asarray(arr)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Read and write the EHdr .bil/.hdr raster pairs used by GLUC.
+
+The header layout follows BILwriteHeader in glucsrc/bil.c, so files
+written here can be read by GLUC and the GLUC outputs (change.bil,
+summary.bil) can be opened without going through GRASS. The data is
+accessed as numpy.memmap views, so no full copy is ever held in RAM.
+"""
+import os
+import sys
+from collections import namedtuple
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+BilHeader = namedtuple('BilHeader',
+    ['nrows', 'ncols', 'nbands', 'nbits', 'pixeltype', 'byteorder',
+     'skipbytes', 'bandrowbytes', 'totalrowbytes',
+     'ulx', 'uly', 'xdim', 'ydim', 'nodata'])
+
+# (PIXELTYPE, NBITS) -> numpy type without byte order
+BILTYPES = {
+    ('UNSIGNEDINT', 8) : 'u1',
+    ('UNSIGNEDINT', 16): 'u2',
+    ('UNSIGNEDINT', 32): 'u4',
+    ('SIGNEDINT', 8)   : 'i1',
+    ('SIGNEDINT', 16)  : 'i2',
+    ('SIGNEDINT', 32)  : 'i4',
+    ('FLOAT', 32)      : 'f4',
+    ('FLOAT', 64)      : 'f8',
+}
+
+
+def hdrname(bilname):
+    """Convert a .bil file name to the associated header file name
+       (same as get_hdr_name in glucsrc/bil.c).
+    """
+    return os.path.splitext(bilname)[0] + '.hdr'
+
+
+def readbilheader(bilname):
+    """Read the .hdr file associated with bilname.
+       Missing optional tags take the EHdr defaults used by GDAL.
+       @input: bilname (str): the .bil (or .hdr) file name
+       @output: BilHeader
+    """
+    tags = {}
+    with open(hdrname(bilname), 'r') as f:
+        for line in f:
+            words = line.split()
+            if len(words) >= 2:
+                tags[words[0].upper()] = words[1]
+
+    for tag in ('NROWS', 'NCOLS', 'NBITS'):
+        if tag not in tags:
+            raise RuntimeError('Failed to locate required tag %s in BIL header %s'
+                               % (tag, hdrname(bilname)))
+    if tags.get('LAYOUT', 'BIL').upper() != 'BIL':
+        raise RuntimeError('unsupported layout %s in %s' %
+                           (tags['LAYOUT'], hdrname(bilname)))
+
+    nrows = int(tags['NROWS'])
+    ncols = int(tags['NCOLS'])
+    nbands = int(tags.get('NBANDS', 1))
+    nbits = int(tags['NBITS'])
+    pixeltype = tags.get('PIXELTYPE', 'UNSIGNEDINT').upper()
+    bandrowbytes = int(tags.get('BANDROWBYTES', ncols*nbits/8))
+    totalrowbytes = int(tags.get('TOTALROWBYTES', nbands*bandrowbytes))
+    nodata = tags.get('NODATA')
+    if nodata is not None:
+        nodata = float(nodata)
+    return BilHeader(nrows, ncols, nbands, nbits, pixeltype,
+        tags.get('BYTEORDER', 'I').upper(), int(tags.get('SKIPBYTES', 0)),
+        bandrowbytes, totalrowbytes,
+        float(tags.get('ULXMAP', 0.0)), float(tags.get('ULYMAP', nrows-1)),
+        float(tags.get('XDIM', 1.0)), float(tags.get('YDIM', 1.0)), nodata)
+
+
+def bildtype(header):
+    """Return the numpy dtype described by the header, honouring BYTEORDER
+       (I = Intel/little endian, M = Motorola/big endian).
+    """
+    key = (header.pixeltype, header.nbits)
+    if key not in BILTYPES:
+        raise RuntimeError('unsupported BIL pixel type %s with NBITS %d' % key)
+    return np.dtype(('>' if header.byteorder == 'M' else '<') + BILTYPES[key])
+
+
+def openbil(bilname, mode='r'):
+    """Open a .bil file as a numpy.memmap view.
+       @inputs: bilname (str): the .bil file name
+                mode (str): 'r' read only, 'r+' to modify the file in place,
+                            'c' copy-on-write.
+       @output: (BilHeader, array) where array is a (nrows, ncols) view for
+                single band files and (nbands, nrows, ncols) otherwise.
+    """
+    header = readbilheader(bilname)
+    dtype = bildtype(header)
+    if header.totalrowbytes % dtype.itemsize or header.bandrowbytes % dtype.itemsize:
+        raise RuntimeError('row bytes of %s are not a multiple of NBITS' % bilname)
+
+    rowlen = header.totalrowbytes / dtype.itemsize
+    arr = np.memmap(bilname, dtype=dtype, mode=mode, offset=header.skipbytes,
+                    shape=(header.nrows, rowlen))
+    if header.nbands == 1:
+        return header, arr[:, :header.ncols]
+    # band interleaved by line: row r of band b starts at
+    # r*TOTALROWBYTES + b*BANDROWBYTES
+    return header, as_strided(arr, shape=(header.nbands, header.nrows, header.ncols),
+        strides=(header.bandrowbytes, header.totalrowbytes, dtype.itemsize))
+
+
+def writebilheader(bilname, nrows, ncols, dtype, ulx, uly, xdim, ydim, nodata=None):
+    """Write the .hdr file in the layout of BILwriteHeader (glucsrc/bil.c).
+       The data is always written in native (Intel) byte order.
+    """
+    dtype = np.dtype(dtype)
+    pixeltype = {'f': 'FLOAT', 'i': 'SIGNEDINT', 'u': 'UNSIGNEDINT'}.get(dtype.kind)
+    if pixeltype is None or (pixeltype, dtype.itemsize*8) not in BILTYPES:
+        raise RuntimeError('unsupported BIL data type %s' % dtype)
+
+    with open(hdrname(bilname), 'w') as f:
+        f.write("BYTEORDER\tI\n")
+        f.write("LAYOUT\t\tBIL\n")
+        f.write("NROWS\t\t%d\nNCOLS\t\t%d\n" % (nrows, ncols))
+        f.write("NBANDS\t\t1\n")
+        f.write("NBITS\t\t%d\n" % (dtype.itemsize * 8))
+        f.write("BANDROWBYTES\t%d\n" % (dtype.itemsize * ncols))
+        f.write("TOTALROWBYTES\t%d\n" % (dtype.itemsize * ncols))
+        f.write("PIXELTYPE\t%s\n" % pixeltype)
+        f.write("ULXMAP\t%f\nULYMAP\t%f\n" % (ulx, uly))
+        f.write("XDIM\t%f\nYDIM\t%f\n" % (xdim, ydim))
+        if nodata is not None:
+            f.write("NODATA\t%s\n" % nodata)
+
+
+def createbil(bilname, nrows, ncols, dtype, ulx, uly, xdim, ydim, nodata=None):
+    """Create an empty .bil/.hdr pair and return it as a writable memmap,
+       so large inputs can be staged block by block.
+       @output: (BilHeader, (nrows, ncols) numpy.memmap)
+    """
+    writebilheader(bilname, nrows, ncols, np.dtype(dtype).newbyteorder('<'),
+                   ulx, uly, xdim, ydim, nodata)
+    return openbil(bilname, mode='w+')
+
+
+def writebil(bilname, arr, ulx, uly, xdim, ydim, nodata=None, blockrows=256):
+    """Write a 2-D array as a .bil/.hdr pair. arr may itself be a memmap;
+       it is copied blockrows rows at a time.
+       @inputs: bilname (str): output .bil file name
+                arr (2-D array): the raster values, row 0 is the north edge
+                ulx, uly (float): center of the upper left cell
+                xdim, ydim (float): cell size
+    """
+    nrows, ncols = arr.shape
+    header, out = createbil(bilname, nrows, ncols, arr.dtype,
+                            ulx, uly, xdim, ydim, nodata)
+    for r in xrange(0, nrows, blockrows):
+        out[r:r+blockrows] = arr[r:r+blockrows]
+    out.flush()
+    del out
+    return header
+
+
+def main():
+    for bilname in sys.argv[1:]:
+        header, arr = openbil(bilname)
+        print bilname, bildtype(header)
+        print header
+        print "min: ", arr.min(), " max: ", arr.max()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Require Arg1: the .bil file(s) to be summarised."
+        exit(1)
+    main()
@@ -8,22 +8,73 @@ cities -- name of the cities raster layer.  Each city is identified by
           by the cat number in the associated cities vector layer.
 id     -- id (cat) of the city
 output -- the output layer name
+
+The same computation is available in process as cityattractors(), which
+runs in the GRASS session of the caller (e.g. multicostModel) and raises
+RuntimeError on failure.
 """
 import sys,os
+import shutil
+import tempfile
 from optparse import OptionParser
+from multiprocessing import Pool, cpu_count
 sys.path += ['./bin']
 from glob import iglob
 import time
-from sets import Set
+import numpy as np
+from bil import openbil, createbil
+from multicost import run_multicost
+from roadgraph import graph_travelcost
+from rasterstats import blockrows
+from parameters import CITIESWORKERS, MAPCALCMAXMAPS, CITIESCLIP, CITIESENGINE, \
+                       CITIESACCUMTYPE, CITIESTRAVEL, STATSMEMBUDGET
 
 usage = "usage: %prog [options] <cities>"
 
 description = """ Iterates through each city in the <cities> 
 vector layer computing a city attractor map.  Each city attractor 
 map is aggregated into the final <attmap> to create a cities gravity 
-map using POP/(cityatt+1)^2.
+map using POP/(cityatt+1)^2. Several modes (e.g. -m grav,cost) are
+derived from the same class travel time maps in one run.
 """
 
+# mode -> (output postfix, initial value, term of a class travel time,
+#          reduction of the terms: '+', 'max' or 'min')
+MODES = {
+    'grav': ('_att', '0.0',
+             'if(isnull(%(tt)s), 0.0, %(pop)s/(%(tt)s+30.0)^2)', '+'),
+    'max' : ('_max_att', '0.0',
+             'if(isnull(%(tt)s), 0.0, %(pop)s/(%(tt)s+0.1)^2)', 'max'),
+    # the cost multiplies 100 to enlarge the difference so that
+    # the cost can be viewable by the .tif map generated by grass
+    'cost': ('_cost', '9999.0',
+             'if(isnull(%(tt)s), 9999.0, %(tt)s*100)', 'min'),
+}
+
+def _gravterm(tt, pop):
+    return pop/(tt+30.0)**2
+
+def _maxterm(tt, pop):
+    return pop/(tt+0.1)**2
+
+def _costterm(tt, pop):
+    return tt*100
+
+# NumPy version of MODES for GridAccumulator: mode -> (term of the reached
+# cells, term of the null cells, in-place reduction)
+GRIDMODES = {
+    'grav': (_gravterm, 0.0, np.add),
+    'max' : (_maxterm, 0.0, np.maximum),
+    'cost': (_costterm, 9999.0, np.minimum),
+}
+
+# (cities, class, maxcost, travel) -> class travel time map computed in this run
+_ttcache = {}
+
+BUFFERDIST = 180 # meters, the centers are buffered before r.multicost
+
+grass = None # the grass.script module, set by grass_config or use_session
+
 def normalize(layer, result=""):
     "normalize a composity gravity map"
     if (result==""):
@@ -53,13 +104,77 @@ def grass_config(location, mapset, gisbase='/usr/local/grass-6.4.5svn', gisdbase
     gisrc = init(gisbase, gisdbase, location, mapset)  
 
 
+def use_session():
+    """Use the GRASS session already initialised in this process
+       (e.g. by multicostModel.grassConfig) instead of grass_config.
+    """
+    global grass
+    if grass is None:
+        if 'grass.script' not in sys.modules or 'GISRC' not in os.environ:
+            raise RuntimeError('cities: no GRASS session, run grass_config first')
+        grass = sys.modules['grass.script']
+
+
+def clip_to_reach(classlayer, maxcost, overland, interstates):
+    """Switch to a temporary region (WIND_OVERRIDE) around the centers of
+       the classlayer vector, expanded by the buffer and by the farthest
+       distance reachable within maxcost minutes at the fastest cell time
+       of overland and interstates. No cell outside can be reached, so
+       r.multicost gives the same values on it as on the full region.
+       @output: the name of the temporary region and the WIND_OVERRIDE
+                in use before, for unclip (None if nothing was clipped)
+    """
+    bounds = grass.parse_command('v.info', flags='g', map=classlayer)
+    full = grass.region()
+    mintime = min(float(grass.raster_info(m)['min']) for m in (overland, interstates))
+    if mintime <= 0:
+        return None
+    pad = BUFFERDIST + float(maxcost)/mintime*full['nsres'] + 2*full['nsres']
+
+    regionname = classlayer + '_reach'
+    if grass.run_command('g.region', save=regionname):
+        raise RuntimeError('unable to save the region of ' + classlayer)
+    clipped = (regionname, os.environ.get('WIND_OVERRIDE'))
+    os.environ['WIND_OVERRIDE'] = regionname # this process only
+    try:
+        if grass.run_command('g.region', align=overland,
+                n=min(float(bounds['north']) + pad, full['n']),
+                s=max(float(bounds['south']) - pad, full['s']),
+                e=min(float(bounds['east']) + pad, full['e']),
+                w=max(float(bounds['west']) - pad, full['w'])):
+            raise RuntimeError('unable to set the region of ' + classlayer)
+    except:
+        unclip(clipped)
+        raise
+    return clipped
+
+
+def unclip(clipped):
+    """Back to the region in use before clip_to_reach, including a
+       WIND_OVERRIDE of the caller.
+    """
+    if clipped is not None:
+        regionname, override = clipped
+        if override is not None:
+            os.environ['WIND_OVERRIDE'] = override
+        else:
+            del os.environ['WIND_OVERRIDE']
+        grass.run_command('g.remove', region=regionname)
+
+
 def make_city_tt(cities, cat, overland='overlandTravelTime30', 
-                 interstates='intTravelTime30', xover='cross', maxcost='180'):
+                 interstates='intTravelTime30', xover='cross', maxcost='180',
+                 clip=CITIESCLIP, travel=CITIESTRAVEL):
     """Extracts a specific city, buffers it, and then uses r.multicost
        to determine travel time out to maxcost (minutes), and computes
        attractor maps based on pop/tt^2.
        @inputs: cities (vector map) : center attractors
                 cat (int) : the class value of the centers
+                clip (bool) : run in a region clipped to the cells reachable
+                              within maxcost (clip_to_reach); the map is
+                              null outside of it, like beyond maxcost.
+                travel (str) : 'raster' runs r.multicost, 'graph' the
+                               road network search of roadgraph.py
        @outputs: travelcost (str) : the name of the class travelcost map
 
        Note: ywkim added, it originally extracts from the raster
@@ -67,23 +182,370 @@ def make_city_tt(cities, cat, overland='overlandTravelTime30',
        so change this to work using vector first then convert to raster
     """
     classlayer = '%s%s'%(cities,cat)
-    travelcost = '%s_travelcost' % classlayer
-    grass.run_command('v.extract', input=cities, output=classlayer,
-        where="class = %s" % (cat), overwrite=True, quiet=True)
+    travelcost = '%s%s_%s_%s_travelcost' % _ttkey(cities, cat, maxcost, travel)
+    if grass.run_command('v.extract', input=cities, output=classlayer,
+        where="class = %s" % (cat), overwrite=True, quiet=True):
+        raise RuntimeError('unable to extract class %s of %s' % (cat, cities))
     grass.run_command('g.region', res=30)
-    grass.run_command('v.to.rast', input=classlayer, output=classlayer, 
-        use='val', value=1, overwrite=True)
-    grass.run_command('g.remove', vect=classlayer)
-    grass.run_command('r.buffer', input=classlayer, output=classlayer, dist='180')
-    grass.mapcalc('%s=if(%s)' % (classlayer, classlayer))
-    grass.run_command('r.multicost', input=overland, m2=interstates, 
-        xover=xover, start_rast=classlayer, output=travelcost, max_cost=maxcost)
-    grass.run_command('g.remove', rast=classlayer)
+    clipped = clip_to_reach(classlayer, maxcost, overland, interstates) if clip else None
+    try:
+        if travel == 'graph':
+            graph_travelcost(grass, classlayer, travelcost, overland, maxcost=maxcost)
+            grass.run_command('g.remove', vect=classlayer)
+            return travelcost
+        if grass.run_command('v.to.rast', input=classlayer, output=classlayer, 
+            use='val', value=1, overwrite=True):
+            raise RuntimeError('unable to rasterize ' + classlayer)
+        grass.run_command('g.remove', vect=classlayer)
+        if grass.run_command('r.buffer', input=classlayer, output=classlayer,
+            dist=str(BUFFERDIST)):
+            raise RuntimeError('unable to buffer ' + classlayer)
+        grass.mapcalc('%s=if(%s)' % (classlayer, classlayer))
+        run_multicost(grass, input=overland, m2=interstates, 
+            xover=xover, start_rast=classlayer, output=travelcost, max_cost=maxcost)
+        grass.run_command('g.remove', rast=classlayer)
+    finally:
+        unclip(clipped)
     #grass.run_command('r.out.gdal', input=travelcost, 
     #   output='./Data/'+travelcost+".tif", type='Float64')
     return travelcost
 
 
+def _ttkey(cities, cat, maxcost, travel=CITIESTRAVEL):
+    """Key of a class travel time map in _ttcache, and the parts of its
+       name: the raster and graph engines give different maps.
+    """
+    return (cities, str(cat), str(maxcost), travel)
+
+
+def cached_class_tt(cities, cat, maxcost='180', reuse=False):
+    """Return the travel time map of a center class already computed in
+       this run or, with reuse, preserved (-P) by an earlier run; None if
+       there is none. A map of an earlier run may come from other centers
+       or settings, so it is only reused on request.
+    """
+    key = _ttkey(cities, cat, maxcost)
+    if key not in _ttcache:
+        travelcost = '%s%s_%s_%s_travelcost' % key
+        if not reuse or not grass.find_file(travelcost, element='cell')['name']:
+            return None
+        _ttcache[key] = travelcost
+    return _ttcache[key]
+
+
+def class_tt(cities, cat, maxcost='180', reuse=False):
+    """Return the travel time map of a center class, running make_city_tt
+       only once per (cities, class, maxcost): every mode of the run
+       reads the same map.
+    """
+    travelcost = cached_class_tt(cities, cat, maxcost, reuse)
+    if travelcost is None:
+        travelcost = make_city_tt(cities, cat, maxcost=maxcost)
+        _ttcache[_ttkey(cities, cat, maxcost)] = travelcost
+    return travelcost
+
+
+############# Parallel class travel times in temporary mapsets ##############
+def enter_mapset(gisenv, mapset):
+    """Switch this (worker) process to a temporary mapset, with the mapset
+       of the run in the search path for the inputs.
+       @output: the GISRC file of the process, to be removed by the caller
+    """
+    fd, gisrc = tempfile.mkstemp(prefix='gisrc_')
+    with os.fdopen(fd, 'w') as f:
+        f.write('GISDBASE: %s\nLOCATION_NAME: %s\nMAPSET: %s\n' %
+                (gisenv['GISDBASE'], gisenv['LOCATION_NAME'], mapset))
+    os.environ['GISRC'] = gisrc # this worker process only
+    if grass.run_command('g.mapsets', addmapset=gisenv['MAPSET'], quiet=True):
+        os.remove(gisrc)
+        raise RuntimeError('unable to access mapset %s from %s' %
+                           (gisenv['MAPSET'], mapset))
+    return gisrc
+
+
+def create_mapsets(gisenv, mapsets):
+    """Create temporary mapsets in the location of the run, with its
+       current region.
+       @output: the mapset directories, to be removed with drop_mapsets
+    """
+    location = os.path.join(gisenv['GISDBASE'], gisenv['LOCATION_NAME'])
+    paths = []
+    try:
+        for mapset in mapsets:
+            path = os.path.join(location, mapset)
+            if os.path.exists(path):
+                shutil.rmtree(path) # left over by a failed run
+            os.makedirs(path)
+            paths.append(path)
+            shutil.copy(os.path.join(location, gisenv['MAPSET'], 'WIND'), path)
+    except:
+        drop_mapsets(paths)
+        raise
+    return paths
+
+
+def _class_tt_worker(args):
+    """Pool worker: run make_city_tt in the temporary mapset of the class.
+       @output: the travel time map name qualified with its mapset
+    """
+    gisenv, mapset, cities, cat, maxcost = args
+    gisrc = enter_mapset(gisenv, mapset)
+    try:
+        return '%s@%s' % (make_city_tt(cities, cat, maxcost=maxcost), mapset)
+    finally:
+        os.remove(gisrc)
+
+
+def parallel_class_tt(cities, classList, maxcost='180', processes=None):
+    """Run make_city_tt for several center classes at once. Each class
+       runs in its own temporary mapset of the location (so the temporary
+       maps and the region of the classes never collide), created with
+       the current region.
+       @output: (travel time map names qualified with their mapset, in
+                 the order of classList, temporary mapset directories
+                 to be removed with drop_mapsets)
+    """
+    gisenv = grass.gisenv()
+    names = ['tmp_%s%s' % (cities, cat) for cat in classList]
+    mapsets = create_mapsets(gisenv, names)
+    try:
+        tasks = [(gisenv, name, cities, cat, maxcost) for name, cat in zip(names, classList)]
+        pool = Pool(min(processes or cpu_count(), len(tasks)))
+        try:
+            ttmaps = pool.map(_class_tt_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    except:
+        drop_mapsets(mapsets)
+        raise
+    return ttmaps, mapsets
+
+
+def drop_mapsets(mapsets):
+    """Remove the temporary mapsets of parallel_class_tt."""
+    for path in mapsets:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def reduce_classes(dest, mode, terms):
+    """Fold the class travel times into dest with a single r.mapcalc per
+       MAPCALCMAXMAPS classes. The terms are reduced in the given order,
+       left to right, so the result is the same as one r.mapcalc per class.
+       @inputs: dest (str): the output map, holding the initial value
+                mode (str): a key of MODES
+                terms (list of (pop, travel time map))
+    """
+    postfix, init, term, op = MODES[mode]
+    for start in xrange(0, len(terms), MAPCALCMAXMAPS):
+        parts = [term % dict(tt=tt, pop=pop) for pop, tt in terms[start:start+MAPCALCMAXMAPS]]
+        if op == '+':
+            expr = ' + '.join([dest] + parts)
+        else:
+            expr = '%s(%s)' % (op, ', '.join([dest] + parts))
+        grass.mapcalc('%s=%s' % (dest, expr))
+
+
+def drop_class_tt(cities):
+    """Remove the class travel time maps of cities computed in this run."""
+    keys = [key for key in _ttcache if key[0] == cities]
+    if keys:
+        grass.run_command('g.remove', rast=[_ttcache.pop(key) for key in keys])
+
+
+class MapcalcAccumulator:
+    """Fold the class travel times into the outputs with r.mapcalc
+       (reduce_classes); the outputs are rewritten for every batch of
+       classes added.
+    """
+    def __init__(self, dests):
+        self.dests = dests
+        for dest, mode in dests:
+            grass.mapcalc('%s=%s' % (dest, MODES[mode][1]))
+
+    def add(self, terms):
+        for dest, mode in self.dests:
+            reduce_classes(dest, mode, terms)
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class GridAccumulator:
+    """Fold the class travel times into the outputs in NumPy. Each class
+       map is exported once (EHdr) and streamed in row blocks, all modes
+       are reduced in the same pass into in-place accumulators (memory
+       mapped .bil files), and each output is imported into GRASS once by
+       finish. With dtype float64 the outputs are the same as with
+       MapcalcAccumulator, float32 halves the memory and I/O.
+    """
+    def __init__(self, dests, dtype=CITIESACCUMTYPE, membudget=STATSMEMBUDGET):
+        self.dests = dests
+        self.tmpdir = tempfile.mkdtemp(prefix='cities_')
+        region = grass.region()
+        self.nrows, self.ncols = int(region['rows']), int(region['cols'])
+        self.step = blockrows(self.ncols, 8, len(dests)+1, membudget)
+        self.accs, self.bilnames = [], []
+        for dest, mode in dests:
+            self.bilnames.append(os.path.join(self.tmpdir, dest + '.bil'))
+            header, acc = createbil(self.bilnames[-1],
+                self.nrows, self.ncols, dtype, region['w'] + region['ewres']/2.0,
+                region['n'] - region['nsres']/2.0, region['ewres'], region['nsres'])
+            acc[:] = GRIDMODES[mode][1] # the initial value of MODES
+            self.accs.append(acc)
+
+    def add(self, terms):
+        for pop, ttmap in terms:
+            bilname = os.path.join(self.tmpdir, 'tt.bil')
+            if grass.run_command('r.out.gdal', input=ttmap, output=bilname,
+                                 format='EHdr', type='Float64', nodata=-1, quiet=True):
+                raise RuntimeError('unable to export travel time ' + ttmap)
+            header, tt = openbil(bilname)
+            for r in xrange(0, self.nrows, self.step):
+                block = np.asarray(tt[r:r+self.step])
+                null = block < 0 # nodata
+                reached = np.where(null, 0.0, block)
+                for (dest, mode), acc in zip(self.dests, self.accs):
+                    term, nullterm, reduce = GRIDMODES[mode]
+                    out = acc[r:r+self.step]
+                    reduce(out, np.where(null, nullterm, term(reached, pop)), out=out)
+            del tt
+            for f in iglob(os.path.join(self.tmpdir, 'tt.*')):
+                os.remove(f)
+
+    def finish(self):
+        for (dest, mode), acc, bilname in zip(self.dests, self.accs, self.bilnames):
+            acc.flush()
+            if grass.run_command('r.in.gdal', flags='o', input=bilname,
+                                 output=dest, quiet=True):
+                raise RuntimeError('unable to import ' + dest)
+
+    def close(self):
+        self.accs = []
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+# engine name -> accumulator of the class travel times
+ACCUMULATORS = {
+    'mapcalc': MapcalcAccumulator,
+    'numpy': GridAccumulator,
+}
+
+
+def read_columns(cities, columns):
+    """Read columns of the attribute table of a vector map with a single
+       v.db.select.
+       @output: list of numpy string arrays, one per column
+    """
+    out = grass.read_command('v.db.select', flags='c', map=cities,
+                             column=','.join(columns), fs='|')
+    if out is None:
+        raise RuntimeError('unable to read the attributes of ' + cities)
+    rows = [line.split('|') for line in out.splitlines() if line]
+    table = np.array(rows, dtype=str).reshape(-1, len(columns))
+    return [table[:, i] for i in xrange(len(columns))]
+
+
+def class_averages(cities, colname):
+    """Return the center classes of cities and the average of the
+       colname column (e.g. total_pop) over the centers of each class,
+       from one query of the attribute table and grouped reductions.
+       @output: (classList, classAveList), classes ascending
+    """
+    classes, pops = read_columns(cities, ['CLASS', colname])
+    classList, index = np.unique(classes.astype(np.int64), return_inverse=True)
+    counts = np.bincount(index)
+    totals = np.bincount(index, weights=pops.astype(np.int64))
+    classAveList = totals.astype(np.int64) // counts # integer average, as before
+    print "classList: ", classList.tolist()
+    print "classAveList: ", classAveList.tolist()
+    return classList.tolist(), classAveList.tolist()
+
+
+def cityattractors(cities, name='cities', colname='POP2010', modes=('grav',),
+                   maxtime='180', preserve=False, rebuild=False, processes=CITIESWORKERS,
+                   engine=CITIESENGINE):
+    """Compute the center attractor maps of the cities vector layer in the
+       current GRASS session.
+       @inputs: cities (vector map): the centers, with CLASS and colname columns
+                name (str): prefix of the outputs, e.g. 'pop' -> pop_att, pop_cost
+                colname (str): the population column averaged per class
+                modes (list of str): keys of MODES, all computed from the
+                                     same class travel time maps
+                maxtime (str): max travel time (minutes) per class
+                preserve (bool): keep the class travel time maps, and
+                                 reuse the ones kept by an earlier run
+                rebuild (bool): with preserve, recompute the class travel
+                                time maps kept by an earlier run
+                processes (int): number of classes run at once, each in a
+                                 temporary mapset (parallel_class_tt);
+                                 0 uses every core, 1 runs in place.
+                engine (str): how the classes are folded into the outputs,
+                              a key of ACCUMULATORS.
+       @output: the list of output map names, one per mode
+       Raises RuntimeError if a GRASS module fails.
+    """
+    use_session()
+    for mode in modes:
+        if mode not in MODES:
+            raise ValueError("cities: mode must be max or grav or cost, not %s" % mode)
+
+    dests = [(name + MODES[mode][0], mode) for mode in modes]
+    classList, classAveList = class_averages(cities, colname)
+    accumulator = ACCUMULATORS[engine](dests)
+    try:
+        accumulate_classes(accumulator, cities, classList, classAveList, maxtime,
+                           preserve, rebuild, processes)
+        accumulator.finish()
+    finally:
+        accumulator.close()
+        if not preserve: # also after a failure, no map is left for a later run
+            drop_class_tt(cities)
+
+    for dest, mode in dests:
+        # normalize(dest) ==> use .SFA
+        if grass.run_command('r.null', map=dest, null=0.0):
+            raise RuntimeError('unable to set nulls of ' + dest)
+        # As all multicost model maps' smallest values are 0,
+        # it makes sense to set all null values to be 0.
+        print dest, " created."
+    return [dest for dest, mode in dests]
+
+
+def accumulate_classes(accumulator, cities, classList, classAveList, maxtime,
+                       preserve, rebuild, processes):
+    """Compute the travel time map of every center class (in parallel if
+       processes > 1) and add them to the accumulator in class order.
+    """
+    processes = processes or cpu_count()
+    reuse = preserve and not rebuild
+    todo = [cat for cat in classList if cached_class_tt(cities, cat, maxtime, reuse) is None]
+    if processes > 1 and len(todo) > 1:
+        # the classes run in parallel, the maps are then folded into
+        # the outputs in class order, so the result does not depend on
+        # which class finished first
+        ttmaps, mapsets = parallel_class_tt(cities, todo, maxtime, processes)
+        try:
+            if preserve: # keep them in the mapset of the run
+                for cat, ttmap in zip(todo, ttmaps):
+                    travelcost = ttmap.split('@')[0]
+                    if grass.run_command('g.copy', rast='%s,%s' % (ttmap, travelcost)):
+                        raise RuntimeError('unable to copy ' + ttmap)
+                    _ttcache[_ttkey(cities, cat, maxtime)] = travelcost
+            ttmaps = dict(zip(todo, ttmaps))
+            accumulator.add([(aveVal, ttmaps.get(cat) or cached_class_tt(cities, cat, maxtime, reuse))
+                             for cat, aveVal in zip(classList, classAveList)])
+        finally:
+            drop_mapsets(mapsets)
+    else:
+        for classVal, aveVal in zip(classList, classAveList):
+            print "Class =  ", classVal, ", Average = " , aveVal
+            classtravelcost = class_tt(cities, classVal, maxtime, reuse)
+            accumulator.add([(aveVal, classtravelcost)])
+
+
 def parse_args():
     parse = OptionParser(usage=usage, description=description)
     parse.add_option('-f', '--force', action="store_true", default=False,
@@ -95,13 +557,18 @@ def parse_args():
     parse.add_option('-p', '--pop', metavar='FIELDNAME', default='POP2010',
         help='name of the population field within parse')
     parse.add_option('-P', '--preserve', default=False, action="store_true",
-        help='preserves the individual city travel time maps (city##_tt)')
+        help='preserves the individual city travel time maps (city##_tt) '
+             'and reuses the ones preserved by an earlier run')
     parse.add_option('-r', '--rebuild', default=False, action="store_true",
-        help='rebuild city travel time maps even if one exists')
+        help='with -P, rebuild city travel time maps even if one exists')
     parse.add_option('-m', '--mode', default="grav",
-        help='operate in either max or gravity mode (default=grav)')
+        help='operate in max, gravity or cost mode, or several '
+             'separated by commas, e.g. grav,cost (default=grav)')
     parse.add_option('-n', '--name', default="cities",
         help='the name of the output attractor (default=cities)')
+    parse.add_option('-j', '--jobs', type='int', default=CITIESWORKERS,
+        help='number of classes run at once in temporary mapsets '
+             '(default=%d, 0 uses every core)' % CITIESWORKERS)
 
     opts, args = parse.parse_args()
     if len(args) != 1:
@@ -109,24 +576,13 @@ def parse_args():
     else:
         cities = args[0]
 
-    if opts.mode == 'grav':
-        dest = opts.name + '_att'
-        method = '$dest=$dest+if(isnull($tt), 0.0, $pop/($tt+30.0)^2)'
-        grass.mapcalc("$dest=0.0", dest=dest)
-    elif opts.mode == 'max':
-        dest = opts.name +'_max_att'
-        method = '$dest=max($dest,if(isnull($tt), 0.0, $pop/($tt+0.1)^2))'
-        grass.mapcalc("$dest=0.0", dest=dest)
-    elif opts.mode == 'cost':
-        dest = opts.name + '_cost'
-        # the cost multiplies 100 to enlarge the difference so that
-        # the cost can be viewable by the .tif map generated by grass
-        method = '$dest=min($dest,if(isnull($tt), 9999.0, $tt*100))'
-        grass.mapcalc("$dest=9999.0", dest=dest)
-    else:
-        parse.error("option mode must be max or gravity or cost")
+    modes = opts.mode.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parse.error("option mode must be max or gravity or cost")
 
-    return cities, dest, method, opts.pop, opts.maxtime
+    return cities, opts.name, modes, opts.pop, opts.maxtime, opts.preserve, opts.rebuild, \
+           opts.jobs
 
 
 def main():
@@ -134,42 +590,13 @@ def main():
 
     os.environ['GRASS_MESSAGE_FORMAT'] = 'silent'
     grass.run_command('g.gisenv', set='OVERWRITE=1')
-    mapset = grass.gisenv()['MAPSET']
-    
-    cities, dest, method, colname, maxtime = parse_args()
-
-    # ywkim added to figure out the number of class
-    # create the list for the unique class category
-    classSet = Set()
-    numClass = grass.parse_command('v.db.select', flags='c', map=cities, column='cat,CLASS', fs='=')
-    for cat,CLASS in numClass.items():
-        classSet.add(int(CLASS))
-    classList = list(classSet)
-    print "classList: ", classList
-    
-    # calculate average population for each class
-    classAveList = []
-    for i in xrange(len(classList)):
-        total = counter = 0
-        classAve = grass.parse_command('v.db.select', flags='c', map=cities, 
-            column='cat,'+colname, where='CLASS = '+str(classList[i]), fs='=')    
-        for cat,pop in classAve.items():
-            total += int(pop)
-            counter += 1
-        classAveList.append(total/counter)
-    print "classAveList: ", classAveList
-    
-    for classVal, aveVal in zip(classList, classAveList):
-        print "Class =  ", classVal, ", Average = " , aveVal
-        classtravelcost = make_city_tt(cities, classVal, maxcost=maxtime)
-        grass.mapcalc(method, dest=dest, pop=aveVal, tt=classtravelcost)
-
-    # normalize(dest) ==> use .SFA
-    grass.run_command('r.null', map=dest, null=0.0) 
-    # As all multicost model maps' smallest values are 0,
-    # it makes sense to set all null values to be 0.
     
-    print dest, " created."
+    cities, name, modes, colname, maxtime, preserve, rebuild, jobs = parse_args()
+    try:
+        cityattractors(cities, name, colname, modes, maxtime, preserve, rebuild, jobs)
+    except RuntimeError as e:
+        print >>sys.stderr, "cities.py:", e
+        sys.exit(1)
 
 if __name__ == '__main__':
      main()
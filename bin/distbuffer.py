@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""NumPy engine of the water and forest buffer costs (bufferAttraction).
+
+bufferAttraction runs r.buffer with the BUFFERRINGS distances (30..360 m)
+from the cells of a landcover condition and maps the zones to
+0 (the cells themselves), 30, 60, ... 360 and BUFFERCAP (390) beyond.
+Here the distance is an exact Euclidean distance transform, computed in
+two separable passes. The first pass gives the distance in rows to the
+nearest class cell of the same column. The second gives the squared
+distance as min over columns dc of (dc*ewres)^2 + (g*nsres)^2. Both passes
+only look as far as the last ring, so each cell is visited a constant
+number of times. A cell falls in the first ring whose squared distance,
+between cell centers, is not smaller than its own. This is the zone test
+of r.buffer, so the bands, and with them the SFA recode tables, are
+unchanged. All the buffer layers come from a single read of landcover,
+streamed in row blocks.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from bil import openbil, createbil
+from rasterstats import blockrows
+from parameters import BUFFERRINGS, BUFFERCAP, STATSMEMBUDGET
+
+
+def ring_costs(mask, ewres, nsres, rings=BUFFERRINGS, cap=BUFFERCAP, halo=0):
+    """Buffer cost of the cells of a boolean class mask: 0 on the class,
+       the first ring (meters) within reach, cap beyond the last ring.
+       @inputs: mask (2-D bool array)
+                halo (int): rows at the top and bottom of mask only read
+                            as neighbours, not returned (block processing)
+       @output: 2-D int16 array of mask.shape minus the halo rows
+    """
+    nrows, ncols = mask.shape
+    reach = max(int(np.ceil(rings[-1] / float(nsres))), 0)
+    creach = max(int(np.ceil(rings[-1] / float(ewres))), 0)
+    out = slice(halo, nrows - halo)
+
+    # rows to the nearest class cell of the column, within reach
+    big = reach + 1
+    g = np.where(mask[out], 0, big).astype(np.int32)
+    for dr in xrange(1, reach + 1):
+        for sign in (-1, 1):
+            lo, hi = halo + sign*dr, nrows - halo + sign*dr
+            src = mask[max(lo, 0):min(hi, nrows)]
+            dst = g[max(-lo, 0):g.shape[0] - max(hi - nrows, 0)]
+            np.minimum(dst, np.where(src, dr, big), out=dst)
+
+    # squared distance in meters, within reach
+    gd2 = np.where(g < big, (g*float(nsres))**2, np.inf)
+    d2 = gd2.copy()
+    for dc in xrange(1, creach + 1):
+        cost = (dc*float(ewres))**2
+        np.minimum(d2[:, dc:], gd2[:, :-dc] + cost, out=d2[:, dc:])
+        np.minimum(d2[:, :-dc], gd2[:, dc:] + cost, out=d2[:, :-dc])
+
+    # zone = first ring at least as far as the cell, as r.buffer
+    bounds = np.array([0.0] + [float(r)**2 for r in rings])
+    zone = np.searchsorted(bounds, d2, side='left')
+    values = np.array([0] + list(rings) + [cap], dtype=np.int16)
+    return values[zone]
+
+
+def buffer_costs(landcover, classlists, ewres, nsres, outs, rings=BUFFERRINGS,
+                 cap=BUFFERCAP, membudget=STATSMEMBUDGET):
+    """Fill the outs arrays with the buffer cost of each list of landcover
+       classes, reading landcover once in row blocks.
+       @inputs: landcover (2-D array, e.g. a memmap)
+                classlists (list of lists of landcover classes)
+                outs (list of 2-D int16 arrays, one per class list)
+    """
+    nrows, ncols = landcover.shape
+    halo = int(np.ceil(rings[-1] / float(nsres)))
+    step = blockrows(ncols, 8, 4, membudget)
+    for r in xrange(0, nrows, step):
+        lo, hi = max(r - halo, 0), min(r + step + halo, nrows)
+        block = np.asarray(landcover[lo:hi])
+        # pad at the map edges so every block has the full halo
+        top, bottom = halo - (r - lo), halo - (hi - min(r + step, nrows))
+        for classes, out in zip(classlists, outs):
+            mask = np.pad(np.in1d(block, classes).reshape(block.shape),
+                          ((top, bottom), (0, 0)), 'constant')
+            out[r:r+step] = ring_costs(mask, ewres, nsres, rings, cap, halo)
+
+
+def bufferAttractions(grass, layers, landcover='landcover'):
+    """Write the buffer cost layers, e.g.
+       [('water_cost', [11]), ('forest_cost', [41, 42, 43, 91])],
+       on the current region from one export of landcover.
+    """
+    region = grass.region()
+    tmpdir = tempfile.mkdtemp(prefix='distbuffer_')
+    try:
+        bilname = os.path.join(tmpdir, landcover + '.bil')
+        if grass.run_command('r.out.gdal', input=landcover, output=bilname,
+                             format='EHdr', type='Int16', nodata=-1, quiet=True):
+            raise RuntimeError('unable to export raster map ' + landcover)
+        header, lc = openbil(bilname)
+        outs, outnames = [], []
+        for layername, classes in layers:
+            outnames.append(os.path.join(tmpdir, layername + '_out.bil'))
+            header, out = createbil(outnames[-1], lc.shape[0], lc.shape[1], 'int16',
+                region['w'] + region['ewres']/2.0, region['n'] - region['nsres']/2.0,
+                region['ewres'], region['nsres'])
+            outs.append(out)
+        buffer_costs(lc, [classes for layername, classes in layers],
+                     region['ewres'], region['nsres'], outs)
+        for (layername, classes), out, outname in zip(layers, outs, outnames):
+            out.flush()
+            if grass.run_command('r.in.gdal', flags='o', input=outname,
+                                 output=layername, quiet=True):
+                raise RuntimeError('unable to import raster map ' + layername)
+        del lc, outs
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return [layername for layername, classes in layers]
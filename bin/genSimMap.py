@@ -1,10 +1,29 @@
 import sys
 sys.path += ['..']
-import pandas as pd
 import numpy as np
+from multiprocessing import Pool
 from sets import Set
+from Utils import readgrid
+from rasterstats import IntHistogram, sketchgrid, gridheader, iterblocks
+from parameters import NUMCOLORS, CHICAGOREGIONCODE, SIMMAPWORKERS, SIMMAPINDEXED
+from simmapcache import getcache
 
 SIMMAPHEADER = "./Inputs/simMapheader.txt"
+PALETTENODATA = 255 # palette index of the uncolored cells of genPaletteRaster
+
+_simmapheader = None # (header, footer) lines of SIMMAPHEADER, read once
+_rgbcache = {}       # (palette, numbaskets) -> rgblist
+
+def getSimMapHeader():
+    """Return the (header, footer) lines of SIMMAPHEADER, reading the
+       template only the first time.
+    """
+    global _simmapheader
+    if _simmapheader is None:
+        with open (SIMMAPHEADER) as f:
+            lines = f.readlines()
+        _simmapheader = (lines[:-2], lines[-2:])
+    return _simmapheader
 
 def genSimMap(spatialcode, classColorCondlist, filename):
     """This function generates simMap: the meta data for maps projected on google map
@@ -17,12 +36,10 @@ def genSimMap(spatialcode, classColorCondlist, filename):
                 R, G, B numerical values seperated by a space.
                 3. filename: the map name of the simMap file to output.
        @output: the simMap file with filename and postfix .map into ./Outputs folder.
+                The content of the file is returned as well.
     """
     # get header and footer from simMapheader.txt
-    with open (SIMMAPHEADER) as f:
-        lines = f.readlines()
-    header = lines[:-2]
-    footer = lines[-2:]
+    header, footer = getSimMapHeader()
     #Note that, in the simMapheader.txt, the layer name has to be final4 as 
     #defined in /services/plone/chicago/zinstance/src/leam.simmap/leam/
     #simmap/browser/simmap.js.
@@ -52,8 +69,80 @@ def genSimMap(spatialcode, classColorCondlist, filename):
     outfilename = "Outputs/"+ filename + ".map"
     with open(outfilename, "w") as f:
       f.writelines(outdata)
+    return outdata
+
+def getHistQuantileList(hist, numbaskets, nomin=False, nomax=False, isuniq=False):
+    """Integer raster version of getQuantileList working on an exact
+       IntHistogram: quantile ticks, unique values and the min/max removal
+       counts are all read from the bincount counts in linear time,
+       without sorting. Returns exactly what getSortedQuantileList returns
+       for the same cells.
+       @inputs: hist (IntHistogram): the non-negative cells of the map
+                the other inputs and the outputs are as in getQuantileList.
+    """
+    basketsize = len(hist)/numbaskets
+
+    uniqarr = hist.values()
+    if isuniq or len(uniqarr) <= 31:
+        if nomin:
+            return uniqarr[uniqarr!=uniqarr[0]], True
+        if nomax:
+            return uniqarr[uniqarr!=uniqarr[-1]], True
+        return uniqarr, True # set isuniq to be true
+
+    # same min/max removal rules as the sort-based path below
+    removemax = False
+    if nomax or hist.count(hist.max(), hist.max()+1) > (numbaskets>>2)*basketsize:
+        hist = hist.select(None, hist.max())
+        basketsize = len(hist)/numbaskets
+        removemax = True
+
+    removemin = False
+    if nomin or hist.count(hist.min(), hist.min()+1) > (numbaskets>>2)*basketsize:
+        hist = hist.select(hist.min()+1, None)
+        basketsize = len(hist)/numbaskets
+        removemin = True
+
+    # ticks at positions 0, basketsize, ... of the sorted values (sortedarr[0:-1:basketsize])
+    arrticks = hist.sortedat(xrange(*slice(0, -1, basketsize).indices(len(hist))))
+    arrticks = np.unique(arrticks)
+    return list(arrticks), False # return isuniq to be False
+
+def getSketchQuantileList(sketch, numbaskets, nomin=False, nomax=False, isuniq=False):
+    """Floating-point raster version of getQuantileList working on a
+       QuantileSketch built block by block (see rasterstats.sketchgrid).
+       Unique values, the min/max removal counts and the min/max themselves
+       are exact; the quantile ticks are within the sketch relative error
+       (SKETCHALPHA), which is plenty for color breaks.
+       @inputs: sketch (QuantileSketch): the non-negative cells of the map
+                the other inputs and the outputs are as in getQuantileList.
+    """
+    basketsize = len(sketch)/numbaskets
 
-def getQuantileList(mapfilename, numbaskets, nomin=False, nomax=False, isuniq=False):
+    if sketch.uniq is not None: # at most 31 uniq values, known exactly
+        uniqarr = np.array(sorted(sketch.uniq))
+        if nomin:
+            return uniqarr[uniqarr!=uniqarr[0]], True
+        if nomax:
+            return uniqarr[uniqarr!=uniqarr[-1]], True
+        return uniqarr, True # set isuniq to be true
+
+    # same min/max removal rules as the sort-based path
+    if nomax or sketch.top[0][1] > (numbaskets>>2)*basketsize:
+        sketch.removemax()
+        basketsize = len(sketch)/numbaskets
+
+    if nomin or sketch.low[0][1] > (numbaskets>>2)*basketsize:
+        sketch.removemin()
+        basketsize = len(sketch)/numbaskets
+
+    arrticks = sketch.quantiles(xrange(*slice(0, -1, basketsize).indices(len(sketch))))
+    if arrticks[-1] > 1:
+        arrticks = arrticks.astype(int)
+    arrticks = np.unique(arrticks)
+    return list(arrticks), False # return isuniq to be False
+
+def getQuantileList(mapfilename, numbaskets, nomin=False, nomax=False, isuniq=False, sketch=False):
     """Get the list of ticks for color assignment.
        @inputs: mapfilename(str): the ascii map to be read
                 numbaskets(int): the number of colors expected to assgin.
@@ -63,12 +152,31 @@ def getQuantileList(mapfilename, numbaskets, nomin=False, nomax=False, isuniq=Fa
                                Otherwise, return quantile ticks.
                 nomax (bool): if nomax = True, max value has no color assignemd.
                 nomin (bool):  if nomin = True, min value has no color assigned.
+                sketch (bool): if sketch = True, stream the map through an
+                               approximate quantile sketch instead of reading
+                               it whole (getSketchQuantileList).
         @outputs: arrticks (list of int): the list of ticks to assign color
                   numbaskets(int): number of ticks used.
+       Integer rasters take the O(N) histogram path (getHistQuantileList);
+       only floating-point rasters are sorted.
     """
-    df = pd.read_csv(mapfilename, sep=r"\s+", skiprows=6, header=None)
-    arr = df.values.flatten()
+    if sketch:
+        qsketch = sketchgrid(mapfilename)
+        if not isuniq or qsketch.uniq is not None:
+            return getSketchQuantileList(qsketch, numbaskets, nomin, nomax, isuniq)
+
+    header, arr = readgrid(mapfilename, nullval=-1)
     arr =  arr[arr>=0] # mapserver cannot recognize negatives
+    if arr.dtype.kind in 'iu': # integer rasters (e.g. UInt16 exports) need no sort
+        return getHistQuantileList(IntHistogram(arr), numbaskets, nomin, nomax, isuniq)
+    return getSortedQuantileList(arr, numbaskets, nomin, nomax, isuniq)
+
+def getSortedQuantileList(arr, numbaskets, nomin=False, nomax=False, isuniq=False):
+    """Sort-based version of getQuantileList, used for floating-point
+       rasters.
+       @inputs: arr (array): the non-negative cells of the map
+                the other inputs and the outputs are as in getQuantileList.
+    """
     basketsize = len(arr)/numbaskets
     sortedarr = np.sort(arr)
 
@@ -99,7 +207,7 @@ def getQuantileList(mapfilename, numbaskets, nomin=False, nomax=False, isuniq=Fa
     # without intermediate values.
     removemin = False
     if nomin or len(sortedarr[sortedarr == sortedarr[0]]) > (numbaskets>>2)*basketsize:
-        sortedarr = sortedarr[sortedarr!=sortedarr[-1]]
+        sortedarr = sortedarr[sortedarr!=sortedarr[0]]
         basketsize = len(sortedarr)/numbaskets
         removemin = True
 
@@ -109,11 +217,22 @@ def getQuantileList(mapfilename, numbaskets, nomin=False, nomax=False, isuniq=Fa
     if arrticks[-1] > 1:
         arrticks = arrticks.astype(int)
     arrticks = np.unique(arrticks)
-    print basketsize
-    print arrticks
     return list(arrticks), False # return isuniq to be False
 
-def getRGBList(numbaskets):
+def getRGBList(numbaskets, palette='default'):
+    """Return the list of colors of a palette, generating it only once
+       for each number of colors.
+       @input: numbaskets(int): number of colors
+               palette(str): 'default' (red to yellow to green to blue) or
+                             'results' (blues, for the GLUC results maps)
+       @output: rgblist(list of str): list of 'R G B' codes
+    """
+    key = (palette, numbaskets)
+    if key not in _rgbcache:
+        _rgbcache[key] = PALETTES[palette](numbaskets)
+    return list(_rgbcache[key])
+
+def getRGBList_default(numbaskets):
     """Inteporlate colors for maximum values to minimum values
        with colors with red to yellow to green to blue.
        @input: numbaskets(int): number of colors
@@ -151,7 +270,83 @@ def getRGBList(numbaskets):
         rgblist.append(str(rlist[i]) + " " + str(glist[i]) + " " + str(blist[i]))
     return rgblist
 
-def genclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq=False):
+def getRGBList_results(numbaskets):
+    """Inteporlate colors for the GLUC results maps (years of growth)
+       from dark blue (early years) to light blue (late years).
+       @input: numbaskets(int): number of colors
+       @output: rgblist(list of str): list of 'R G B' codes
+    """
+    if numbaskets == 1:
+        return ['255 0 0']
+    if numbaskets == 2:
+        return ['255 255 0', '255 0 0']
+    if numbaskets == 3:
+        return ['220 220 240', '115 120 150', '10 20 60']
+    if numbaskets == 4:
+        return ['220 220 240', '150 160 180', '807 85 120', '10 20 60']
+
+    # From dark blue (early years) to light blue (late years).
+    # Red Color Code List
+    rnum50 = rnum255 = max(0, numbaskets/3-1)
+    rarr = np.linspace(10, 220, numbaskets-rnum50-rnum255, dtype=np.int)
+    rlist = [10]*rnum50 + rarr.tolist() + [220]*rnum255
+    rlist = rlist[::-1]
+
+    # Green Color Code List
+    gnum50 = gnum255 = max(0, numbaskets / 3 - 1)
+    garr = np.linspace(20, 220, numbaskets - gnum50 - gnum255, dtype=np.int)
+    glist = [20] * gnum50 + garr.tolist() + [220] * gnum255
+    glist = glist[::-1]
+
+    # Blue Color Code List
+    bnum50 = bnum255 = max(0, numbaskets/3-1)
+    barr = np.linspace(60, 240, numbaskets-bnum50-bnum255, dtype=np.int)
+    blist = [60]*bnum50 + barr.tolist() + [240]*bnum255
+    blist = blist[::-1]
+
+    rgblist = []
+    for i in xrange(numbaskets):
+        rgblist.append(str(rlist[i]) + " " + str(glist[i]) + " " + str(blist[i]))
+    return rgblist
+
+PALETTES = {
+    'default': getRGBList_default,
+    'results': getRGBList_results,
+}
+
+def simmapCacheKey(filename, numbaskets, nomin=False, nomax=False, isuniq=False,
+                   sketch=False, palette='default', spatialcode=None):
+    """Key of the SimMapCache entry of a classified map. With spatialcode,
+       the key also covers the mapfile template, for the rendered .map.
+    """
+    options = dict(numbaskets=numbaskets, nomin=nomin, nomax=nomax, isuniq=isuniq,
+                   sketch=sketch, palette=palette)
+    if spatialcode is not None:
+        header, footer = getSimMapHeader()
+        options['spatialcode'] = str(spatialcode)
+        options['template'] = "".join(header + footer)
+    return getcache().key("./Data/%s.txt" % filename, **options)
+
+def genclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq=False,
+                          sketch=False, palette='default', cache=True):
+    """Cached version of computeclassColorCondlist (same inputs and output).
+       With cache = True, the SimMapCache is looked up before the raster
+       is read, and the result is stored in it.
+    """
+    if not cache:
+        return computeclassColorCondlist(filename, numbaskets, nomin, nomax, isuniq,
+                                         sketch, palette)
+    key = simmapCacheKey(filename, numbaskets, nomin, nomax, isuniq, sketch, palette)
+    entry = getcache().get(key)
+    if entry is not None:
+        return entry['condlist']
+    classColorCondlist = computeclassColorCondlist(filename, numbaskets, nomin, nomax,
+                                                   isuniq, sketch, palette)
+    getcache().put(key, classColorCondlist)
+    return classColorCondlist
+
+def computeclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq=False,
+                              sketch=False, palette='default'):
     """Generate a list of triples in the format(classname, condition, color)
        @inputs: filename(str): the ascii map filename without path and postfix,
                               which is a .txt file locates in ./Data directory.
@@ -160,15 +355,31 @@ def genclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq
                               less due to the hardness to assign quantile colors.
                 isuniq (bool): if isuniq = False, assign map quantile colors.
                                Otherwise, assign color with unique values. 
+                sketch (bool): if sketch = True, the quantile colors come from
+                               an approximate quantile sketch (floating-point maps).
+                palette (str): the color palette, a key of PALETTES.
+    """
+    quantilelist, isuniq = getclassBreaks(filename, numbaskets, nomin, nomax, isuniq, sketch)
+    return breaksCondlist(quantilelist, isuniq, palette)
+
+def getclassBreaks(filename, numbaskets, nomin=False, nomax=False, isuniq=False, sketch=False):
+    """The ticks of the color classes of a map, see getQuantileList.
+       @inputs: as in genclassColorCondlist.
+       @output: (quantilelist, isuniq)
     """
     if (numbaskets < 2):
         print "Error: number of baskets is less than 2."
         exit(1)
-    quantilelist, isuniq = getQuantileList("./Data/%s.txt" % filename, numbaskets, nomin, nomax, isuniq)
+    return getQuantileList("./Data/%s.txt" % filename, numbaskets, nomin, nomax, isuniq, sketch)
+
+def breaksCondlist(quantilelist, isuniq, palette='default'):
+    """Build the (classname, condition, color) triples of the class ticks
+       returned by getclassBreaks.
+    """
     if isuniq:
         numbaskets = len(quantilelist)
         classColorCondlist = []
-        rgblist = getRGBList(numbaskets)
+        rgblist = getRGBList(numbaskets, palette)
         for tick, rgb in zip(quantilelist, rgblist):
             condstr = "[pixel] == %s" % str(tick)
             classColorCondlist.append((tick, condstr, rgb))
@@ -176,7 +387,7 @@ def genclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq
         return classColorCondlist
 
     numbaskets = len(quantilelist) + 1   # note that the fisrt cond == quantilelist[0]
-    rgblist = getRGBList(numbaskets)
+    rgblist = getRGBList(numbaskets, palette)
     lastindex = numbaskets-1
 
     classColorCondlist = []
@@ -192,13 +403,149 @@ def genclassColorCondlist(filename, numbaskets, nomin=False, nomax=False, isuniq
     print classColorCondlist
     return classColorCondlist
 
+def paletteIndex(values, quantilelist, isuniq):
+    """Classify cells in NumPy the way the mapserver expressions of
+       breaksCondlist would: the result is the index of the class (and
+       of its color in the palette), PALETTENODATA for uncolored cells.
+       @inputs: values (array): the cells, negatives are null
+                quantilelist, isuniq: as returned by getclassBreaks
+       @output: numpy.uint8 array of the shape of values
+    """
+    # the ticks as printed in the expressions, str() rounds floats
+    ticks = np.array([float(str(tick)) for tick in quantilelist])
+    index = np.searchsorted(ticks, values) # ticks[i-1] < value <= ticks[i]
+    if isuniq:
+        colored = ticks[np.minimum(index, len(ticks)-1)] == values
+    else:
+        colored = values >= ticks[0]
+    colored &= values >= 0
+    return np.where(colored, index, PALETTENODATA).astype(np.uint8)
+
+def genPaletteRaster(filename, quantilelist, isuniq, palette='default',
+                     spatialcode=CHICAGOREGIONCODE):
+    """Write the pre-classified GeoTIFF of a map: a Byte raster of the class
+       indices of paletteIndex with the class colors as its color table,
+       so mapserver renders it without evaluating any class expression.
+       The map is read in row blocks from ./Data/filename.txt (or its
+       sidecar).
+       @output: the GeoTIFF file name, Data/<filename>_idx.tif
+    """
+    from osgeo import gdal, osr # only needed by the indexed publish mode
+    from geotiff import gtiffcreateopts
+
+    numbaskets = len(quantilelist) + (0 if isuniq else 1)
+    if numbaskets > PALETTENODATA:
+        raise ValueError('%s: %d classes do not fit a Byte palette' % (filename, numbaskets))
+
+    mapfilename = "./Data/%s.txt" % filename
+    header = gridheader(mapfilename)
+    outfilename = "Data/%s_idx.tif" % filename
+    ds = gdal.GetDriverByName('GTiff').Create(outfilename, header.ncols, header.nrows,
+                                              1, gdal.GDT_Byte,
+                                              gtiffcreateopts('Byte', predictor=False))
+    ds.SetGeoTransform((header.xll, header.cellsize, 0.0,
+                        header.yll + header.nrows*header.cellsize, 0.0, -header.cellsize))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(spatialcode))
+    ds.SetProjection(srs.ExportToWkt())
+
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(PALETTENODATA)
+    colors = gdal.ColorTable()
+    for i, rgb in enumerate(getRGBList(numbaskets, palette)):
+        colors.SetColorEntry(i, tuple(int(c) for c in rgb.split()) + (255,))
+    colors.SetColorEntry(PALETTENODATA, (0, 0, 0, 0))
+    band.SetRasterColorTable(colors)
+    band.SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+
+    row = 0
+    for block, in iterblocks([mapfilename], nullval=-1):
+        block = paletteIndex(block, quantilelist, isuniq).reshape(-1, header.ncols)
+        band.WriteArray(block, 0, row)
+        row += len(block)
+    band.FlushCache()
+    ds = None # closes the file
+    return outfilename
+
+def _layerOptions(layer):
+    """genclassColorCondlist arguments of a genSimMaps layer."""
+    return (layer['name'], layer.get('numcolors', NUMCOLORS),
+        layer.get('nomin', False), layer.get('nomax', False), layer.get('isuniq', False),
+        layer.get('sketch', False), layer.get('palette', 'default'))
+
+def _classColorCondlist(args):
+    """Pool worker: classify one (layer, spatialcode) of genSimMaps. The
+       cache is only used by the parent process. Indexed layers get their
+       palette raster written here and an empty class list.
+    """
+    layer, spatialcode = args
+    if layer.get('indexed', SIMMAPINDEXED):
+        name, numbaskets, nomin, nomax, isuniq, sketch, palette = _layerOptions(layer)
+        quantilelist, isuniq = getclassBreaks(name, numbaskets, nomin, nomax, isuniq, sketch)
+        genPaletteRaster(name, quantilelist, isuniq, palette, spatialcode)
+        return []
+    return computeclassColorCondlist(*_layerOptions(layer))
+
+def genSimMaps(layers, spatialcode=CHICAGOREGIONCODE, processes=SIMMAPWORKERS):
+    """Generate the .map files of a batch of layers in one pass.
+       Each raster is read exactly once, the mapfile template and the
+       palettes are shared by all layers, and the classification of the
+       layers is spread over a pool of processes worker processes.
+       @inputs: layers (list of dict): one dict per layer with key 'name'
+                       (the map name in ./Data) and the optional keys
+                       'nomin', 'nomax', 'isuniq', 'sketch', 'numcolors'
+                       and 'palette' (see genclassColorCondlist), and
+                       'indexed' (default SIMMAPINDEXED): classify the map
+                       into the palette raster Data/<name>_idx.tif
+                       (genPaletteRaster) with a class-free .map file.
+                spatialcode (str): the epsg code, see genSimMap.
+                processes (int): number of worker processes, 1 runs in place.
+       @output: the list of the generated .map file names.
+       Layers whose raster and options are found in the SimMapCache are
+       not read at all; the cached .map text is written instead. Indexed
+       layers always are, as their palette raster is rebuilt.
+    """
+    simmapcache = getcache()
+    todo = []
+    for layer in layers:
+        if layer.get('indexed', SIMMAPINDEXED):
+            todo.append((layer, None))
+            continue
+        key = simmapCacheKey(*_layerOptions(layer), spatialcode=spatialcode)
+        entry = simmapcache.get(key)
+        if entry is not None and entry['mapfile'] is not None:
+            with open("Outputs/%s.map" % layer['name'], "w") as f:
+                f.write(entry['mapfile'])
+        else:
+            todo.append((layer, key))
+
+    todolayers = [(layer, spatialcode) for layer, key in todo]
+    if processes > 1 and len(todolayers) > 1:
+        pool = Pool(min(processes, len(todolayers)))
+        try:
+            condlists = pool.map(_classColorCondlist, todolayers)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        condlists = [_classColorCondlist(layer) for layer in todolayers]
+
+    for (layer, key), classColorCondlist in zip(todo, condlists):
+        outdata = genSimMap(spatialcode, classColorCondlist, layer['name'])
+        if key is None:
+            continue
+        simmapcache.put(key, classColorCondlist, outdata)
+        simmapcache.put(simmapCacheKey(*_layerOptions(layer)), classColorCondlist)
+    return ["Outputs/%s.map" % layer['name'] for layer in layers]
+
 def main():
     filename = sys.argv[1]
     numbaskets = int(sys.argv[2])
+    palette = sys.argv[3] if len(sys.argv) > 3 else 'default'
     if (numbaskets < 2):
         print "Error: number of baskets is less than 2."
         exit(1)
-    classColorCondlist = genclassColorCondlist(filename, numbaskets, nomin=True)
+    classColorCondlist = genclassColorCondlist(filename, numbaskets, nomin=True, palette=palette)
     genSimMap("26916", classColorCondlist, filename)
 
     # print getRGBList(5)
@@ -223,6 +570,7 @@ def main():
 if __name__ == '__main__':
     if (len(sys.argv) < 2):
         print "Require Arg1: the mapfile name without postfix.\n" + \
-              "        Arg2: the number of quantile baskets."
+              "        Arg2: the number of quantile baskets.\n" + \
+              "        Arg3: (optional) the palette, default or results."
         exit(1)
     main()
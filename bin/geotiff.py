@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""Export profile of the GeoTIFFs published as SimMaps.
+
+The published maps are written tiled and DEFLATE compressed with a
+predictor chosen per value type (horizontal differencing for integers,
+floating-point prediction for floats), and carry internal overviews so
+zoomed out views do not read the full resolution raster. Mostly zero
+layers (cross, interstates, the _change results) shrink by orders of
+magnitude.
+
+The creation options are applied by r.out.gdal. The overviews are
+added, and other files rewritten, through the GDAL Python bindings, or
+through the gdalinfo, gdal_translate and gdaladdo tools when the
+bindings are not installed. With neither, publishing fails rather than
+uploading uncompressed maps without overviews.
+"""
+import os
+import re
+import sys
+import subprocess
+from parameters import GTIFFCREATEOPTS, GTIFFOVERVIEWS
+
+
+def _gdal():
+    """The osgeo.gdal module, None if the bindings are not installed."""
+    try:
+        from osgeo import gdal
+    except ImportError:
+        return None
+    return gdal
+
+
+def _gdaltool(args):
+    """Run a GDAL command line tool, return its standard output."""
+    try:
+        return subprocess.check_output(args, stderr=subprocess.STDOUT)
+    except OSError:
+        raise RuntimeError('%s: neither the GDAL Python bindings (osgeo) nor '
+                           'the GDAL command line tools are installed' % args[0])
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError('%s failed on %s: %s' % (args[0], args[-1], e.output))
+
+
+def _gdalinfo(tifname):
+    """What optimizegtiff needs to know of a GeoTIFF, parsed from the
+       output of gdalinfo: dict of xsize, ysize, valuetype, colortable,
+       compressed, tiled and hasoverviews.
+    """
+    text = _gdaltool(['gdalinfo', tifname])
+    size = re.search(r'^Size is (\d+), (\d+)', text, re.M)
+    band = re.search(r'^Band 1 Block=(\d+)x(\d+) Type=(\w+)', text, re.M)
+    if size is None or band is None:
+        raise RuntimeError('unable to open GeoTIFF ' + tifname)
+    band1 = text[band.start():].split('\nBand ')[0]
+    return dict(xsize=int(size.group(1)), ysize=int(size.group(2)),
+                valuetype=band.group(3),
+                colortable='Color Table' in band1,
+                compressed=re.search(r'^\s*COMPRESSION=DEFLATE', text, re.M) is not None,
+                tiled=int(band.group(2)) > 1,
+                hasoverviews='Overviews:' in band1)
+
+
+def isfloattype(valuetype):
+    """True for the GDAL floating-point types (Float32, Float64...)."""
+    return valuetype.startswith('Float') or valuetype.startswith('CFloat')
+
+
+def gtiffcreateopts(valuetype, predictor=True):
+    """GTiff creation options of the export profile for a GDAL type.
+       @inputs: valuetype (str): the GDAL type name, e.g. 'UInt16', 'Float64'
+                predictor (bool): False for palette indices, which gain
+                                  nothing from differencing.
+       @output: list of 'NAME=VALUE' strings, as taken by r.out.gdal
+                createopt and gdal Create/CreateCopy.
+    """
+    opts = list(GTIFFCREATEOPTS)
+    if predictor:
+        opts.append('PREDICTOR=%d' % (3 if isfloattype(valuetype) else 2))
+    return opts
+
+
+def overviewresampling(valuetype):
+    """Overview resampling of a GDAL type: classes and counts keep their
+       values (NEAREST), continuous floating-point maps are averaged.
+    """
+    return 'AVERAGE' if isfloattype(valuetype) else 'NEAREST'
+
+
+def buildoverviews(tifname, valuetype=None, predictor=True):
+    """Add internal, DEFLATE compressed overviews to a GeoTIFF.
+       valuetype defaults to the type of the first band.
+    """
+    gdal = _gdal()
+    if gdal is None:
+        info = _gdalinfo(tifname)
+        if valuetype is None:
+            valuetype = info['valuetype']
+        levels = [str(l) for l in GTIFFOVERVIEWS
+                  if min(info['xsize'], info['ysize']) / l > 0]
+        if levels:
+            args = ['gdaladdo', '-q', '-r', overviewresampling(valuetype).lower(),
+                    '--config', 'COMPRESS_OVERVIEW', 'DEFLATE']
+            if predictor:
+                args += ['--config', 'PREDICTOR_OVERVIEW',
+                         '3' if isfloattype(valuetype) else '2']
+            _gdaltool(args + [tifname] + levels)
+        return
+    ds = gdal.Open(tifname, gdal.GA_Update)
+    if ds is None:
+        raise RuntimeError('unable to open GeoTIFF ' + tifname)
+    if valuetype is None:
+        valuetype = gdal.GetDataTypeName(ds.GetRasterBand(1).DataType)
+    gdal.SetConfigOption('COMPRESS_OVERVIEW', 'DEFLATE')
+    if predictor:
+        gdal.SetConfigOption('PREDICTOR_OVERVIEW', '3' if isfloattype(valuetype) else '2')
+    try:
+        levels = [l for l in GTIFFOVERVIEWS
+                  if min(ds.RasterXSize, ds.RasterYSize) / l > 0]
+        if levels and ds.BuildOverviews(overviewresampling(valuetype), levels):
+            raise RuntimeError('unable to build overviews of ' + tifname)
+    finally:
+        gdal.SetConfigOption('COMPRESS_OVERVIEW', None)
+        gdal.SetConfigOption('PREDICTOR_OVERVIEW', None)
+        ds = None # closes the file
+
+
+def optimizegtiff(tifname):
+    """Bring a GeoTIFF to the export profile before it is uploaded.
+       Files already tiled and compressed (exportRaster, genPaletteRaster)
+       only get their missing overviews; others, e.g. the GLUC results,
+       are rewritten in place.
+    """
+    gdal = _gdal()
+    if gdal is None:
+        info = _gdalinfo(tifname)
+        valuetype = info['valuetype']
+        predictor = not info['colortable']
+        compressed, tiled = info['compressed'], info['tiled']
+        hasoverviews = info['hasoverviews']
+        ds = None
+    else:
+        ds = gdal.Open(tifname)
+        if ds is None:
+            raise RuntimeError('unable to open GeoTIFF ' + tifname)
+        band = ds.GetRasterBand(1)
+        valuetype = gdal.GetDataTypeName(band.DataType)
+        predictor = band.GetColorTable() is None
+        compressed = ds.GetMetadata('IMAGE_STRUCTURE').get('COMPRESSION') == 'DEFLATE'
+        tiled = band.GetBlockSize()[1] > 1
+        hasoverviews = band.GetOverviewCount() > 0
+
+    if not (compressed and tiled):
+        tmpname = tifname + '.tmp.tif'
+        opts = gtiffcreateopts(valuetype, predictor)
+        if gdal is None:
+            args = ['gdal_translate', '-q', '-of', 'GTiff']
+            for opt in opts:
+                args += ['-co', opt]
+            _gdaltool(args + [tifname, tmpname])
+        else:
+            out = gdal.GetDriverByName('GTiff').CreateCopy(tmpname, ds, 0, opts)
+            if out is None:
+                raise RuntimeError('unable to compress GeoTIFF ' + tifname)
+            out = None
+            ds = None
+        os.rename(tmpname, tifname)
+        hasoverviews = False
+    ds = None
+    if not hasoverviews:
+        buildoverviews(tifname, valuetype, predictor)
+
+
+def main():
+    for tifname in sys.argv[1:]:
+        before = os.path.getsize(tifname)
+        optimizegtiff(tifname)
+        print tifname, before, '->', os.path.getsize(tifname)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print "Require Arg1: the GeoTIFF file(s) to be compressed."
+        exit(1)
+    main()
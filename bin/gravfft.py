@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Fast approximate preview of the center gravity maps (pop_att, emp_att).
+
+The exact maps sum, over the center classes, pop/(tt+30)^2 where tt is
+the r.multicost travel time from the buffered centers of the class, null
+(0) beyond maxtime (cities.py). The preview replaces the travel time by
+the distance beyond the buffer times the overland time per meter of the
+cell (overlandTravelTime30, i.e. the landcover speed, or the road speed
+on road cells):
+
+    att(x) = sum_c w_c / (max(d(x,c) - BUFFERDIST, 0)*rate(x) + 30)^2
+
+with each center c weighted by w_c, the population of its class shared
+between the centers of the class. For a fixed rate this is a single
+convolution of the center weight raster with a distance decay kernel,
+done with FFTs. The rates are spread over GRAVFFTLEVELS log-spaced
+levels, and each cell interpolates between the convolutions of the two
+levels around its rate. Each level only reaches as far as its rate
+allows within maxtime, at most GRAVFFTRADIUS; the levels are convolved
+one at a time, so no more than two convolutions are held. A preview
+takes seconds instead of a multicost run per class. deviation()
+measures how far it is from the exact layer on a reference region.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from multicost import _readmap, _writemap
+from parameters import GRAVFFTLEVELS, GRAVFFTRADIUS
+
+BUFFERDIST = 180 # meters, as in cities.py
+
+
+def fftsize(n):
+    """Smallest size >= n with only 2, 3 and 5 as factors (fast FFT)."""
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m //= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def gravity_kernel(radius, res, rate, maxtime):
+    """The distance decay 1/(tt+30)^2 over the (2*radius+1)^2 offsets of
+       cells of size res, tt = max(d - BUFFERDIST, 0)*rate, 0 beyond maxtime.
+    """
+    off = np.arange(-radius, radius+1) * float(res)
+    d = np.hypot(off[:, None], off[None, :])
+    tt = np.maximum(d - BUFFERDIST, 0.0) * rate
+    return np.where(tt <= maxtime, 1.0/(tt + 30.0)**2, 0.0)
+
+
+def fftconvolve(grid, kernel, transformed=None):
+    """'same' size convolution of grid with an odd sized, centered kernel.
+       transformed, the (padded shape, transform of grid) returned by an
+       earlier call, is reused when the padded shape is the same.
+       @output: (the convolution, (padded shape, transform of grid))
+    """
+    nrows, ncols = grid.shape
+    kr, kc = kernel.shape[0]//2, kernel.shape[1]//2
+    shape = (fftsize(nrows + 2*kr), fftsize(ncols + 2*kc))
+    if transformed is None or transformed[0] != shape:
+        transformed = (shape, np.fft.rfft2(grid, shape))
+    product = np.fft.rfft2(kernel, shape)
+    product *= transformed[1]
+    conv = np.fft.irfft2(product, shape)[kr:kr+nrows, kc:kc+ncols].copy()
+    return conv, transformed
+
+
+def approx_gravity(weights, rates, res, maxtime=180.0, levels=GRAVFFTLEVELS,
+                   maxradius=GRAVFFTRADIUS):
+    """Approximate gravity surface.
+       Unlike the exact maps, which take for each class the travel time
+       to its nearest center only, the preview sums w_c/(tt+30)^2 over
+       every center. With the class population shared between its
+       centers, the two agree where the centers of a class are about
+       equally far; near one center of a spread out class the preview
+       is lower, as that center only brings its share. Read the numbers
+       of deviation() with this in mind.
+       @inputs: weights (2-D array): population weight of the center cells
+                rates (2-D array): minutes per meter of each cell, NaN for
+                                   null cells (they take the fastest rate)
+                res (float): cell size (meters)
+                maxtime (float): the max travel time of the exact maps
+                levels (int): number of rates convolved
+                maxradius (float): longest reach of the kernels (meters)
+       @output: 2-D float64 array
+    """
+    valid = rates[np.isfinite(rates) & (rates > 0)]
+    if not len(valid) or not weights.any():
+        return np.zeros(weights.shape)
+    rmin, rmax = valid.min(), valid.max()
+    rates = np.where(np.isfinite(rates) & (rates > 0), rates, rmin)
+    levels = max(int(levels), 1) if rmax > rmin else 1
+    steps = np.log(rmin) + np.arange(levels) * \
+            ((np.log(rmax) - np.log(rmin)) / max(levels - 1, 1))
+
+    # linear interpolation in log(rate) between the two levels around it
+    if levels > 1:
+        pos = np.clip((np.log(rates) - steps[0]) / (steps[1] - steps[0]), 0, levels - 1)
+        low = np.minimum(pos.astype(np.int64), levels - 2)
+        frac = pos - low
+    out = np.zeros(weights.shape)
+    transformed = previous = None
+    for l, step in enumerate(steps):
+        # the kernel reaches maxtime at the rate of the level, within
+        # maxradius and the grid
+        rate = np.exp(step)
+        radius = int(np.ceil((maxtime/rate + BUFFERDIST) / res))
+        radius = min(radius, int(np.ceil(maxradius / res)), max(weights.shape))
+        conv, transformed = fftconvolve(weights, gravity_kernel(radius, res, rate, maxtime),
+                                        transformed)
+        if levels == 1:
+            out = conv
+        elif l > 0:
+            here = low == l - 1
+            out[here] = (1 - frac[here])*previous[here] + frac[here]*conv[here]
+        previous = conv
+    return np.maximum(out, 0.0) # FFT round off around 0
+
+
+############################ GRASS interface ############################
+def center_weights(grass, cities, colname, region):
+    """Raster of the center weights of the current region: each center
+       carries the average colname of its class (as in cities.py) divided
+       by the number of centers of the class.
+    """
+    out = grass.read_command('v.out.ascii', input=cities, fs='|',
+                             columns='CLASS,%s' % colname)
+    if out is None:
+        raise RuntimeError('unable to export the centers ' + cities)
+    rows = [line.split('|') for line in out.splitlines() if line]
+    table = np.array([[r[0], r[1], r[-2], r[-1]] for r in rows], dtype=str)
+    grid = np.zeros((int(region['rows']), int(region['cols'])))
+    if not len(table):
+        return grid
+    x, y = table[:, 0].astype(np.float64), table[:, 1].astype(np.float64)
+    classes, index = np.unique(table[:, 2].astype(np.int64), return_inverse=True)
+    counts = np.bincount(index)
+    averages = np.bincount(index, weights=table[:, 3].astype(np.int64)) // counts
+    weight = averages[index] / counts[index]
+
+    col = np.floor((x - region['w']) / region['ewres']).astype(np.int64)
+    row = np.floor((region['n'] - y) / region['nsres']).astype(np.int64)
+    ok = (row >= 0) & (row < grid.shape[0]) & (col >= 0) & (col < grid.shape[1])
+    np.add.at(grid, (row[ok], col[ok]), weight[ok])
+    return grid
+
+
+def gravity_preview(grass, cities, output, colname='POP2010',
+                    overland='overlandTravelTime30', maxtime='180',
+                    levels=GRAVFFTLEVELS):
+    """Write the approximate gravity map of the cities vector to output
+       on the current region (e.g. pop_att_fft for pop_att).
+    """
+    region = grass.region()
+    tmpdir = tempfile.mkdtemp(prefix='gravfft_')
+    try:
+        rates = _readmap(grass, overland, tmpdir) / region['nsres']
+        weights = center_weights(grass, cities, colname, region)
+        att = approx_gravity(weights, rates, region['nsres'], float(maxtime), levels)
+        _writemap(grass, att, output, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return output
+
+
+def deviation(grass, approx, exact, refregion=None):
+    """Compare the preview with the exact layer on a saved region
+       (refregion, the current region if None).
+       @output: dict of the mean and max absolute error, the mean
+                relative error over the cells where exact > 0, and the
+                correlation of the two maps.
+    """
+    override = os.environ.get('WIND_OVERRIDE')
+    if refregion is not None:
+        os.environ['WIND_OVERRIDE'] = refregion # this process only
+    tmpdir = tempfile.mkdtemp(prefix='gravfft_')
+    try:
+        a = np.nan_to_num(_readmap(grass, approx, tmpdir))
+        e = np.nan_to_num(_readmap(grass, exact, tmpdir))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        if override is not None: # back to the region in use before
+            os.environ['WIND_OVERRIDE'] = override
+        elif refregion is not None:
+            del os.environ['WIND_OVERRIDE']
+    err = np.abs(a - e)
+    pos = e > 0
+    corr = np.corrcoef(a.ravel(), e.ravel())[0, 1] if a.std() and e.std() else np.nan
+    return {'meanabs': float(err.mean()), 'maxabs': float(err.max()),
+            'meanrel': float((err[pos] / e[pos]).mean()) if pos.any() else 0.0,
+            'corr': float(corr)}
+
+
+def main():
+    sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
+    import grass.script as grass
+    cities, colname, output = sys.argv[1:4]
+    gravity_preview(grass, cities, output, colname)
+    if len(sys.argv) > 4:
+        refregion = sys.argv[5] if len(sys.argv) > 5 else None
+        for key, value in sorted(deviation(grass, output, sys.argv[4], refregion).items()):
+            print key, ": ", value
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print "Require Arg1: centers vector, Arg2: population column, Arg3: output,\n" + \
+              "        Arg4: (optional) exact layer to compare with, e.g. pop_att,\n" + \
+              "        Arg5: (optional) saved reference region of the comparison.\n" + \
+              "Runs in the current GRASS session."
+        exit(1)
+    main()
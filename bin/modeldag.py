@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+"""Incremental, dependency-aware execution of the model steps.
+
+Each step of runMulticostModel is a Node: the maps it produces, the
+base inputs it reads (GRASS rasters and vectors, rule files), the nodes
+it depends on, the parameter values it uses, the function producing it
+and the modules of the code it runs. Before a run, every node gets a
+fingerprint that hashes its name, its parameters, the stamps of its
+base inputs (size and modification time of the GRASS map files, content
+hash of the other files), the source of its modules and the
+fingerprints of the nodes it depends on. A change (e.g. a new centers
+shapefile or a fix in sfarecode.py) therefore changes the fingerprints
+of the affected subgraph only. A node whose fingerprint is the one
+recorded by its last successful run, with all its outputs still in the
+mapset, is skipped. The layers it published then are queued again
+instead of being recomputed.
+
+With one worker the nodes run one after the other in this process.
+With more, each node runs as soon as its dependencies are done, in a
+child process of its own with a temporary mapset (cities.create_mapsets
+and enter_mapset), so the region, WIND_OVERRIDE and the scratch maps of
+the steps never collide. The maps a node leaves in its mapset are
+copied back to the mapset of the run when it ends.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import traceback
+from multiprocessing import Process, Queue
+from Queue import Empty
+import cities
+from cities import create_mapsets, enter_mapset, drop_mapsets
+from Utils import createdirectorynotexist
+from parameters import MODELDAGSTATE, MODELDAGWORKERS
+
+HASHCHUNK = 1 << 20
+POLLSECONDS = 5 # how often dead child processes are looked for
+
+_published = None # layers published by the node running in this process
+
+
+class Node:
+    """A step of the model.
+       @inputs: name (str): unique node name
+                func (callable): produces the outputs, no arguments
+                outputs (list of str): the raster maps it produces
+                deps (list of str): the nodes it depends on
+                rasters, vectors (list of str): base GRASS inputs
+                files (list of str): base input files (SFA rules...)
+                params (dict): the parameter values it uses
+                code (list of str): the modules it runs, besides the one
+                                    of func
+    """
+    def __init__(self, name, func, outputs, deps=(), rasters=(), vectors=(),
+                 files=(), params=None, code=()):
+        self.name, self.func, self.outputs = name, func, list(outputs)
+        self.deps, self.rasters, self.vectors = list(deps), list(rasters), list(vectors)
+        self.files, self.params, self.code = list(files), params or {}, list(code)
+
+
+def published():
+    """The list exportAllforms queues the published layers to: the list
+       of the node run by this process, None outside of a node.
+    """
+    return _published
+
+
+def _filestamp(fname):
+    """Content hash of a file, '' if it does not exist."""
+    if not os.path.exists(fname):
+        return ''
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASHCHUNK), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _codestamp(modname):
+    """Content hash of the source of a module."""
+    module = sys.modules.get(modname) or __import__(modname)
+    fname = getattr(module, '__file__', '')
+    if fname.endswith(('.pyc', '.pyo')):
+        fname = fname[:-1]
+    return _filestamp(fname)
+
+
+def _mapstamp(grass, name, element):
+    """Stamp of a GRASS map: size and mtime of its files."""
+    found = grass.find_file(name, element=element)
+    if not found['name']:
+        raise RuntimeError('input map %s not found' % name)
+    mapsetdir = os.path.dirname(os.path.dirname(found['file']))
+    if element == 'cell':
+        fnames = [found['file'], os.path.join(mapsetdir, 'cellhd', found['name']),
+                  os.path.join(mapsetdir, 'fcell', found['name'])]
+    else:
+        fnames = [os.path.join(found['file'], 'coor'),
+                  os.path.join(mapsetdir, 'dbf', found['name'] + '.dbf')]
+    stamps = []
+    for fname in fnames:
+        if os.path.exists(fname):
+            st = os.stat(fname)
+            stamps.append('%s:%d:%d' % (os.path.basename(fname), st.st_size, st.st_mtime))
+    return '%s@%s %s' % (found['name'], found['mapset'], ' '.join(stamps))
+
+
+def toposort(nodes):
+    """The nodes in dependency order; raises on cycles and unknown deps."""
+    byname = dict((n.name, n) for n in nodes)
+    order, state = [], {}
+    def visit(node):
+        if state.get(node.name) == 'done':
+            return
+        if state.get(node.name) == 'visiting':
+            raise RuntimeError('dependency cycle at node ' + node.name)
+        state[node.name] = 'visiting'
+        for dep in node.deps:
+            if dep not in byname:
+                raise RuntimeError('node %s depends on unknown node %s' % (node.name, dep))
+            visit(byname[dep])
+        state[node.name] = 'done'
+        order.append(node)
+    for node in nodes:
+        visit(node)
+    return order
+
+
+def fingerprints(grass, nodes):
+    """node name -> fingerprint, see the module doc."""
+    prints = {}
+    for node in toposort(nodes):
+        h = hashlib.sha1()
+        h.update(node.name)
+        h.update(getattr(node.func, '__name__', repr(node.func)))
+        for modname in [node.func.__module__] + node.code:
+            h.update(modname + _codestamp(modname))
+        h.update(repr(sorted(node.params.items())))
+        for name in node.rasters:
+            h.update(_mapstamp(grass, name, 'cell'))
+        for name in node.vectors:
+            h.update(_mapstamp(grass, name, 'vector'))
+        for fname in node.files:
+            h.update(fname + _filestamp(fname))
+        for dep in sorted(node.deps):
+            h.update(prints[dep])
+        prints[node.name] = h.hexdigest()
+    return prints
+
+
+def loadstate(statename=MODELDAGSTATE):
+    try:
+        with open(statename, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def savestate(state, statename=MODELDAGSTATE):
+    createdirectorynotexist(statename)
+    tmpname = '%s.%d' % (statename, os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.rename(tmpname, statename)
+
+
+def _runnode(node):
+    """Run a node in this process.
+       @output: (the layers it published, seconds)
+    """
+    global _published
+    _published = []
+    start = time.time()
+    try:
+        node.func()
+        return _published, time.time() - start
+    finally:
+        _published = None
+
+
+def _childnode(node, gisenv, mapset, results, childinit):
+    """Child process body: run a node in its temporary mapset, sending
+       its log messages and its result to the parent.
+    """
+    send = lambda msg: results.put(('log', node.name, msg))
+    start = time.time()
+    try:
+        gisrc = enter_mapset(gisenv, mapset)
+        try:
+            if childinit is not None:
+                childinit(send)
+            layers, seconds = _runnode(node)
+        finally:
+            os.remove(gisrc)
+        results.put(('done', node.name, layers, seconds, None))
+    except Exception:
+        results.put(('done', node.name, [], time.time() - start, traceback.format_exc()))
+
+
+def _copyback(grass, mapset):
+    """Copy the maps of a temporary mapset to the mapset of the run."""
+    for maptype in ('rast', 'vect'):
+        names = grass.read_command('g.mlist', type=maptype, mapset=mapset)
+        for name in (names or '').split():
+            if grass.run_command('g.copy', quiet=True,
+                                 **{maptype: '%s@%s,%s' % (name, mapset, name)}):
+                raise RuntimeError('unable to copy %s@%s' % (name, mapset))
+
+
+def _skipped(grass, nodes, prints, state, force):
+    """The names of the nodes that are unchanged, and so are all their
+       dependencies, with their outputs and published files in place.
+    """
+    skip = set()
+    for node in toposort(nodes):
+        recorded = state.get(node.name, {})
+        if not force and recorded.get('fingerprint') == prints[node.name] \
+           and all(dep in skip for dep in node.deps) \
+           and all(grass.find_file(out, element='cell')['name'] for out in node.outputs) \
+           and all(os.path.exists('Data/%s.tif' % p['name']) for p in recorded.get('published', [])):
+            skip.add(node.name)
+    return skip
+
+
+def execute(grass, nodes, publishqueue, log=None, republish=None,
+            workers=MODELDAGWORKERS, statename=MODELDAGSTATE, force=False,
+            childinit=None):
+    """Run the nodes whose fingerprint changed, see the module doc.
+       @inputs: publishqueue (list): where the layers published by the
+                                     nodes (ran or skipped) are queued
+                log (callable): progress messages, e.g. runlog.p
+                republish (callable): the queue entry of a layer published
+                                      by a skipped node, from the recorded
+                                      one (e.g. with the url of this run)
+                workers (int): nodes run at once, each in a child process
+                               if more than one
+                force (bool): run every node
+                childinit (callable): called first in each child process
+                                      with a function sending a message to
+                                      log, e.g. to route the log of the
+                                      steps through the parent
+       @output: (names of the nodes run, names of the nodes skipped)
+       Raises the first error of a node, after the running ones end.
+    """
+    log = log or (lambda msg: None)
+    republish = republish or dict
+    prints = fingerprints(grass, nodes)
+    state = loadstate(statename)
+    skip = _skipped(grass, nodes, prints, state, force)
+    for node in toposort(nodes):
+        if node.name in skip:
+            for layer in state[node.name].get('published', []):
+                publishqueue.append(republish(layer))
+            log("--%s unchanged, skipped" % node.name)
+
+    def finish(node, layers, seconds):
+        publishqueue.extend(layers)
+        done.add(node.name)
+        state[node.name] = {'fingerprint': prints[node.name], 'published': layers}
+        savestate(state, statename)
+        log("--%s done in %ds" % (node.name, seconds))
+
+    done = set(skip)
+    pending = [n for n in toposort(nodes) if n.name not in skip]
+    if max(workers, 1) == 1 or len(pending) <= 1:
+        for node in pending:
+            log("--%s......" % node.name)
+            try:
+                layers, seconds = _runnode(node)
+            except Exception as e:
+                log("--%s failed: %s" % (node.name, e))
+                raise
+            finish(node, layers, seconds)
+        return [n.name for n in pending], sorted(skip)
+
+    cities.use_session()
+    gisenv = grass.gisenv()
+    running = {} # name -> (node, process, mapset directory)
+    results = Queue()
+    error = None
+    try:
+        while pending or running:
+            if error is None:
+                for node in list(pending):
+                    if len(running) >= workers:
+                        break
+                    if all(dep in done for dep in node.deps):
+                        pending.remove(node)
+                        mapset = 'dag_' + node.name
+                        path, = create_mapsets(gisenv, [mapset])
+                        sys.stdout.flush() # or the child writes it again
+                        sys.stderr.flush()
+                        proc = Process(target=_childnode,
+                                       args=(node, gisenv, mapset, results, childinit))
+                        running[node.name] = (node, proc, path)
+                        log("--%s......" % node.name)
+                        proc.start()
+            if not running:
+                if pending and error is None:
+                    raise RuntimeError('nodes cannot run: ' + ', '.join(n.name for n in pending))
+                break
+            try:
+                msg = results.get(timeout=POLLSECONDS)
+            except Empty:
+                for name, (node, proc, path) in running.items():
+                    if not proc.is_alive() and results.empty():
+                        msg = ('done', name, [], 0, 'exited with code %s' % proc.exitcode)
+                        break
+                else:
+                    continue
+            if msg[0] == 'log':
+                log(msg[2])
+                continue
+            name, layers, seconds, e = msg[1:]
+            node, proc, path = running.pop(name)
+            proc.join()
+            try:
+                if e is None:
+                    _copyback(grass, os.path.basename(path))
+            finally:
+                drop_mapsets([path])
+            if e is not None:
+                error = error or RuntimeError('node %s failed: %s' % (name, e))
+                log("--%s failed after %ds: %s" % (name, seconds, e))
+                continue
+            finish(node, layers, seconds)
+    finally:
+        for node, proc, path in running.values():
+            proc.terminate()
+            proc.join()
+            drop_mapsets([path])
+    if error is not None:
+        raise error
+    return [n for n in done if n not in skip], sorted(skip)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""NumPy travel time engine mirroring the r.multicost GRASS add-on.
+
+r.multicost spreads a cumulative cost from the start cells over two cost
+layers: the overland travel time (input) and the interstate travel time
+(m2). Moves stay within a layer, except at crossover cells (xover != 0)
+where a move may switch layers at no cost. As in r.cost, moves are
+8-connected. An orthogonal move costs the mean of the two cell costs and a
+diagonal move costs that mean times sqrt(2). Null cost cells cannot be
+entered, and cells farther than max_cost stay null. Each output cell
+holds the smaller cost of its two layers.
+
+The search is a bucket (Dial) queue with bucket width set to the smallest
+cell cost, which is a lower bound on any move within a layer. Every label
+in the current bucket is then final, so a whole bucket is expanded at
+once with vectorised NumPy operations. The zero-cost crossovers are
+closed within the bucket. The result is exact, not an approximation.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from bil import openbil, writebil
+from parameters import MULTICOSTENGINE
+
+SQRT2 = np.sqrt(2.0)
+# (row offset, column offset, distance factor) of the 8 neighbours
+MOVES = [(-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0),
+         (-1, -1, SQRT2), (-1, 1, SQRT2), (1, -1, SQRT2), (1, 1, SQRT2)]
+
+
+def multicost(cost1, cost2, xover, start, maxcost=None):
+    """Cumulative travel cost from the start cells over two cost layers.
+       @inputs: cost1, cost2 (2-D float arrays): cost per cell of each
+                        layer (e.g. overlandTravelTime30, intTravelTime30),
+                        NaN for the null cells.
+                xover (2-D array): non-zero where the layers connect
+                start (2-D bool array): the start cells
+                maxcost (float): stop at this cost, None for no limit
+       @output: 2-D float64 array of the cumulative cost, NaN where the
+                cost is null or above maxcost.
+    """
+    nrows, ncols = cost1.shape
+    costs = [np.asarray(cost1, dtype=np.float64).ravel(),
+             np.asarray(cost2, dtype=np.float64).ravel()]
+    passable = [~np.isnan(c) for c in costs]
+    cross = np.flatnonzero(np.asarray(xover).ravel() != 0)
+    crossmask = np.zeros(nrows*ncols, dtype=bool)
+    crossmask[cross] = True
+    rows = np.arange(nrows*ncols) // ncols
+    limit = np.inf if maxcost is None else float(maxcost)
+
+    if any((c[p] <= 0).any() for c, p in zip(costs, passable)):
+        raise ValueError('multicost: cell costs must be positive')
+    # the bucket width, no move within a layer costs less
+    width = min([c[p].min() for c, p in zip(costs, passable) if p.any()] or [1.0])
+
+    dist = [np.full(nrows*ncols, np.inf) for c in costs]
+    done = [np.zeros(nrows*ncols, dtype=bool) for c in costs]
+    buckets = {}
+
+    def push(layer, idx, values):
+        if len(idx) == 0:
+            return
+        keys = (values / width).astype(np.int64)
+        order = np.argsort(keys, kind='mergesort')
+        keys, idx = keys[order], idx[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for k, part in zip(keys[np.r_[0, bounds]], np.split(idx, bounds)):
+            buckets.setdefault(k, ([], []))[layer].append(part)
+
+    startidx = np.flatnonzero(np.asarray(start).ravel())
+    for layer in (0, 1):
+        idx = startidx[passable[layer][startidx]]
+        dist[layer][idx] = 0.0
+        push(layer, idx, dist[layer][idx])
+
+    while buckets:
+        k = min(buckets)
+        pending = buckets.pop(k)
+        if k*width > limit:
+            break
+        frontier = []
+        for layer in (0, 1):
+            idx = np.unique(np.concatenate(pending[layer])) if pending[layer] \
+                  else np.zeros(0, dtype=np.int64)
+            # lazy deletion: skip settled cells and labels that improved since
+            idx = idx[~done[layer][idx]]
+            idx = idx[(dist[layer][idx] / width).astype(np.int64) == k]
+            frontier.append(idx)
+
+        # zero-cost layer switches at the crossover cells
+        for layer in (0, 1):
+            other = 1 - layer
+            idx = frontier[layer][crossmask[frontier[layer]]]
+            idx = idx[passable[other][idx] & ~done[other][idx]]
+            better = dist[layer][idx] < dist[other][idx]
+            dist[other][idx[better]] = dist[layer][idx[better]]
+        for layer in (0, 1):
+            other = 1 - layer
+            idx = frontier[layer][crossmask[frontier[layer]]]
+            idx = idx[passable[other][idx] & ~done[other][idx]]
+            frontier[other] = np.union1d(frontier[other], idx)
+
+        for layer in (0, 1):
+            idx = frontier[layer]
+            if len(idx) == 0:
+                continue
+            done[layer][idx] = True
+            cost, here = costs[layer], dist[layer][idx]
+            for dr, dc, fac in MOVES:
+                nb = idx + dr*ncols + dc
+                ok = (nb >= 0) & (nb < nrows*ncols)
+                ok[ok] &= rows[nb[ok]] == rows[idx[ok]] + dr # no wrap around rows
+                src, nb, base = idx[ok], nb[ok], here[ok]
+                ok = passable[layer][nb] & ~done[layer][nb]
+                src, nb, base = src[ok], nb[ok], base[ok]
+                new = base + (cost[src] + cost[nb]) / 2.0 * fac
+                ok = (new < dist[layer][nb]) & (new <= limit)
+                nb, new = nb[ok], new[ok]
+                if len(nb) == 0:
+                    continue
+                np.minimum.at(dist[layer], nb, new)
+                push(layer, nb, dist[layer][nb])
+
+    out = np.minimum(dist[0], dist[1])
+    out[~np.isfinite(out) | (out > limit)] = np.nan
+    return out.reshape(nrows, ncols)
+
+
+############################ GRASS interface ############################
+def _readmap(grass, layername, tmpdir):
+    """Export a raster of the current region into a float64 array, NaN
+       for null cells.
+    """
+    bilname = os.path.join(tmpdir, layername.replace('@', '_') + '.bil')
+    if grass.run_command('r.out.gdal', input=layername, output=bilname,
+                         format='EHdr', type='Float64', nodata=-1, quiet=True):
+        raise RuntimeError('unable to export raster map ' + layername)
+    header, arr = openbil(bilname)
+    arr = np.array(arr, dtype=np.float64)
+    arr[arr == -1] = np.nan
+    return arr
+
+
+def _writemap(grass, arr, layername, tmpdir):
+    """Import a float array of the current region as a raster map, NaN
+       for null cells.
+    """
+    region = grass.region()
+    bilname = os.path.join(tmpdir, layername + '_out.bil')
+    writebil(bilname, np.where(np.isnan(arr), -1.0, arr),
+             region['w'] + region['ewres']/2.0, region['n'] - region['nsres']/2.0,
+             region['ewres'], region['nsres'], nodata=-1)
+    if grass.run_command('r.in.gdal', flags='o', input=bilname, output=layername,
+                         quiet=True):
+        raise RuntimeError('unable to import raster map ' + layername)
+
+
+def r_multicost(grass, input, m2, xover, start_rast, output, max_cost=None):
+    """Drop-in replacement of
+       grass.run_command('r.multicost', input=, m2=, xover=, start_rast=,
+                         output=, max_cost=)
+       computed by multicost() on the current region.
+       @inputs: grass: the grass.script module of the session
+    """
+    tmpdir = tempfile.mkdtemp(prefix='multicost_')
+    try:
+        cost1 = _readmap(grass, input, tmpdir)
+        cost2 = _readmap(grass, m2, tmpdir)
+        cross = np.nan_to_num(_readmap(grass, xover, tmpdir))
+        start = ~np.isnan(_readmap(grass, start_rast, tmpdir))
+        out = multicost(cost1, cost2, cross, start, max_cost)
+        _writemap(grass, out, output, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return output
+
+
+def run_multicost(grass, input, m2, xover, start_rast, output, max_cost=None,
+                  engine=MULTICOSTENGINE):
+    """Run r.multicost ('grass') or its NumPy version ('numpy').
+       Raises RuntimeError on failure.
+    """
+    if engine == 'numpy':
+        return r_multicost(grass, input, m2, xover, start_rast, output, max_cost)
+    if grass.run_command('r.multicost', input=input, m2=m2, xover=xover,
+            start_rast=start_rast, output=output, max_cost=max_cost):
+        raise RuntimeError('unable to compute travel cost ' + output)
+    return output
+
+
+def validate(grass, input, m2, xover, start_rast, max_cost=None):
+    """Run r.multicost and multicost() on the same inputs and return the
+       (max absolute difference, number of cells null in only one of them).
+    """
+    tmpdir = tempfile.mkdtemp(prefix='multicost_')
+    try:
+        if grass.run_command('r.multicost', input=input, m2=m2, xover=xover,
+                start_rast=start_rast, output='multicost_ref', max_cost=max_cost):
+            raise RuntimeError('r.multicost failed')
+        ref = _readmap(grass, 'multicost_ref', tmpdir)
+        grass.run_command('g.remove', rast='multicost_ref')
+        cost1 = _readmap(grass, input, tmpdir)
+        cost2 = _readmap(grass, m2, tmpdir)
+        cross = np.nan_to_num(_readmap(grass, xover, tmpdir))
+        start = ~np.isnan(_readmap(grass, start_rast, tmpdir))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    out = multicost(cost1, cost2, cross, start, max_cost)
+    both = ~np.isnan(ref) & ~np.isnan(out)
+    diff = np.abs(ref[both] - out[both]).max() if both.any() else 0.0
+    return diff, int((np.isnan(ref) != np.isnan(out)).sum())
+
+
+def main():
+    sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
+    import grass.script as grass
+    maxcost = sys.argv[5] if len(sys.argv) > 5 else None
+    diff, nullmismatch = validate(grass, *sys.argv[1:5], max_cost=maxcost)
+    print "max abs difference: ", diff
+    print "cells null in only one output: ", nullmismatch
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print "Require Arg1: input cost map, Arg2: m2 cost map, Arg3: xover map,\n" + \
+              "        Arg4: start raster, Arg5: (optional) max cost.\n" + \
+              "Compares r.multicost with the NumPy engine in the current GRASS session."
+        exit(1)
+    main()
@@ -4,11 +4,21 @@ import sys
 import time
 sys.path += ['..']
 from glob import iglob
+from multiprocessing import Pool, cpu_count
 from leamsite import LEAMsite
 from parameters import *
-from genSimMap import genSimMap, genclassColorCondlist
-from genSimMap_results import genSimMap_results, genclassColorCondlist_results
+from genSimMap import genSimMaps
 from weblog import RunLog
+from bil import openbil
+from Utils import AsciiGridHeader, writesidecar
+from geotiff import gtiffcreateopts, buildoverviews, optimizegtiff
+import cities
+from cities import cityattractors, enter_mapset, create_mapsets, drop_mapsets
+from multicost import run_multicost
+from distbuffer import bufferAttractions
+from sfarecode import sfascore
+from probmap import fused_probmaps
+from modeldag import Node, execute, published
 
 """Organized from original LEAM attrmap.make and probmap.make.
    TODO: merge basic GRASS functions to the grasssetup.py.
@@ -49,10 +59,13 @@ def exportRaster(layername, valuetype='Float64', enlarge=False): #'UInt16'
             grass.mapcalc("%s%s=if(%s, %s*%i)"%(layername, str(multiplier), layername, layername, multiplier))
             layername = layername+str(multiplier)
     
+    # tiled, compressed GeoTIFF with overviews, see geotiff.py
     outfilename = 'Data/'+layername+'.tif'
     if grass.run_command('r.out.gdal', input=layername, 
-      output=outfilename, type=valuetype, quiet=True):
+      output=outfilename, type=valuetype, createopt=gtiffcreateopts(valuetype),
+      quiet=True):
         raise RuntimeError('unable to export raster map ' + layername )
+    buildoverviews(outfilename, valuetype)
 
     return layername # in caseo enlarge == True, layername may be modified
 
@@ -74,8 +87,59 @@ def export_asciimap(layername, nullval=-1, integer=False):
             raise RuntimeError('unable to export ascii map ' + layername)
 
 
+def export_npymap(layername, valuetype='Float64'):
+    """Export a raster layer into a binary .npy sidecar with a .json header
+       (extent, nodata, min/max) next to 'Data/'+layername+'.txt'.
+       The layer is written once through r.out.gdal EHdr and memory mapped,
+       so the values and the valuetype are preserved exactly.
+       @param: layername (str)     the raster layer name.
+               valuetype (str)     the GDAL type, same as exportRaster.
+    """
+    bilname = 'Data/'+layername+'.bil'
+    if valuetype.startswith('Float') or valuetype.startswith('Int'):
+        nodata = -1 # same null value as export_asciimap
+    else:
+        nodata = {'Byte': 255, 'UInt16': 65535, 'UInt32': 4294967295}[valuetype]
+    if grass.run_command('r.out.gdal', input=layername, output=bilname,
+      format='EHdr', type=valuetype, nodata=nodata, quiet=True):
+        raise RuntimeError('unable to export binary map ' + layername)
+
+    bil, arr = openbil(bilname)
+    header = AsciiGridHeader(bil.ncols, bil.nrows, bil.ulx - bil.xdim/2.0,
+        bil.uly - bil.ydim*(bil.nrows-0.5), bil.xdim, nodata)
+    writesidecar('Data/'+layername+'.txt', arr, header)
+    del arr
+    for ext in ('.bil*', '.hdr', '.prj', '.stx'):
+        for f in iglob('Data/'+layername+ext):
+            os.remove(f)
+
+
+def publishSimMaps(layers, site, regioncode=CHICAGOREGIONCODE):
+    """Publish a batch of raster maps .tif to the website. The .map files
+       of all layers are generated in one pass by genSimMaps.
+       @ inputs: layers (list of dict) the layers as described in genSimMaps,
+                       plus 'url' (the folder url to be published to) and
+                       'description' (shown for each map on the website)
+                 site (str) the website to be published to.
+                 regioncode (int) the epsg region code. Chicago is 26196.
+    """
+    mapfiles = genSimMaps(layers, regioncode)
+    for layer, mapfile in zip(layers, mapfiles):
+        maptitle = layer['name']
+        if layer.get('indexed', SIMMAPINDEXED):
+            simmap = 'Data/%s_idx.tif' % maptitle # palette raster of genPaletteRaster
+        else:
+            simmap = 'Data/%s.tif' % maptitle
+        optimizegtiff(simmap) # no-op but for the overviews of exportRaster outputs
+        popattrurl = site.putSimMap("%s.tif" % maptitle, "%s.map" % maptitle, layer['url'],
+            simmap_file=open(simmap, 'rb'), 
+            mapfile_file=open(mapfile, 'rb'))
+        site.updateSimMap(popattrurl, title=maptitle, description=layer.get('description', ''))
+
+
 def publishSimMap(maptitle, site, url, description='', nomin=False, nomax=False,
-                  numcolors=NUMCOLORS, regioncode=CHICAGOREGIONCODE, flag=0):
+                  numcolors=NUMCOLORS, regioncode=CHICAGOREGIONCODE, flag=0, sketch=False,
+                  indexed=SIMMAPINDEXED):
     """Publish the raster map .tif to the website.
        @ inputs: maptitle (str) the output map name
                  description (str) the description to be shown for each map on the website
@@ -84,36 +148,47 @@ def publishSimMap(maptitle, site, url, description='', nomin=False, nomax=False,
                  numcolors (int) the number of colors to be assigned to the map
                        the actual number of colors may be less than expected
                  regioncode (int) the epsg region code. Chicago is 26196.
+                 flag (int) 0 for the default palette, 1 for the results palette
+                 sketch (bool) use approximate quantile colors (floating-point maps)
+                 indexed (bool) publish a pre-classified Byte palette raster
     """
-    simmap  = 'Data/%s.tif' % maptitle
-    mapfile = 'Outputs/%s.map' % maptitle
-    
-    if flag == 0:
-        classColorCondlist = genclassColorCondlist(maptitle, numcolors, nomin, nomax)
-        genSimMap(regioncode, classColorCondlist, maptitle)
-    else:
-        classColorCondlist_results = genclassColorCondlist_results(maptitle, numcolors, nomin, nomax)
-        genSimMap_results(regioncode, classColorCondlist_results, maptitle)
-    
-    popattrurl = site.putSimMap("%s.tif" % maptitle, "%s.map" % maptitle, url,
-        simmap_file=open(simmap, 'rb'), 
-        mapfile_file=open(mapfile, 'rb'))
-    site.updateSimMap(popattrurl, title=maptitle, description=description)
+    publishSimMaps([dict(name=maptitle, url=url, description=description,
+                         nomin=nomin, nomax=nomax, numcolors=numcolors, sketch=sketch,
+                         indexed=indexed,
+                         palette='results' if flag else 'default')],
+                   site, regioncode)
+
 
+# layers exported by exportAllforms waiting to be published by flushSimMaps
+publishqueue = []
 
-def exportAllforms(maplayer, valuetype='Float64', description='', enlarge=True, nomin=False, nomax=False):
+def flushSimMaps():
+    """Publish all the layers queued by exportAllforms in one batch."""
+    global publishqueue
+    layers, publishqueue = publishqueue, []
+    if layers:
+        publishSimMaps(layers, site)
+
+
+def exportAllforms(maplayer, valuetype='Float64', description='', enlarge=True, nomin=False, nomax=False,
+                   sketch=False):
     """ Float64 has the most accurate values. However, Float64
         is slow in processing the map to show in browser. 'UInt16' 
-        is the best.
+        is the best. sketch=True colors Float maps from an approximate
+        quantile sketch instead of sorting the whole map.
+        The layer is queued and published by the next flushSimMaps.
     """
     maplayer = exportRaster(maplayer, valuetype, enlarge)
     if valuetype == 'UInt16':
         export_asciimap(maplayer, integer=True)
     else:
         export_asciimap(maplayer)
+    export_npymap(maplayer, valuetype) # read by genSimMap in place of the .txt
         
-    #wrap file into details folder
-    publishSimMap(maplayer, site, resultsdir+"/details", description, nomin, nomax)
+    #wrap file into details folder, or into the layers of the modeldag node
+    queue = published()
+    (publishqueue if queue is None else queue).append(dict(name=maplayer, url=resultsdir+"/details",
+        description=description, nomin=nomin, nomax=nomax, sketch=sketch))
 
 ################## Fucntions for centers and travel time maps #################
 ######  Required files in GRASS: otherroadsBase, landcover ########
@@ -199,34 +274,77 @@ def genintTravelTime30():
 ################# Multicost to Travel Time On Roads Model ###################
 ##### this function is a sample to be used in cities.py #####
 def multicost4travelcost(centersMap, outputname, maxcostmin):
-    grass.run_command('r.multicost', input="overlandTravelTime30", 
+    run_multicost(grass, input="overlandTravelTime30", 
         m2="intTravelTime30", xover="cross", start_rast=centersMap, 
         output=outputname, max_cost=maxcostmin)
     exportRaster(outputname)
 
 ################## Caculate Roads Attraction #################################
 ######  Required files in GRASS: otherroads #########
-def roadsTravelCost(roadsClassName_list=[('staterd', 2), ('county', 3), ('road', 4), ('ramp', 6)]):
-    """This takes about 3min.
+def _travelcost_worker(args):
+    """Pool worker: in its temporary mapset, make the start map of a
+       travel cost from a r.mapcalc expression over the maps of the run,
+       then run r.multicost.
+       @output: the travel cost map name qualified with its mapset
     """
-    for layername, classnum in roadsClassName_list:
-        start = time.time()
-        outname = str(layername)+"_cost"
-        runlog.p("***caculating %s......" % outname)
-        grass.mapcalc('centers=if(otherroads==' + str(classnum) + ',1,null())')
-        grass.run_command('r.multicost', input="overlandTravelTime30",
-            m2="intTravelTime30", xover="cross", start_rast="centers", 
+    gisenv, mapset, outname, startexpr = args
+    gisrc = enter_mapset(gisenv, mapset)
+    try:
+        grass.mapcalc('start=' + startexpr)
+        run_multicost(grass, input="overlandTravelTime30",
+            m2="intTravelTime30", xover="cross", start_rast="start",
             output=outname)
-        exportAllforms(outname, 'UInt16')
-        print outname," takes ", time.time()-start,"s."
-
-
-def intersectionTravelCost(layername="intersect_cost"):
+        return '%s@%s' % (outname, mapset)
+    finally:
+        os.remove(gisrc)
+
+
+def parallelTravelCosts(jobs, processes=TRAVELCOSTWORKERS):
+    """Run independent r.multicost travel costs at once, each in its own
+       temporary mapset, and yield each output name as soon as it is
+       copied back to the mapset of the run, so it can be exported while
+       the others still run.
+       @inputs: jobs (list of (output name, start map r.mapcalc expression))
+                processes (int): 0 uses every core, 1 runs in place
+    """
+    processes = min(processes or cpu_count(), len(jobs))
+    if processes <= 1:
+        for outname, startexpr in jobs:
+            grass.mapcalc('start=' + startexpr)
+            run_multicost(grass, input="overlandTravelTime30",
+                m2="intTravelTime30", xover="cross", start_rast="start",
+                output=outname)
+            grass.run_command('g.remove', rast='start')
+            yield outname
+        return
+
+    cities.use_session()
+    gisenv = grass.gisenv()
+    mapsets = create_mapsets(gisenv, ['tmp_' + outname for outname, startexpr in jobs])
+    try:
+        pool = Pool(processes)
+        try:
+            tasks = [(gisenv, 'tmp_' + outname, outname, startexpr)
+                     for outname, startexpr in jobs]
+            for costmap in pool.imap_unordered(_travelcost_worker, tasks):
+                outname = costmap.split('@')[0]
+                if grass.run_command('g.copy', rast='%s,%s' % (costmap, outname)):
+                    raise RuntimeError('unable to copy ' + costmap)
+                yield outname
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        drop_mapsets(mapsets)
+
+
+def genintersection():
     """Finds state #2 and county #3 road  intersections.  Create a map of
        just state and county roads. Expand these locations by one cell and
        then thin them down to one cell (to take care of any small map errors).
        Then find cells that are surrounded by more than two cells containing
        roads.
+       @output map: intersection
     """
     grass.run_command('g.region', res=30)
     grass.mapcalc('int1=if((otherroads==2) || (otherroads==3), 1, 0)')
@@ -237,11 +355,28 @@ def intersectionTravelCost(layername="intersect_cost"):
             int2[ 0,-1]           +int2[ 0,1]+ \
             int2[ 1,-1]+int2[ 1,0]+int2[ 1,1]) ,1,0))')
     grass.run_command('r.null', map='intersection', setnull=0)
-    
-    grass.run_command('r.multicost', input="overlandTravelTime30",
-            m2="intTravelTime30", xover="cross", start_rast="intersection", 
-            output=layername)
-    grass.run_command('g.remove', rast=["int1","int2", "intersection"])
+    grass.run_command('g.remove', rast=["int1","int2"])
+
+
+def transportTravelCosts(roadsClassName_list=[('staterd', 2), ('county', 3), ('road', 4), ('ramp', 6)],
+                         intersectname="intersect_cost", processes=TRAVELCOSTWORKERS):
+    """Travel cost to each road class and to the state and county road
+       intersections: the five travel costs share their inputs and run
+       at once, each exported as soon as it is done. Takes about the time
+       of the slowest one. The exports are uploaded together by the next
+       flushSimMaps, as one genSimMaps batch.
+    """
+    start = time.time()
+    genintersection()
+    jobs = [(str(layername)+"_cost", 'if(otherroads==%d,1,null())' % classnum)
+            for layername, classnum in roadsClassName_list]
+    jobs.append((intersectname, 'intersection'))
+    try:
+        for outname in parallelTravelCosts(jobs, processes):
+            exportAllforms(outname, 'UInt16')
+            print outname," done after ", time.time()-start,"s."
+    finally:
+        grass.run_command('g.remove', rast="intersection")
 
 
 def transportAttraction(layername="transport_att"):
@@ -254,16 +389,18 @@ def transportAttraction(layername="transport_att"):
 
 ##################### Water and Forest Attraction ########################
 ######  Required files in GRASS: landcover #########
+def classcondstr(classes):
+    return "(" + " || ".join(["landcover==%d" % c for c in classes]) + ")"
 def watercondstr():
-    return "(landcover==11)"
+    return classcondstr(WATERCLASSES)
 def forestcondstr():
     """41=deciduous forest, 42=evergreen forest, 43=mixed forest, 91=woody wetland"""
-    return "(landcover==41 || landcover==42 || landcover==43 || landcover==91)"
+    return classcondstr(FORESTCLASSES)
 def bufferAttraction(layername, layercond_str):
     grass.mapcalc('int1=if' + layercond_str)
     grass.run_command('r.buffer', flags='z', input='int1', output='int2',
-       distances=[30,60,90,120,150,180,210,240,270,300,330,360])
-    grass.mapcalc(layername+'=if(isnull(int2),390,(int2-1)*30)')
+       distances=BUFFERRINGS)
+    grass.mapcalc(layername+'=if(isnull(int2),%d,(int2-1)*30)' % BUFFERCAP)
     grass.run_command('g.remove', rast=["int1","int2"])
 
 ##################### Slope Attraction ########################
@@ -284,6 +421,9 @@ def cost2score(costname, scorename):
        @input: attractiveness map without _cost
        @output: result score map name
     """
+    if SFAENGINE == 'numpy': # recode and r.null in one pass
+        return sfascore(grass, costname+'_cost', scorename+"_score",
+                        GRAPHS+"/"+scorename+".sfa", nullzero=True)
     grass.run_command('r.recode', input=costname+'_cost', output=scorename+"_score", 
                                   rules="SFA/"+scorename+".sfa")
     # Setting to null so that there won't be weird values appear
@@ -296,10 +436,14 @@ def att2score_centers(attname, scorename):
        @input: attractiveness map without _att
        @output: result score map name
     """
-    grass.run_command('r.recode', input=attname+"_att", output=scorename+"_score", 
-                                  rules="SFA/"+scorename+".sfa")
     weight = WEIGHTS[scorename]
-    grass.mapcalc('%s_score=pow(%s_score,%f)' %(scorename, scorename, weight))
+    if SFAENGINE == 'numpy': # recode and pow in one pass
+        sfascore(grass, attname+"_att", scorename+"_score",
+                 GRAPHS+"/"+scorename+".sfa", weight=weight)
+    else:
+        grass.run_command('r.recode', input=attname+"_att", output=scorename+"_score", 
+                                      rules="SFA/"+scorename+".sfa")
+        grass.mapcalc('%s_score=pow(%s_score,%f)' %(scorename, scorename, weight))
     export_asciimap(scorename+"_score")
     return scorename+"_score"
 
@@ -329,91 +473,204 @@ def genProbmap(centerscorelist, costscorelist, problayername, multiplier=100000)
     grass.run_command('g.remove', rast=score)
 
 ##################### Main Functions to be called ######################
-def gencentersAttmaps(empcenters, popcenters):
-    # pop/emp centers attractive maps require landTravelTime30 and intTravelTime30
+def stepotherroads():
     runlog.p("--generate otherroads, the raster form of roadnetwork......")
     genotherroads()
     exportAllforms('otherroads', 'UInt16', nomin=True) # otherroads have road class 1-6
-    
+
+def stepinterstates():
     runlog.p("--generate interstatesBase, the interstates roads (class 1) extracted from roadnetwork......")
     geninterstatesBaseAndinterstates()
     exportAllforms('interstates', 'UInt16', nomin=True)
-    
+
+def stepcross():
     runlog.p("--generate cross, the intersection of interstates and ramps......")
     gencross()
     exportAllforms('cross', 'UInt16')     # cross has values either 0 or 1
-    
+
+def stepoverlandTravelTime30():
     runlog.p("--generate overlandTravelTime30, the travel time cost per cell, "
                "using landuse map and landuse type speed table......")
     genoverlandTravelTime30()
-    exportAllforms('overlandTravelTime30')# overlandTravelTime30 is (0, 1) 
-    
+    exportAllforms('overlandTravelTime30', sketch=True)# overlandTravelTime30 is (0, 1) 
+
+def stepintTravelTime30():
     runlog.p("--generate intTravelTime30, the travel time cost per cell, "
                "using the 'CLASS' and 'SPEED' values in roadnetwork map......") 
     genintTravelTime30()                  # intTravelTime30 has one uniq value
     exportAllforms('intTravelTime30', 'UInt16')
 
-    runlog.p("--generate population centers attractive map using cross, "
+def steppopcenters(popcenters=POPCENTERS):
+    # the attractive (grav) and travelcost (cost) maps of the centers
+    # share one travel time map per center class
+    runlog.p("--generate population centers attractive and travelcost maps using cross, "
                "overlandTravelTime30, intTravelTime30, and population centers......")
-    os.system("python bin/cities.py -p total_pop -n pop -m grav popcentersBase > Log/popatt.log")
+    cityattractors(popcenters, 'pop', 'total_pop', ['grav', 'cost'])
     exportAllforms("pop_att", 'UInt16', nomin=True)
-
-    runlog.p("--generate population centers travelcost map......")
-    os.system("python bin/cities.py -p total_pop -n pop -m cost popcentersBase > Log/popcost.log")
     exportAllforms("pop_cost", 'UInt16', nomax=True)
 
-    runlog.p("--generate employment centers attractive map using cross, "
+def stepempcenters(empcenters=EMPCENTERS):
+    runlog.p("--generate employment centers attractive and travelcost maps using cross, "
                "overlandTravelTime30, intTravelTime30, and employment centers......")
-    os.system("python bin/cities.py -p total_emp -n emp -m grav empcentersBase > Log/empatt.log")
+    cityattractors(empcenters, 'emp', 'total_emp', ['grav', 'cost'])
     exportAllforms("emp_att", 'UInt16', nomin=True)
-
-    runlog.p("--generate employment centers travelcost map......")
-    os.system("python bin/cities.py -p total_emp -n emp -m cost empcentersBase > Log/empcost.log")
     exportAllforms("emp_cost", 'UInt16', nomax=True)
 
-def genOtherAttmaps():
+def gencentersAttmaps(empcenters, popcenters):
+    # pop/emp centers attractive maps require landTravelTime30 and intTravelTime30
+    stepotherroads()
+    stepinterstates()
+    stepcross()
+    stepoverlandTravelTime30()
+    stepintTravelTime30()
+    steppopcenters(popcenters)
+    stepempcenters(empcenters)
+
+ROADSCLASSNAME_LIST = [('staterd', 2), ('county', 3), ('road', 4), ('ramp', 6)]
+
+def steptransportcosts():
     # print "--generate staterd, county, road, and ramp attractiveness..."
-    runlog.p("--generate travel cost map for each road class type except for interstates......")
-    roadsClassName_list = [('staterd', 2), ('county', 3), ('road', 4), ('ramp', 6)]    
-    roadsTravelCost(roadsClassName_list)
-    
-    runlog.p("--generate intersection travel cost map......")
-    intersectionTravelCost()
-    exportAllforms("intersect_cost", 'UInt16')
+    runlog.p("--generate travel cost map for each road class type except for interstates, "
+             "and the intersection travel cost map......")
+    transportTravelCosts(ROADSCLASSNAME_LIST, "intersect_cost")
 
+def steptransportattraction():
     runlog.p("--generate transport attraction map using statered_cost, "
                "county_cost, road_cost, ramp_cost, and intersect_cost......")
     transportAttraction()
     exportAllforms("transport_att", 'UInt16', nomin=True)
-    
-    runlog.p("--generate water travelcost map......")
-    bufferAttraction("water_cost", watercondstr())
-    exportAllforms("water_cost", 'UInt16')
 
-    runlog.p("--generate forest travelcost map......")
-    bufferAttraction("forest_cost", forestcondstr())
+def stepwaterforest():
+    if BUFFERENGINE == 'numpy':
+        runlog.p("--generate water and forest travelcost maps......")
+        bufferAttractions(grass, [("water_cost", WATERCLASSES),
+                                  ("forest_cost", FORESTCLASSES)])
+    else:
+        runlog.p("--generate water travelcost map......")
+        bufferAttraction("water_cost", watercondstr())
+        runlog.p("--generate forest travelcost map......")
+        bufferAttraction("forest_cost", forestcondstr())
+    exportAllforms("water_cost", 'UInt16')
     exportAllforms("forest_cost", 'UInt16')
 
+def stepslope():
     runlog.p("--generate slope travelcost map......")
     genslopeCost()
     exportAllforms("slope_cost", 'UInt16', nomin=True)
 
+def genOtherAttmaps():
+    steptransportcosts()
+    steptransportattraction()
+    stepwaterforest()
+    stepslope()
+
 
 def genProbmaps():
+    if PROBMAPENGINE == 'fused':
+        runlog.p("--generate probmap_com and probmap_res, the probabiltiy maps for commertial "
+                 "and residential developement, and their _percentage maps in one pass......")
+        fused_probmaps(grass, [('probmap_com', COMSCORELIST, 10000000), # probcom has -07 values
+                               ('probmap_res', RESSCORELIST, 100000)], COSTSCORELIST)
+        for att, scorename in COMSCORELIST + RESSCORELIST: # as att2score_centers
+            export_asciimap(scorename + "_score")
+        for problayername in ('probmap_com', 'probmap_res'):
+            exportRaster(problayername, 'Float32')
+            exportAllforms(problayername + '_percentage', nomin=True, sketch=True)
+        return
+
     runlog.p("--generate probmap_com, the probabiltiy map for commertial developement, "
                "and output probmap_com_percentage, where all values are 0.01 of probmap_com......")
     genProbmap(COMSCORELIST, COSTSCORELIST, 'probmap_com', 10000000)# probcom has -07 values
     exportRaster('probmap_com', 'Float32')
-    exportAllforms('probmap_com_percentage', nomin=True) 
+    exportAllforms('probmap_com_percentage', nomin=True, sketch=True) 
 
     runlog.p("--generate probmap_res...the probabiltiy map for residential developement, "
              "and output probmap_res_percentage, where all values are 0.01 of probmap_res......")
     genProbmap(RESSCORELIST, COSTSCORELIST, 'probmap_res', 100000)
     exportRaster('probmap_res', 'Float32')
-    exportAllforms('probmap_res_percentage', nomin=True)
+    exportAllforms('probmap_res_percentage', nomin=True, sketch=True)
+
+
+def modelNodes(empcenters, popcenters):
+    """The steps of runMulticostModel as modeldag nodes: what each one
+       produces and reads, the parameters and the modules it depends on.
+       A node is a step rather than a layer where the layers of the step
+       come from one computation: the att and cost maps of the centers
+       share the class travel times, water and forest one distance
+       transform pass, the transport costs one process pool, the two
+       probmaps one fused pass.
+    """
+    travel = dict(MULTICOSTENGINE=MULTICOSTENGINE)
+    centers = dict(travel, CITIESCLIP=CITIESCLIP, CITIESENGINE=CITIESENGINE,
+                   CITIESACCUMTYPE=CITIESACCUMTYPE, CITIESTRAVEL=CITIESTRAVEL,
+                   ROADGRAPHACCESS=ROADGRAPHACCESS, ROADGRAPHSNAP=ROADGRAPHSNAP,
+                   ROADGRAPHCACHEDIR=ROADGRAPHCACHEDIR)
+    centerscode = ['cities', 'multicost', 'roadgraph', 'bil', 'rasterstats']
+    roadnodes = ['cross', 'overlandTravelTime30', 'intTravelTime30']
+    scorefiles = sorted(set(GRAPHS + '/' + scorename + '.sfa'
+                            for att, scorename in COMSCORELIST + RESSCORELIST + COSTSCORELIST))
+    return [
+        Node('otherroads', stepotherroads, ['otherroads'], vectors=['otherroads']),
+        Node('interstates', stepinterstates, ['interstatesBase', 'interstates'],
+             vectors=['otherroads']),
+        Node('cross', stepcross, ['cross'], deps=['otherroads', 'interstates']),
+        Node('overlandTravelTime30', stepoverlandTravelTime30, ['overlandTravelTime30'],
+             deps=['interstates'], rasters=['landcover'], vectors=['otherroads'],
+             files=[GRAPHS + '/lu_speeds.recode']),
+        Node('intTravelTime30', stepintTravelTime30, ['intTravelTime30'],
+             deps=['interstates']),
+        Node('popcenters', lambda: steppopcenters(popcenters), ['pop_att', 'pop_cost'],
+             deps=roadnodes, vectors=[popcenters, 'otherroads'],
+             params=dict(centers, centers=popcenters), code=centerscode),
+        Node('empcenters', lambda: stepempcenters(empcenters), ['emp_att', 'emp_cost'],
+             deps=roadnodes, vectors=[empcenters, 'otherroads'],
+             params=dict(centers, centers=empcenters), code=centerscode),
+        Node('transportcosts', steptransportcosts,
+             [name + '_cost' for name, classnum in ROADSCLASSNAME_LIST] + ['intersect_cost'],
+             deps=['otherroads'] + roadnodes,
+             params=dict(travel, roads=ROADSCLASSNAME_LIST),
+             code=['cities', 'multicost', 'bil']),
+        Node('transport_att', steptransportattraction, ['transport_att'],
+             deps=['transportcosts'],
+             params=dict(W_STATERD=W_STATERD, W_COUNTY=W_COUNTY, W_ROAD=W_ROAD,
+                         W_RAMP=W_RAMP, W_INTERSECT=W_INTERSECT)),
+        Node('waterforest', stepwaterforest, ['water_cost', 'forest_cost'],
+             rasters=['landcover'],
+             params=dict(BUFFERENGINE=BUFFERENGINE, BUFFERRINGS=BUFFERRINGS,
+                         BUFFERCAP=BUFFERCAP, WATERCLASSES=WATERCLASSES,
+                         FORESTCLASSES=FORESTCLASSES),
+             code=['distbuffer', 'bil', 'rasterstats']),
+        Node('slope', stepslope, ['slope_cost'], rasters=['demBase']),
+        Node('probmaps', genProbmaps,
+             ['probmap_com', 'probmap_res', 'probmap_com_percentage', 'probmap_res_percentage'],
+             deps=['popcenters', 'empcenters', 'transport_att', 'waterforest', 'slope'],
+             files=scorefiles,
+             params=dict(WEIGHTS=sorted(WEIGHTS.items()), COMSCORELIST=COMSCORELIST,
+                         RESSCORELIST=RESSCORELIST, COSTSCORELIST=COSTSCORELIST,
+                         PROBMAPENGINE=PROBMAPENGINE, SFAENGINE=SFAENGINE),
+             code=['probmap', 'sfarecode', 'bil', 'rasterstats']),
+    ]
+
+
+class NodeLog:
+    """runlog of a step run in a modeldag child process: the messages go
+       to the log of the run through the parent.
+    """
+    def __init__(self, send):
+        self.send = send
+
+    def p(self, s):
+        self.send(s)
 
+    h = warn = error = debug = p
 
-def runMulticostModel(resultsurl, website, log):
+
+def _nodelog(send):
+    global runlog
+    runlog = NodeLog(send)
+
+
+def runMulticostModel(resultsurl, website, log, force=MODELDAGFORCE):
     global resultsdir
     global site
     global runlog
@@ -422,9 +679,19 @@ def runMulticostModel(resultsurl, website, log):
     runlog = log
     grassConfig('grass', 'model')
 
-    gencentersAttmaps(EMPCENTERS, POPCENTERS)
-    genOtherAttmaps()
-    genProbmaps()
+    if MODELDAG:
+        # only the steps whose inputs changed since the last run
+        execute(grass, modelNodes(EMPCENTERS, POPCENTERS), publishqueue, runlog.p,
+                republish=lambda layer: dict(layer, url=resultsdir+"/details"),
+                force=force, childinit=_nodelog)
+        flushSimMaps()
+    else:
+        gencentersAttmaps(EMPCENTERS, POPCENTERS)
+        flushSimMaps()
+        genOtherAttmaps()
+        flushSimMaps()
+        genProbmaps()
+        flushSimMaps()
 
 
 def main():
@@ -3,8 +3,59 @@
 NUMCOLORS = 15
 CHICAGOREGIONCODE = "26916" #epsg
 SIMMAPHEADER = "./Inputs/simMapheader.txt"
+SIMMAPWORKERS = 4 # processes classifying the layers of one genSimMaps batch
+# content-addressed cache of the classified .map files (simmapcache.py);
+# point it outside the scenario folder to keep it across runs.
+SIMMAPCACHEDIR = "./Cache/simmap"
+SIMMAPCACHESIZE = 64*1024*1024 # bytes, least recently used entries evicted
+# publish the maps as pre-classified Byte palette rasters with a class-free
+# .map file instead of the raw values with one class expression per color.
+SIMMAPINDEXED = False
+# GeoTIFF export profile of the published maps (geotiff.py); the PREDICTOR
+# option is added per value type.
+GTIFFCREATEOPTS = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                   'COMPRESS=DEFLATE', 'ZLEVEL=6']
+GTIFFOVERVIEWS = [2, 4, 8, 16, 32] # internal overview levels
+
+############################ cities.py ###############################
+CITIESWORKERS = 0 # center classes run at once (r.multicost), 0 = all cores
+MAPCALCMAXMAPS = 64 # class maps folded into the outputs per r.mapcalc
+# run r.multicost of each class in a region clipped to the cells reachable
+# within the max travel time (same result, much smaller search grid)
+CITIESCLIP = True
+# how the class travel times are folded into the _att/_cost outputs:
+# 'mapcalc' (one r.mapcalc per batch of classes) or 'numpy' (streamed
+# blocks, each output written once); 'float64' accumulators give the
+# same values as 'mapcalc', 'float32' halves their memory and I/O but
+# differs in the last digits (~5e-8 relative)
+CITIESENGINE = 'numpy'
+CITIESACCUMTYPE = 'float64'
+# travel time engine of cities.py and multicostModel.py: 'grass' runs the
+# r.multicost add-on, 'numpy' the same computation in multicost.py (no
+# add-on needed, see multicost.py to compare both on a GRASS location).
+MULTICOSTENGINE = 'grass'
+# travel time of each center class: 'raster' (r.multicost, as set by
+# MULTICOSTENGINE) or 'graph' (shortest paths on the otherroads network
+# plus an overland access leg, see roadgraph.py)
+CITIESTRAVEL = 'raster'
+
+############################ roadgraph.py ############################
+ROADGRAPHCACHEDIR = "./Cache/roadgraph"
+# road vertices closer than this (meters) are one node (v.in.ogr snap)
+ROADGRAPHSNAP = 0.01
+# max number of cell moves over land from the roads and the centers
+ROADGRAPHACCESS = 34 # ~1 km at 30 m
+
+############################# gravfft.py #############################
+# overland rates convolved by the gravity preview, more is closer to
+# the distance decay of each cell but one more FFT each
+GRAVFFTLEVELS = 8
+# longest reach (meters) of the preview kernels: the FFTs are padded by
+# it, so it bounds their memory; the exact maps reach further on roads
+GRAVFFTRADIUS = 20000
 
 ######################### multicostModel.py #########################
+TRAVELCOSTWORKERS = 0 # road class travel costs run at once, 0 = all cores
 
 ##ROADS WEIGHT##
 W_STATERD=float(3000)
@@ -40,10 +91,43 @@ EMPCENTERS = 'empcentersBase'
 POPCENTERS = 'popcentersBase'
 
 GRAPHS="./SFA"
+# score maps from the SFA rules: 'numpy' (sfarecode.py, one pass with the
+# r.null/pow steps) or 'grass' (r.recode)
+SFAENGINE = 'numpy'
+# 'fused' computes both probmaps and their _percentage maps in one pass
+# over the attraction and cost layers (probmap.py), 'mapcalc' runs
+# genProbmap with one r.mapcalc per score
+PROBMAPENGINE = 'fused'
+# weight sweeps (weightsweep.py): worker processes (0 = all cores) and
+# weight sets evaluated together on each row block
+SWEEPWORKERS = 0
+SWEEPBATCH = 16
+# runMulticostModel through modeldag.py: only the steps whose inputs or
+# parameters changed since the last run (recorded in MODELDAGSTATE) are
+# computed again, MODELDAGWORKERS of them at once. With more than one
+# worker, each step runs in a process and temporary mapset of its own
+MODELDAG = True
+MODELDAGSTATE = "./Cache/modeldag.json"
+MODELDAGWORKERS = 1
+MODELDAGFORCE = False # run every step, ignoring MODELDAGSTATE
 
 ##BUFFER SIZE##
 # interstates buffer to generate cross = 60
-# water and forest buffer = 30,60,90,120,150,180,210,240,270,300,330,360
+# water and forest buffer rings (meters) and the cost beyond the last ring
+BUFFERRINGS = [30,60,90,120,150,180,210,240,270,300,330,360]
+BUFFERCAP = 390
+WATERCLASSES = [11]
+FORESTCLASSES = [41, 42, 43, 91] # deciduous, evergreen, mixed forest, woody wetland
+# 'numpy' (distbuffer.py, one read of landcover) or 'grass' (r.buffer)
+BUFFERENGINE = 'numpy'
 
 ######################### genYearChangemap.py #########################
-DEMANDGRAPH ='gluc/Data/demand.graphs'
\ No newline at end of file
+DEMANDGRAPH ='gluc/Data/demand.graphs'
+
+######################### rasterstats.py #########################
+# memory (bytes) for the row blocks read at once when computing
+# raster statistics; lower it to process larger regions.
+STATSMEMBUDGET = 64*1024*1024
+# relative error of the quantile sketch used for the color breaks
+# of floating-point maps (genclassColorCondlist(..., sketch=True)).
+SKETCHALPHA = 0.01
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Fused evaluation of the probmaps (genProbmap).
+
+genProbmap sets probmap=1.0 and multiplies it by one score map at a
+time, each score map made by r.recode with its SFA rules (and r.null or
+pow), then writes the _percentage map in another pass. Here every
+attraction and cost layer is exported once and streamed in row blocks,
+the scores are recoded in the block (sfarecode.py), and each block of
+every probmap and its _percentage map is written once. The cost scores
+(COSTSCORELIST) are the same for the residential and the commercial
+probmaps, so they are read and recoded once for both. The products are
+taken in the order of genProbmap. As with cost2score and
+att2score_centers, every <score>_score map is written too (CELL for the
+cost scores of CELL layers, DCELL otherwise), and the probmaps and their
+_percentage maps are DCELL, as made by r.mapcalc.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+from rasterstats import blockrows
+from sfarecode import NODATA, load_table, score, exportlayer, createlayer, importlayer
+from parameters import GRAPHS, WEIGHTS, STATSMEMBUDGET
+
+
+def fused_probmaps(grass, probmaps, costscorelist, membudget=STATSMEMBUDGET):
+    """Compute several probmaps sharing their cost scores in one pass.
+       @inputs: probmaps (list of (problayername, centerscorelist,
+                          multiplier)), e.g.
+                          [('probmap_com', COMSCORELIST, 10000000),
+                           ('probmap_res', RESSCORELIST, 100000)]
+                costscorelist (list of (costname, scorename)), see genProbmap
+       @output: the names of the probmaps; each comes with a
+                <problayername>_percentage map. The <score>_score maps of
+                the scores are written as well.
+    """
+    # (input layer, score name, nullzero, weight) of the shared and own
+    # scores, as cost2score and att2score_centers
+    costs = [(cost + '_cost', scorename, True, None)
+             for cost, scorename in costscorelist]
+    centers = [[(att + '_att', scorename, False, WEIGHTS[scorename])
+                for att, scorename in centerscorelist]
+               for problayername, centerscorelist, multiplier in probmaps]
+    components = []
+    for component in costs + sum(centers, []):
+        if component not in components:
+            components.append(component)
+    layers = sorted(set(c[0] for c in components))
+    integer = dict((layer, grass.raster_info(layer)['datatype'] == 'CELL')
+                   for layer in layers)
+
+    tmpdir = tempfile.mkdtemp(prefix='probmap_')
+    try:
+        inputs = dict((layer, exportlayer(grass, layer,
+                       os.path.join(tmpdir, layer + '.bil'))) for layer in layers)
+        outputs = []
+        for problayername, centerscorelist, multiplier in probmaps:
+            for name in (problayername, problayername + '_percentage'):
+                bilname = os.path.join(tmpdir, name + '_out.bil')
+                outputs.append((name, bilname, createlayer(grass, bilname)))
+        scoremaps = {}
+        for component in components:
+            layer, scorename, nullzero, weight = component
+            # r.recode keeps a CELL input CELL, the pow of the centers is DCELL
+            dtype = 'int32' if integer[layer] and weight is None else 'float64'
+            bilname = os.path.join(tmpdir, scorename + '_score_out.bil')
+            scoremaps[component] = (scorename + '_score', bilname,
+                                    createlayer(grass, bilname, dtype))
+
+        nrows, ncols = inputs[layers[0]].shape
+        step = blockrows(ncols, 8, len(layers) + 2*len(components) + 2*len(probmaps) + 2,
+                         membudget)
+        for r in xrange(0, nrows, step):
+            blocks = {}
+            for layer in layers:
+                block = np.array(inputs[layer][r:r+step], dtype=np.float64)
+                block[block == NODATA] = np.nan
+                blocks[layer] = block
+
+            scores = {}
+            for component in components:
+                layer, scorename, nullzero, weight = component
+                scores[component] = score(blocks[layer],
+                    load_table(GRAPHS + '/' + scorename + '.sfa'), nullzero, weight,
+                    integer[layer])
+                out = scoremaps[component][2]
+                out[r:r+step] = np.where(np.isnan(scores[component]), NODATA,
+                                         scores[component])
+
+            shared = np.ones((min(step, nrows - r), ncols))
+            for component in costs:
+                shared *= scores[component]
+            for i, (problayername, centerscorelist, multiplier) in enumerate(probmaps):
+                prob = shared.copy()
+                for component in centers[i]:
+                    prob *= scores[component]
+                percentage = prob * multiplier
+                for out, values in ((outputs[2*i][2], prob), (outputs[2*i+1][2], percentage)):
+                    out[r:r+step] = np.where(np.isnan(values), NODATA, values)
+
+        inputs = None
+        outputs += scoremaps.values()
+        for name, bilname, out in outputs:
+            out.flush()
+        for name, bilname, out in outputs:
+            importlayer(grass, bilname, name)
+        outputs = scoremaps = None
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return [problayername for problayername, centerscorelist, multiplier in probmaps]
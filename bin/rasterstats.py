@@ -0,0 +1,336 @@
+"""Bounded-memory raster statistics.
+
+Rasters (the Data/*.txt ascii maps or their .npy sidecars) are walked in
+row blocks whose size is set from a memory budget, so min/max, counts and
+exact integer histograms can be computed for grids much larger than RAM.
+The residential/commercial subsets used by dataanalysis.py are kept as
+histograms rather than as masked copies of the map, and floating-point
+maps can be summarised by an approximate, mergeable QuantileSketch.
+"""
+from itertools import izip
+from collections import namedtuple
+import numpy as np
+from Utils import readasciiheader, readsidecar
+from parameters import STATSMEMBUDGET, SKETCHALPHA
+
+BLOCKCOPIES = 4 # block-sized temporaries (casts, masks) alive at once
+
+GridStats = namedtuple('GridStats', ['count', 'nulls', 'min', 'max', 'sum'])
+
+
+def blockrows(ncols, itemsize=8, nrasters=1, membudget=STATSMEMBUDGET):
+    """Number of rows per block so that nrasters blocks and their
+       temporaries fit in membudget bytes.
+    """
+    return max(1, membudget // (ncols*itemsize*nrasters*BLOCKCOPIES))
+
+
+def _readblocks(fname, nrows, dtype, nullval):
+    """Yield nrows*ncols values at a time from the sidecar of fname if
+       there is one, from the ascii map otherwise.
+    """
+    sidecar = readsidecar(fname)
+    if sidecar is not None:
+        header, arr = sidecar
+        step = nrows*header.ncols
+        for start in xrange(0, len(arr), step):
+            block = np.array(arr[start:start+step], dtype=dtype)
+            if nullval is not None and header.nodata is not None:
+                block[arr[start:start+step] == header.nodata] = nullval
+            yield block
+        return
+
+    with open(fname, 'rb') as f:
+        header = readasciiheader(f)
+        step = nrows*header.ncols
+        while True:
+            block = np.fromfile(f, dtype=dtype, count=step, sep=' ')
+            if len(block) == 0:
+                break
+            if nullval is not None and header.nodata is not None:
+                block[block == header.nodata] = nullval
+            yield block
+
+
+def gridheader(fname):
+    """Return the AsciiGridHeader of fname without reading its values."""
+    sidecar = readsidecar(fname)
+    if sidecar is not None:
+        return sidecar[0]
+    with open(fname, 'rb') as f:
+        return readasciiheader(f)
+
+
+def iterblocks(fnames, dtype=np.float64, nullval=None, membudget=STATSMEMBUDGET):
+    """Walk one or more rasters of the same size in lockstep row blocks.
+       @inputs: fnames (list of str): the ascii maps (sidecars preferred)
+                dtype: the numpy dtype each block is decoded to
+                nullval: if not None, replaces NODATA cells
+                membudget (int): bytes available for the blocks
+       @output: yields a list with one 1-D block per raster
+    """
+    ncols = gridheader(fnames[0]).ncols
+    nrows = blockrows(ncols, np.dtype(dtype).itemsize, len(fnames), membudget)
+    readers = [_readblocks(fname, nrows, dtype, nullval) for fname in fnames]
+    for blocks in izip(*readers):
+        yield list(blocks)
+
+
+def gridstats(fname, nullval=-1, membudget=STATSMEMBUDGET):
+    """Count, min, max and sum of a raster, ignoring cells equal to
+       nullval (the null value of export_asciimap) and NODATA cells.
+       @output: GridStats
+    """
+    count = nulls = 0
+    vmin, vmax, vsum = None, None, 0.0
+    for block, in iterblocks([fname], nullval=nullval, membudget=membudget):
+        valid = block[block != nullval] if nullval is not None else block
+        nulls += len(block) - len(valid)
+        if len(valid) == 0:
+            continue
+        count += len(valid)
+        vsum += valid.sum()
+        bmin, bmax = valid.min(), valid.max()
+        vmin = bmin if vmin is None else min(vmin, bmin)
+        vmax = bmax if vmax is None else max(vmax, bmax)
+    return GridStats(count, nulls, vmin, vmax, vsum)
+
+
+class IntHistogram:
+    """Exact histogram of integer values; counts[i] is the number of
+       cells equal to offset+i. Histograms of blocks are merged with add,
+       so a full raster never has to be held in memory.
+    """
+    def __init__(self, values=None):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        if values is not None:
+            self.add(values)
+
+    def add(self, values):
+        """Add the (integer valued) cells in values to the histogram."""
+        values = np.asarray(values).ravel()
+        if len(values) == 0:
+            return self
+        vmin = int(values.min())
+        counts = np.bincount((values - vmin).astype(np.intp))
+        self._addcounts(vmin, counts)
+        return self
+
+    def merge(self, other):
+        """Add the counts of another IntHistogram."""
+        if len(other.counts):
+            self._addcounts(other.offset, other.counts)
+        return self
+
+    def _addcounts(self, offset, counts):
+        if len(self.counts) == 0:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        lo = min(self.offset, offset)
+        hi = max(self.offset + len(self.counts), offset + len(counts))
+        if lo != self.offset or hi != self.offset + len(self.counts):
+            grown = np.zeros(hi-lo, dtype=np.int64)
+            grown[self.offset-lo:self.offset-lo+len(self.counts)] = self.counts
+            self.offset, self.counts = lo, grown
+        self.counts[offset-lo:offset-lo+len(counts)] += counts
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def values(self):
+        """The unique values, ascending."""
+        return np.flatnonzero(self.counts) + self.offset
+
+    def min(self):
+        return int(self.values()[0])
+
+    def max(self):
+        return int(self.values()[-1])
+
+    def count(self, lo=None, hi=None):
+        """Number of cells with lo <= value < hi; None is unbounded."""
+        lo = 0 if lo is None else min(max(int(lo) - self.offset, 0), len(self.counts))
+        hi = len(self.counts) if hi is None else \
+             min(max(int(hi) - self.offset, 0), len(self.counts))
+        return int(self.counts[lo:hi].sum()) if hi > lo else 0
+
+    def select(self, lo=None, hi=None):
+        """A new histogram of the cells with lo <= value < hi."""
+        h = IntHistogram()
+        start = 0 if lo is None else min(max(int(lo) - self.offset, 0), len(self.counts))
+        stop = len(self.counts) if hi is None else \
+               min(max(int(hi) - self.offset, start), len(self.counts))
+        h.offset, h.counts = self.offset + start, self.counts[start:stop].copy()
+        return h
+
+    def sortedat(self, positions):
+        """Values found at the given indices of the sorted cell values,
+           i.e. np.sort(cells)[positions] without sorting.
+        """
+        cumsum = np.cumsum(self.counts)
+        return np.searchsorted(cumsum, np.asarray(positions), side='right') + self.offset
+
+
+def maskedhistograms(valuefile, maskfile, maskfuncs, nullval=-1,
+                     membudget=STATSMEMBUDGET):
+    """Exact histograms of the (rounded) values of valuefile over the cells
+       selected by each mask, in a single streaming pass over both rasters.
+       @inputs: valuefile (str): the map to be counted, e.g. Data/pop_att.txt
+                maskfile (str): the map the masks are computed from,
+                                e.g. Data/landroadclassmap.txt
+                maskfuncs (dict): name -> function(maskblock) -> bool array;
+                                  None selects every cell.
+       @output: dict name -> IntHistogram
+    """
+    hists = dict((name, IntHistogram()) for name in maskfuncs)
+    for values, classes in iterblocks([valuefile, maskfile], nullval=nullval,
+                                      membudget=membudget):
+        values = values.round().astype(np.int64)
+        for name, func in maskfuncs.items():
+            hists[name].add(values if func is None else values[func(classes)])
+    return hists
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch for non-negative floating-point cells.
+
+    Positive values are counted in logarithmic buckets
+    (gamma^(i-1), gamma^i] with gamma = (1+alpha)/(1-alpha), zeros are
+    counted exactly. Error bound: the value returned for any rank is within
+    a relative error alpha of the exact value at that rank, whatever the
+    distribution, e.g. alpha=0.01 gives breaks within 1% of the exact
+    quantiles. Memory is O(log(max/min)/alpha) buckets, independent of the
+    number of cells, and sketches of separate blocks or tiles are combined
+    with merge.
+
+    The two smallest and the two largest distinct values and their counts,
+    and the unique values (while there are at most UNIQMAX of them) are
+    tracked as well, as getQuantileList needs them.
+    """
+    UNIQMAX = 31
+
+    def __init__(self, alpha=SKETCHALPHA):
+        self.alpha = alpha
+        self.gamma = (1.0 + alpha) / (1.0 - alpha)
+        self.lngamma = np.log(self.gamma)
+        self.buckets = IntHistogram()
+        self.zeros = 0
+        self.low = []    # [(min, count), (second min, count)]
+        self.top = []    # [(max, count), (second max, count)]
+        self.uniq = set()
+
+    def add(self, values):
+        """Add a block of non-negative cells to the sketch."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+        positive = values[values > 0]
+        self.zeros += len(values) - len(positive)
+        if len(positive):
+            self.buckets.add(np.ceil(np.log(positive) / self.lngamma))
+
+        low, rest = [], values
+        for i in xrange(2):
+            if len(rest) == 0:
+                break
+            vmin = rest.min()
+            low.append((vmin, int((rest == vmin).sum())))
+            rest = rest[rest > vmin]
+        self.low = self._extremes(self.low + low, 2, min)
+        top, rest = [], values
+        for i in xrange(2):
+            if len(rest) == 0:
+                break
+            vmax = rest.max()
+            top.append((vmax, int((rest == vmax).sum())))
+            rest = rest[rest < vmax]
+        self.top = self._extremes(self.top + top, 2, max)
+
+        if self.uniq is not None:
+            self.uniq.update(np.unique(values).tolist())
+            if len(self.uniq) > self.UNIQMAX:
+                self.uniq = None
+        return self
+
+    def merge(self, other):
+        """Add the cells summarised by another sketch with the same alpha."""
+        if other.alpha != self.alpha:
+            raise ValueError('cannot merge sketches with different alpha')
+        self.buckets.merge(other.buckets)
+        self.zeros += other.zeros
+        self.low = self._extremes(self.low + other.low, 2, min)
+        self.top = self._extremes(self.top + other.top, 2, max)
+        if self.uniq is not None and other.uniq is not None:
+            self.uniq |= other.uniq
+            if len(self.uniq) > self.UNIQMAX:
+                self.uniq = None
+        else:
+            self.uniq = None
+        return self
+
+    @staticmethod
+    def _extremes(pairs, n, pick):
+        """Sum the counts of equal values and keep the n extreme ones."""
+        counts = {}
+        for v, c in pairs:
+            counts[v] = counts.get(v, 0) + c
+        values = sorted(counts, reverse=(pick is max))[:n]
+        return [(v, counts[v]) for v in values]
+
+    def __len__(self):
+        return self.zeros + len(self.buckets)
+
+    def _bucket(self, value):
+        return int(np.ceil(np.log(value) / self.lngamma))
+
+    def _remove(self, value, count):
+        if value > 0:
+            self.buckets.counts[self._bucket(value) - self.buckets.offset] -= count
+        else:
+            self.zeros -= count
+        if self.uniq is not None:
+            self.uniq.discard(value)
+
+    def removemax(self):
+        """Remove every cell equal to the current maximum (which is
+           known exactly) from the sketch.
+        """
+        vmax, count = self.top.pop(0)
+        self._remove(vmax, count)
+        if self.low and self.low[-1][0] == vmax:
+            self.low.pop()
+
+    def removemin(self):
+        """Remove every cell equal to the current minimum (which is
+           known exactly) from the sketch.
+        """
+        vmin, count = self.low.pop(0)
+        self._remove(vmin, count)
+        if self.top and self.top[-1][0] == vmin:
+            self.top.pop()
+
+    def quantiles(self, positions):
+        """Approximate values at the given indices of the sorted cells,
+           i.e. np.sort(cells)[positions] within a relative error alpha.
+        """
+        positions = np.asarray(positions)
+        cumsum = np.cumsum(self.buckets.counts) + self.zeros
+        idx = np.searchsorted(cumsum, positions, side='right')
+        values = 2.0 * self.gamma**(idx + self.buckets.offset) / (self.gamma + 1.0)
+        values[positions < self.zeros] = 0.0
+        # representatives never lie outside the exact range
+        vmin = self.low[0][0] if self.low else 0.0
+        vmax = self.top[0][0] if self.top else np.inf
+        return np.clip(values, vmin, vmax)
+
+
+def sketchgrid(fname, alpha=SKETCHALPHA, nullval=-1, membudget=STATSMEMBUDGET):
+    """Build a QuantileSketch of the non-negative cells of a raster in
+       one streaming pass (negatives and NODATA are skipped, as mapserver
+       cannot color them).
+    """
+    sketch = QuantileSketch(alpha)
+    for block, in iterblocks([fname], nullval=nullval, membudget=membudget):
+        sketch.add(block[block >= 0])
+    return sketch
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""Center travel times on the road network graph.
+
+Most of the speed of the raster travel time model (overlandTravelTime30,
+intTravelTime30, cross) comes from the road vector otherroads, imported
+from the tdm shapefile with its class and speed columns. This module
+builds a routable graph from that vector once: the line vertices are the
+nodes (shared vertices connect lines, as v.in.ogr snapped them) and each
+segment is an edge costing its length at the road speed (km/h, 0.06*m/speed
+minutes, the 1.8/speed per 30 m cell of genoverlandTravelTime30).
+
+The travel time of a center class is then
+  1. a multi-source shortest path search over the graph, from the nodes
+     within BUFFERDIST of a center (0 min, they lie in the buffered start
+     of r.multicost) and from the node nearest each center (reached over
+     land at the overland time of the center cell),
+  2. the node times rasterised along the edges (interstates excepted, they
+     can only be left at their nodes, i.e. the ramps), and the center
+     buffers set to 0,
+  3. an overland access leg: at most ROADGRAPHACCESS moves over
+     overlandTravelTime30 from these cells, with the 8-connected moves of
+     r.multicost.
+The graph search covers tens of thousands of edges instead of every cell
+of the region. The graph is kept in ROADGRAPHCACHEDIR keyed on the road
+vector, so it is only built again when a driver set imports new roads.
+"""
+import os
+import sys
+import heapq
+import shutil
+import tempfile
+import numpy as np
+from Utils import createdirectorynotexist
+from multicost import MOVES, _readmap, _writemap
+from parameters import ROADGRAPHCACHEDIR, ROADGRAPHACCESS, ROADGRAPHSNAP
+
+BUFFERDIST = 180 # meters, as in cities.py
+INTERSTATE = 1 # road class of the interstates
+
+# (roads, cache file) -> RoadGraph loaded in this process
+_graphs = {}
+
+
+class RoadGraph:
+    """Nodes (x, y) and undirected edges (u, v, minutes, road class) of a
+       road vector, with a CSR adjacency list for the searches.
+    """
+    def __init__(self, xy, u, v, minutes, roadclass):
+        self.xy, self.u, self.v = xy, u, v
+        self.minutes, self.roadclass = minutes, roadclass
+        # both directions of every edge, grouped by the start node
+        src = np.concatenate([u, v])
+        order = np.argsort(src, kind='mergesort')
+        self.indptr = np.searchsorted(src[order], np.arange(len(xy)+1))
+        self.indices = np.concatenate([v, u])[order]
+        self.weights = np.concatenate([minutes, minutes])[order]
+
+    def save(self, fname):
+        np.savez(fname, xy=self.xy, u=self.u, v=self.v,
+                 minutes=self.minutes, roadclass=self.roadclass)
+
+    @classmethod
+    def load(cls, fname):
+        f = np.load(fname)
+        return cls(f['xy'], f['u'], f['v'], f['minutes'], f['roadclass'])
+
+
+def parse_lines(ascii):
+    """Parse the lines of a 'v.out.ascii format=standard' output.
+       @output: list of (vertices (n x 2 array), category list)
+    """
+    lines = ascii.splitlines()
+    i = 0
+    while i < len(lines) and not lines[i].startswith('VERTI:'):
+        i += 1
+    i += 1
+    features = []
+    while i < len(lines):
+        words = lines[i].split()
+        i += 1
+        if not words:
+            continue
+        ftype, nverts = words[0], int(words[1])
+        ncats = int(words[2]) if len(words) > 2 else 0
+        verts = [lines[j].split()[:2] for j in xrange(i, i+nverts)]
+        cats = [int(lines[j].split()[1]) for j in xrange(i+nverts, i+nverts+ncats)]
+        i += nverts + ncats
+        if ftype.upper() == 'L' and nverts > 1:
+            features.append((np.array(verts, dtype=np.float64), cats))
+    return features
+
+
+def read_attributes(grass, roads):
+    """cat -> (class, speed) of the road vector."""
+    out = grass.read_command('v.db.select', flags='c', map=roads,
+                             column='cat,class,speed', fs='|')
+    if out is None:
+        raise RuntimeError('unable to read the attributes of ' + roads)
+    attrs = {}
+    for line in out.splitlines():
+        words = line.split('|')
+        if len(words) == 3 and words[1] and words[2]:
+            attrs[int(words[0])] = (int(float(words[1])), float(words[2]))
+    return attrs
+
+
+def build_graph(grass, roads='otherroads'):
+    """Build the RoadGraph of a road vector with class and speed columns.
+       Lines without a positive speed are left out.
+    """
+    out = grass.read_command('v.out.ascii', input=roads, format='standard')
+    if out is None:
+        raise RuntimeError('unable to export the road vector ' + roads)
+    attrs = read_attributes(grass, roads)
+
+    verts, first, speeds, classes = [], [], [], []
+    nverts = 0
+    for coords, cats in parse_lines(out):
+        attr = [attrs[c] for c in cats if c in attrs]
+        if not attr or attr[0][1] <= 0:
+            continue
+        verts.append(coords)
+        # a segment starts at every vertex but the last of the line
+        starts = np.arange(nverts, nverts + len(coords) - 1)
+        first.append(starts)
+        speeds.append(np.repeat(attr[0][1], len(starts)))
+        classes.append(np.repeat(attr[0][0], len(starts)))
+        nverts += len(coords)
+    if not verts:
+        raise RuntimeError('no road with a speed in ' + roads)
+
+    verts = np.concatenate(verts)
+    first = np.concatenate(first)
+    # vertices closer than ROADGRAPHSNAP are the same node
+    keys = np.round(verts / ROADGRAPHSNAP).astype(np.int64)
+    keys, index, node = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    u, v = node[first], node[first+1]
+    length = np.hypot(*(verts[first+1] - verts[first]).T)
+    minutes = 0.06 * length / np.concatenate(speeds)
+    keep = u != v
+    return RoadGraph(verts[index], u[keep], v[keep], minutes[keep],
+                     np.concatenate(classes)[keep])
+
+
+def graph_cachename(grass, roads, cachedir=ROADGRAPHCACHEDIR):
+    """Cache file of the graph of roads: the location, mapset and the
+       modification time of the vector geometry (a new import of the
+       roads, i.e. another driver set, gives another file).
+    """
+    found = grass.find_file(roads, element='vector')
+    if not found['name']:
+        raise RuntimeError('road vector %s not found' % roads)
+    mtime = int(os.path.getmtime(os.path.join(found['file'], 'coor')))
+    gisenv = grass.gisenv()
+    return os.path.join(cachedir, '%s_%s_%s_%d.npz' % (gisenv['LOCATION_NAME'],
+                        found['mapset'], roads, mtime))
+
+
+def load_graph(grass, roads='otherroads', cachedir=ROADGRAPHCACHEDIR):
+    """Return the RoadGraph of roads, built once per version of the roads."""
+    fname = graph_cachename(grass, roads, cachedir)
+    if (roads, fname) not in _graphs:
+        if os.path.exists(fname):
+            graph = RoadGraph.load(fname)
+        else:
+            graph = build_graph(grass, roads)
+            createdirectorynotexist(fname)
+            tmpname = '%s.%d.npz' % (fname[:-4], os.getpid())
+            graph.save(tmpname)
+            os.rename(tmpname, fname) # atomic, parallel classes share the cache
+        _graphs[(roads, fname)] = graph
+    return _graphs[(roads, fname)]
+
+
+def shortest_times(graph, sources, inits, maxcost=None):
+    """Multi-source Dijkstra over the graph.
+       @inputs: sources (int array): start nodes
+                inits (float array): their initial times (minutes)
+                maxcost (float): stop at this time, None for no limit
+       @output: float array of the node times, inf if not reached
+    """
+    limit = np.inf if maxcost is None else float(maxcost)
+    dist = np.full(len(graph.xy), np.inf)
+    np.minimum.at(dist, sources, inits)
+    indptr, indices, weights = graph.indptr, graph.indices, graph.weights
+    heap = [(dist[n], n) for n in np.unique(sources)]
+    heapq.heapify(heap)
+    done = np.zeros(len(graph.xy), dtype=bool)
+    while heap:
+        d, n = heapq.heappop(heap)
+        if done[n] or d > limit:
+            continue
+        done[n] = True
+        for k in xrange(indptr[n], indptr[n+1]):
+            m, nd = indices[k], d + weights[k]
+            if nd < dist[m] and nd <= limit:
+                dist[m] = nd
+                heapq.heappush(heap, (nd, m))
+    return dist
+
+
+def center_sources(graph, centers, centertimes):
+    """Start nodes of the search: every node within BUFFERDIST of a
+       center (0 min) and the nearest node of each center, reached at
+       centertimes (minutes per meter over land) beyond the buffer.
+       @output: (nodes, initial times)
+    """
+    nodes, inits = [], []
+    for (x, y), rate in zip(centers, centertimes):
+        d = np.hypot(graph.xy[:, 0] - x, graph.xy[:, 1] - y)
+        near = np.flatnonzero(d <= BUFFERDIST)
+        nodes.append(near)
+        inits.append(np.zeros(len(near)))
+        if not len(near) and np.isfinite(rate):
+            n = np.argmin(d)
+            nodes.append([n])
+            inits.append([(d[n] - BUFFERDIST) * rate])
+    return np.concatenate(nodes).astype(np.int64), np.concatenate(inits)
+
+
+def rasterize_times(graph, times, region, grid):
+    """Fold the times along the edges into grid (minimum per cell). A point
+       at fraction f of an edge u-v is reached at
+       min(t_u + f*w, t_v + (1-f)*w). Interstates are left out, except
+       at their nodes.
+    """
+    res = min(region['ewres'], region['nsres'])
+    keep = (graph.roadclass != INTERSTATE) & \
+           (np.isfinite(times[graph.u]) | np.isfinite(times[graph.v]))
+    u, v, w = graph.u[keep], graph.v[keep], graph.minutes[keep]
+    length = np.hypot(*(graph.xy[v] - graph.xy[u]).T)
+    steps = np.maximum(np.ceil(length / (res/2.0)).astype(np.int64), 1)
+    edge = np.repeat(np.arange(len(u)), steps + 1)
+    f = np.arange(len(edge)) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+    f = f / np.repeat(steps, steps + 1).astype(np.float64)
+    t = np.minimum(times[u][edge] + f*w[edge], times[v][edge] + (1-f)*w[edge])
+    xy = graph.xy[u][edge] + f[:, None]*(graph.xy[v][edge] - graph.xy[u][edge])
+    _foldpoints(grid, region, np.vstack([xy, graph.xy]),
+                np.concatenate([t, times]))
+
+
+def _foldpoints(grid, region, xy, values):
+    """grid = min(grid, values) at the cells of the points in the region."""
+    nrows, ncols = grid.shape
+    col = np.floor((xy[:, 0] - region['w']) / region['ewres']).astype(np.int64)
+    row = np.floor((region['n'] - xy[:, 1]) / region['nsres']).astype(np.int64)
+    ok = (row >= 0) & (row < nrows) & (col >= 0) & (col < ncols) & np.isfinite(values)
+    np.minimum.at(grid, (row[ok], col[ok]), values[ok])
+
+
+def buffer_cells(grid, region, centers):
+    """Set to 0 the cells within BUFFERDIST of the centers."""
+    nrows, ncols = grid.shape
+    rr = int(np.ceil(BUFFERDIST / region['nsres']))
+    rc = int(np.ceil(BUFFERDIST / region['ewres']))
+    for x, y in centers:
+        col = int(np.floor((x - region['w']) / region['ewres']))
+        row = int(np.floor((region['n'] - y) / region['nsres']))
+        r0, r1 = max(row - rr, 0), min(row + rr + 1, nrows)
+        c0, c1 = max(col - rc, 0), min(col + rc + 1, ncols)
+        if r0 >= r1 or c0 >= c1:
+            continue
+        dy = (np.arange(r0, r1) - row) * region['nsres']
+        dx = (np.arange(c0, c1) - col) * region['ewres']
+        inside = dy[:, None]**2 + dx[None, :]**2 <= BUFFERDIST**2
+        grid[r0:r1, c0:c1][inside] = 0.0
+
+
+def access_leg(grid, overland, steps=ROADGRAPHACCESS, maxcost=None):
+    """Spread grid over land: up to steps rounds of the 8-connected moves
+       of r.multicost (mean of the two cell costs, times sqrt(2) on the
+       diagonals) over the overland cost per cell. Stops early once no
+       cell improves.
+       @inputs: grid (2-D float array): the start times, inf elsewhere
+                overland (2-D float array): cost per cell, NaN for null
+    """
+    cost = np.where(np.isnan(overland), np.inf, overland)
+    limit = np.inf if maxcost is None else float(maxcost)
+    nrows, ncols = grid.shape
+    for i in xrange(steps):
+        changed = False
+        for dr, dc, fac in MOVES:
+            dst = (slice(max(dr, 0), nrows + min(dr, 0)), slice(max(dc, 0), ncols + min(dc, 0)))
+            src = (slice(max(-dr, 0), nrows + min(-dr, 0)), slice(max(-dc, 0), ncols + min(-dc, 0)))
+            new = grid[src] + (cost[src] + cost[dst]) / 2.0 * fac
+            better = (new < grid[dst]) & (new <= limit)
+            if better.any():
+                grid[dst][better] = new[better]
+                changed = True
+        if not changed:
+            break
+    return grid
+
+
+def read_centers(grass, centers):
+    """(x, y) of the points of a vector map."""
+    out = grass.read_command('v.out.ascii', input=centers, fs='|')
+    if out is None:
+        raise RuntimeError('unable to export the centers ' + centers)
+    return [tuple(float(w) for w in line.split('|')[:2])
+            for line in out.splitlines() if line]
+
+
+def graph_travelcost(grass, centers, output, overland='overlandTravelTime30',
+                     roads='otherroads', maxcost='180', steps=ROADGRAPHACCESS):
+    """Travel time (minutes) from the centers vector over the road graph
+       of roads and overland access, written to the output raster of the
+       current region, null beyond maxcost (as the r.multicost output of
+       cities.make_city_tt).
+    """
+    graph = load_graph(grass, roads)
+    region = grass.region()
+    tmpdir = tempfile.mkdtemp(prefix='roadgraph_')
+    try:
+        cost = _readmap(grass, overland, tmpdir)
+        points = read_centers(grass, centers)
+
+        # minutes per meter over land at each center
+        rates = []
+        for x, y in points:
+            row = int(np.floor((region['n'] - y) / region['nsres']))
+            col = int(np.floor((x - region['w']) / region['ewres']))
+            inside = 0 <= row < cost.shape[0] and 0 <= col < cost.shape[1]
+            rates.append(cost[row, col] / region['nsres'] if inside else np.nan)
+
+        grid = np.full(cost.shape, np.inf)
+        if points:
+            sources, inits = center_sources(graph, points, rates)
+            times = shortest_times(graph, sources, inits, maxcost)
+            rasterize_times(graph, times, region, grid)
+            buffer_cells(grid, region, points)
+        access_leg(grid, cost, steps, maxcost)
+        grid[~np.isfinite(grid) | (grid > float(maxcost))] = np.nan
+        _writemap(grass, grid, output, tmpdir)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return output
+
+
+def main():
+    sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
+    import grass.script as grass
+    maxcost = sys.argv[3] if len(sys.argv) > 3 else '180'
+    graph_travelcost(grass, sys.argv[1], sys.argv[2], maxcost=maxcost)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Require Arg1: centers vector map, Arg2: output raster, " + \
+              "Arg3: (optional) max travel time.\n" + \
+              "Runs in the current GRASS session."
+        exit(1)
+    main()
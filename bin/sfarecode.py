@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""NumPy engine of the r.recode runs turning attraction maps into scores
+with the SFA/<name>.sfa rules (cost2score, att2score_centers).
+
+A rule file holds r.recode rules, one per line:
+    old_low:old_high:new_low:new_high   (linear between the two)
+    old_low:old_high:new_value          (constant)
+    *:old_high:new_value                (constant up to old_high)
+    old_low:*:new_value                 (constant from old_low)
+'#' comments and 'end' are skipped. As in the GRASS floating-point
+reclass (fpreclass), the bounds are inclusive and the last finite rule
+matching a value wins. The '*' rules are kept apart, the last one of
+each side only, and apply only to values no finite rule matches: first
+the '*:old_high' rule, then the 'old_low:*' one. Values matched by no
+rule become null.
+
+A file is compiled once into a RecodeTable: the sorted bounds of the
+finite rules, with the winning rule at each bound and in each open
+interval between two bounds, so a block of values is recoded with a
+single searchsorted and the interpolation of its rules. Compiled tables are
+cached by file name and modification time. sfascore runs the recode, the
+null-to-zero of cost2score and the weight exponent of att2score_centers
+in the same pass over the input, in row blocks.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+from bil import openbil, createbil
+from rasterstats import blockrows
+from parameters import STATSMEMBUDGET
+
+NODATA = -9999.0 # null cells of the EHdr files exchanged with GRASS (exact in Float32)
+
+# rule file name -> (mtime, RecodeTable)
+_tables = {}
+
+
+def parse_rules(text):
+    """Parse r.recode rules.
+       @output: (rules, left, right): rules the list of the finite rules
+                (old_low, old_high, new_low, new_high); left and right
+                the (old_high, new_value) of the '*:old_high' rule and the
+                (old_low, new_value) of the 'old_low:*' rule, None if
+                there is none
+    """
+    rules, left, right = [], None, None
+    for line in text.splitlines():
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        if line.lower() == 'end':
+            break
+        words = [w.strip() for w in line.split(':')]
+        if len(words) not in (3, 4) or words[0] == words[1] == '*':
+            raise ValueError('invalid recode rule: ' + line)
+        new = [float(w) for w in words[2:]]
+        if words[0] == '*': # one rule per side, the last one is kept
+            left = (float(words[1]), new[0])
+            continue
+        if words[1] == '*':
+            right = (float(words[0]), new[0])
+            continue
+        low, high = float(words[0]), float(words[1])
+        if low > high: # r.recode accepts the bounds in any order
+            low, high = high, low
+            new.reverse()
+        rules.append((low, high, new[0], new[-1]))
+    return rules, left, right
+
+
+class RecodeTable:
+    """Compiled rules: bounds (sorted unique finite rule bounds),
+       atbound[i] the rule applied at bounds[i] and inside[i] the rule
+       applied between bounds[i-1] and bounds[i] (i = 0 below the first
+       bound, len(bounds) above the last), -1 for none. atbound has one
+       more entry so both are indexed by the searchsorted position.
+       left and right are the '*' rules of parse_rules, applied where
+       no finite rule is.
+    """
+    def __init__(self, rules, left=None, right=None):
+        self.rules, self.left, self.right = rules, left, right
+        lows = np.array([r[0] for r in rules] or [0.0])
+        highs = np.array([r[1] for r in rules] or [0.0])
+        self.lows, self.highs = lows, highs
+        self.newlows = np.array([r[2] for r in rules] or [0.0])
+        self.newhighs = np.array([r[3] for r in rules] or [0.0])
+        ends = np.concatenate([lows, highs])
+        self.bounds = np.unique(ends[np.isfinite(ends)])
+        # a sample value of each open interval
+        b = self.bounds
+        if len(b):
+            mids = np.concatenate([[b[0] - 1], (b[:-1] + b[1:]) / 2.0, [b[-1] + 1]])
+        else:
+            mids = np.array([0.0])
+        self.atbound = np.append(self._winner(b), -1)
+        self.inside = self._winner(mids)
+
+    def _winner(self, values):
+        """Index of the last rule matching each value, -1 if none."""
+        win = np.full(len(values), -1, dtype=np.int64)
+        for i, (low, high, newlow, newhigh) in enumerate(self.rules):
+            win[(values >= low) & (values <= high)] = i
+        return win
+
+    def recode(self, values):
+        """Recode an array of values, NaN for null (in and out)."""
+        values = np.asarray(values, dtype=np.float64)
+        pos = np.searchsorted(self.bounds, values, side='left')
+        onbound = pos < len(self.bounds)
+        onbound[onbound] = self.bounds[pos[onbound]] == values[onbound]
+        rule = np.where(onbound, self.atbound[pos], self.inside[pos])
+        rule[np.isnan(values)] = -1
+        r = np.maximum(rule, 0)
+        low, span = self.lows[r], self.highs[r] - self.lows[r]
+        newlow, newhigh = self.newlows[r], self.newhighs[r]
+        # constant for the 3 field rules, the open and the one value ranges
+        linear = np.isfinite(span) & (span > 0) & (newhigh != newlow)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(linear, (values - low) / span, 0.0)
+        out = newlow + frac * (newhigh - newlow)
+        out[rule < 0] = np.nan
+        # the '*' rules, only where no finite rule matches
+        with np.errstate(invalid='ignore'):
+            if self.right is not None:
+                out[(rule < 0) & (values >= self.right[0])] = self.right[1]
+            if self.left is not None:
+                out[(rule < 0) & (values <= self.left[0])] = self.left[1]
+        return out
+
+
+def load_table(rulesname):
+    """The RecodeTable of a rule file, compiled again only when the file
+       has changed.
+    """
+    mtime = os.path.getmtime(rulesname)
+    cached = _tables.get(rulesname)
+    if cached is None or cached[0] != mtime:
+        with open(rulesname, 'r') as f:
+            cached = (mtime, RecodeTable(*parse_rules(f.read())))
+        _tables[rulesname] = cached
+    return cached[1]
+
+
+def score(values, table, nullzero=False, weight=None, integer=False):
+    """Recode a block of values and apply the post-processing of the
+       score maps.
+       @inputs: nullzero (bool): null to 0 (the r.null of cost2score)
+                weight (float): exponent (the pow mapcalc of
+                                att2score_centers), None for none
+                integer (bool): truncate the recoded values, as r.recode
+                                writes integer inputs as CELL maps
+    """
+    out = table.recode(values)
+    if integer:
+        out = np.trunc(out)
+    if weight is not None:
+        with np.errstate(invalid='ignore'):
+            out = np.power(out, weight)
+    if nullzero:
+        out[np.isnan(out)] = 0.0
+    return out
+
+
+def exportlayer(grass, layername, bilname):
+    """Export a raster of the current region as a Float64 EHdr file,
+       NODATA for null cells.
+       @output: (nrows, ncols) numpy.memmap
+    """
+    if grass.run_command('r.out.gdal', input=layername, output=bilname,
+            format='EHdr', type='Float64', nodata=NODATA, quiet=True):
+        raise RuntimeError('unable to export raster map ' + layername)
+    return openbil(bilname)[1]
+
+
+def createlayer(grass, bilname, dtype='float64'):
+    """Create an EHdr file of the current region, to be filled in and
+       imported with importlayer.
+       @output: (nrows, ncols) writable numpy.memmap
+    """
+    region = grass.region()
+    return createbil(bilname, int(region['rows']), int(region['cols']), dtype,
+        region['w'] + region['ewres']/2.0, region['n'] - region['nsres']/2.0,
+        region['ewres'], region['nsres'], nodata=NODATA)[1]
+
+
+def importlayer(grass, bilname, layername):
+    """Import an EHdr file written by createlayer as a raster map."""
+    if grass.run_command('r.in.gdal', flags='o', input=bilname,
+                         output=layername, quiet=True):
+        raise RuntimeError('unable to import raster map ' + layername)
+
+
+def sfascore(grass, inputname, outputname, rulesname, nullzero=False,
+             weight=None, membudget=STATSMEMBUDGET):
+    """Write outputname, the score of the inputname raster recoded by the
+       rules file, in one block-wise pass over the current region.
+    """
+    table = load_table(rulesname)
+    integer = grass.raster_info(inputname)['datatype'] == 'CELL'
+    tmpdir = tempfile.mkdtemp(prefix='sfarecode_')
+    try:
+        values = exportlayer(grass, inputname, os.path.join(tmpdir, 'input.bil'))
+        outname = os.path.join(tmpdir, 'output.bil')
+        out = createlayer(grass, outname)
+        step = blockrows(values.shape[1], 8, 4, membudget)
+        for r in xrange(0, values.shape[0], step):
+            block = np.array(values[r:r+step], dtype=np.float64)
+            block[block == NODATA] = np.nan
+            block = score(block, table, nullzero, weight, integer)
+            block[np.isnan(block)] = NODATA
+            out[r:r+step] = block
+        out.flush()
+        del values, out
+        importlayer(grass, outname, outputname)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return outputname
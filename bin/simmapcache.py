@@ -0,0 +1,139 @@
+"""Content-addressed cache of the SimMap classifications.
+
+An entry is keyed on a hash of the raster content (the .npy sidecar or
+the ascii map, whichever readgrid would read) plus the classification
+options (numcolors, nomin, nomax, isuniq, sketch, palette) and, for the
+rendered .map text, the region code and the mapfile template. Entries
+hold the classColorCondlist and the rendered mapfile, so a re-run over
+an unchanged raster does not read the raster at all. The cache is kept
+under SIMMAPCACHEDIR and the least recently used entries are evicted
+once the total size goes over SIMMAPCACHESIZE bytes. Several runs may
+share the cache: the index is merged with the one on disk, under a lock,
+each time it is written.
+"""
+import os
+import json
+import time
+import fcntl
+import hashlib
+from Utils import createdirectorynotexist, gridsource
+from parameters import SIMMAPCACHEDIR, SIMMAPCACHESIZE
+
+HASHCHUNK = 1 << 20
+
+
+class SimMapCache:
+    """LRU cache of classColorCondlist and .map text on disk.
+       index.json maps each entry key to [size, last used], and each
+       raster file name to [size, mtime, digest] so unchanged files
+       are not hashed twice.
+    """
+    def __init__(self, cachedir=SIMMAPCACHEDIR, maxsize=SIMMAPCACHESIZE):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.indexname = os.path.join(cachedir, 'index.json')
+        createdirectorynotexist(self.indexname)
+        self.index = self._loadindex()
+        self.dropped = set() # entries removed since the index was saved
+
+    def _loadindex(self):
+        try:
+            with open(self.indexname, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {'entries': {}, 'files': {}}
+
+    def _saveindex(self):
+        """Merge the index with the one on disk (other runs may have
+           added or used entries since), evict the least recently used
+           entries over maxsize and write it, holding the lock of the
+           cache.
+        """
+        with open(self.indexname + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX) # released when closed
+            ondisk = self._loadindex()
+            entries = self.index['entries']
+            for k, value in ondisk['entries'].items():
+                if k not in self.dropped and (k not in entries or entries[k][1] < value[1]):
+                    entries[k] = value
+            for k in list(entries):
+                if k in self.dropped or not os.path.exists(self._entryname(k)):
+                    del entries[k] # evicted by another run
+            for fname, value in ondisk['files'].items():
+                self.index['files'].setdefault(fname, value)
+            self.dropped = set()
+
+            total = sum(size for size, used in entries.values())
+            for k in sorted(entries, key=lambda k: entries[k][1]):
+                if total <= self.maxsize:
+                    break
+                total -= entries.pop(k)[0]
+                if os.path.exists(self._entryname(k)):
+                    os.remove(self._entryname(k))
+
+            tmpname = '%s.%d' % (self.indexname, os.getpid())
+            with open(tmpname, 'w') as f:
+                json.dump(self.index, f)
+            os.rename(tmpname, self.indexname)
+
+    def digest(self, fname):
+        """Content hash of the raster fname stands for."""
+        fname = gridsource(fname)
+        st = os.stat(fname)
+        known = self.index['files'].get(fname)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime:
+            return known[2]
+        h = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASHCHUNK), ''):
+                h.update(chunk)
+        self.index['files'][fname] = [st.st_size, st.st_mtime, h.hexdigest()]
+        return h.hexdigest()
+
+    def key(self, fname, **options):
+        """Entry key of the raster fname classified with options."""
+        opts = json.dumps(sorted(options.items()))
+        return hashlib.sha1(self.digest(fname) + opts).hexdigest()
+
+    def _entryname(self, key):
+        return os.path.join(self.cachedir, key + '.json')
+
+    def get(self, key):
+        """Return the cached entry dict (keys 'condlist' and 'mapfile')
+           or None.
+        """
+        if key not in self.index['entries']:
+            return None
+        try:
+            with open(self._entryname(key), 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            del self.index['entries'][key]
+            self.dropped.add(key)
+            return None
+        self.index['entries'][key][1] = time.time()
+        self._saveindex()
+        entry['condlist'] = [tuple(c) for c in entry['condlist']]
+        return entry
+
+    def put(self, key, condlist, mapfile=None):
+        """Store a classColorCondlist and optionally its rendered .map text,
+           then evict the least recently used entries over maxsize.
+        """
+        entryname = self._entryname(key)
+        with open(entryname, 'w') as f:
+            json.dump({'condlist': condlist, 'mapfile': mapfile}, f,
+                      default=lambda o: o.item()) # numpy scalars
+        self.index['entries'][key] = [os.path.getsize(entryname), time.time()]
+        self.dropped.discard(key)
+        self._saveindex()
+
+
+_cache = None
+
+def getcache():
+    """The SimMapCache shared by genSimMap."""
+    global _cache
+    if _cache is None:
+        _cache = SimMapCache()
+    return _cache
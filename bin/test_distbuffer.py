@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""distbuffer.py against brute force r.buffer zones.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import unittest
+import numpy as np
+from distbuffer import ring_costs, buffer_costs
+
+RINGS = [30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330, 360]
+CAP = 390
+
+
+def reference(mask, ewres, nsres):
+    """First ring at least as far as the nearest class cell center."""
+    rows, cols = np.nonzero(mask)
+    out = np.full(mask.shape, CAP, dtype=np.int16)
+    if not len(rows):
+        return out
+    for r in xrange(mask.shape[0]):
+        for c in xrange(mask.shape[1]):
+            d2 = (((rows - r)*nsres)**2 + ((cols - c)*ewres)**2).min()
+            for ring in [0] + RINGS:
+                if d2 <= ring*ring:
+                    out[r, c] = ring
+                    break
+    return out
+
+
+class DistBufferTest(unittest.TestCase):
+
+    def test_ring_costs(self):
+        mask = np.zeros((30, 30), bool)
+        mask[15, 15] = True
+        got = ring_costs(mask, 30.0, 30.0, RINGS, CAP)
+        np.testing.assert_array_equal(got, reference(mask, 30.0, 30.0))
+        self.assertEqual(got[15, 15], 0)
+        self.assertEqual(got[15, 16], 30)
+        self.assertEqual(got[16, 16], 60) # 42.4 m
+        self.assertEqual(got[0, 0], CAP)
+
+    def test_random_blocks(self):
+        rng = np.random.RandomState(3)
+        classlists = [[11], [41, 91]]
+        for trial in xrange(15):
+            nrows, ncols = rng.randint(1, 40), rng.randint(1, 40)
+            landcover = rng.choice([11, 41, 21, 82, -1], size=(nrows, ncols),
+                                   p=[.01, .02, .5, .45, .02])
+            ewres, nsres = (30.0, 25.0) if trial % 3 == 0 else (30.0, 30.0)
+            outs = [np.zeros((nrows, ncols), np.int16) for classes in classlists]
+            # small budgets split the map in blocks with a halo
+            buffer_costs(landcover, classlists, ewres, nsres, outs, RINGS, CAP,
+                         membudget=trial*2000 + 1)
+            for classes, out in zip(classlists, outs):
+                mask = np.in1d(landcover, classes).reshape(landcover.shape)
+                np.testing.assert_array_equal(out, reference(mask, ewres, nsres))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Quantile breaks of genSimMap.py: the histogram path of integer rasters
+and the sketch path of floating-point ones against the sort-based path.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import unittest
+import numpy as np
+from rasterstats import IntHistogram, QuantileSketch
+from genSimMap import getHistQuantileList, getSketchQuantileList, getSortedQuantileList
+
+
+class HistQuantileListTest(unittest.TestCase):
+
+    def assertSameBreaks(self, arr, numbaskets, **kw):
+        ticks, uniq = getSortedQuantileList(arr, numbaskets, **kw)
+        histticks, histuniq = getHistQuantileList(IntHistogram(arr), numbaskets, **kw)
+        self.assertEqual(histuniq, uniq)
+        np.testing.assert_array_equal(histticks, ticks)
+        return ticks
+
+    def test_random_uint16(self):
+        rng = np.random.RandomState(5)
+        for trial in xrange(30):
+            arr = rng.randint(0, [40, 1000, 65536][trial % 3],
+                              rng.randint(100, 5000)).astype(np.uint16)
+            if trial % 2: # a large min or max class is removed anyway
+                arr[rng.rand(len(arr)) < 0.4] = [arr.min(), arr.max()][trial % 4 == 1]
+            for kw in ({}, {'nomin': True}, {'nomax': True},
+                       {'nomin': True, 'nomax': True}, {'isuniq': True}):
+                self.assertSameBreaks(arr, 15, **kw)
+
+    def test_nomin_drops_the_minimum(self):
+        arr = np.arange(100, dtype=np.uint16)
+        self.assertEqual(self.assertSameBreaks(arr, 10, nomin=True)[0], 1)
+        self.assertEqual(self.assertSameBreaks(arr, 10, nomax=True)[0], 0)
+
+
+class SketchQuantileListTest(unittest.TestCase):
+
+    def test_min_max_removal(self):
+        rng = np.random.RandomState(2)
+        arr = rng.uniform(0.1, 0.9, 4000)
+        arr[:1500] = 0.05 # a large min class
+        arr[-200:] = 0.95
+        for kw in ({}, {'nomin': True}, {'nomax': True}, {'nomin': True, 'nomax': True}):
+            sketch = QuantileSketch()
+            for block in np.array_split(arr, 7):
+                sketch.add(block)
+            ticks, uniq = getSketchQuantileList(sketch, 15, **kw)
+            expected, expecteduniq = getSortedQuantileList(arr, 15, **kw)
+            self.assertEqual(uniq, expecteduniq)
+            self.assertEqual(len(ticks), len(expected))
+            np.testing.assert_allclose(ticks, expected, rtol=sketch.alpha)
+            self.assertTrue(ticks[0] > 0.05) # the min class is always removed
+
+    def test_removemin(self):
+        sketch = QuantileSketch().add([0, 0, 1.5, 2, 2, 3])
+        sketch.removemin()
+        self.assertEqual((len(sketch), sketch.low), (4, [(1.5, 1)]))
+        sketch.removemin()
+        self.assertEqual(len(sketch), 3)
+        np.testing.assert_allclose(sketch.quantiles([0, 2]), [2, 3], rtol=sketch.alpha)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""modeldag.py: skipping of unchanged nodes, serial and in child
+processes with temporary mapsets, on a stand-in of GRASS whose maps are
+files in the mapset directories.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import cities
+import modeldag
+from modeldag import Node, execute
+
+ELEMENTS = {'cell': 'cell', 'vector': 'vector', 'rast': 'cell', 'vect': 'vector'}
+
+
+class FakeGrass:
+    """The GRASS commands used by modeldag and cities.enter_mapset; the
+       mapset is the one of the GISRC file of the process.
+    """
+    def __init__(self, gisdbase):
+        self.location = os.path.join(gisdbase, 'loc')
+
+    def gisenv(self):
+        with open(os.environ['GISRC']) as f:
+            env = dict(line.split(': ', 1) for line in f.read().splitlines())
+        return env
+
+    def mapsetdir(self, mapset=None):
+        return os.path.join(self.location, mapset or self.gisenv()['MAPSET'])
+
+    def write(self, name, value, element='cell'):
+        """A map of the current mapset holding value."""
+        path = os.path.join(self.mapsetdir(), element)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(str(value))
+
+    def read(self, name, mapset=None):
+        found = self.find_file(name, element='cell')
+        with open(found['file']) as f:
+            return f.read()
+
+    def find_file(self, name, element):
+        searchpath = [self.gisenv()['MAPSET']]
+        fname = os.path.join(self.mapsetdir(), 'SEARCH_PATH')
+        if os.path.exists(fname):
+            searchpath += open(fname).read().split()
+        for mapset in searchpath:
+            path = os.path.join(self.mapsetdir(mapset), ELEMENTS[element], name)
+            if os.path.exists(path):
+                return {'name': name, 'mapset': mapset, 'file': path}
+        return {'name': '', 'mapset': '', 'file': ''}
+
+    def read_command(self, cmd, type, mapset):
+        path = os.path.join(self.mapsetdir(mapset), ELEMENTS[type])
+        return '\n'.join(sorted(os.listdir(path))) if os.path.isdir(path) else ''
+
+    def run_command(self, cmd, **kw):
+        if cmd == 'g.mapsets':
+            with open(os.path.join(self.mapsetdir(), 'SEARCH_PATH'), 'w') as f:
+                f.write(kw['addmapset'])
+        elif cmd == 'g.copy':
+            maptype = 'rast' if 'rast' in kw else 'vect'
+            source, dest = kw[maptype].split(',')
+            name, mapset = source.split('@')
+            with open(os.path.join(self.mapsetdir(mapset), ELEMENTS[maptype], name)) as f:
+                self.write(dest, f.read(), ELEMENTS[maptype])
+        return 0
+
+
+class ModelDagTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp(prefix='test_modeldag_')
+        os.chdir(self.tmpdir)
+        os.makedirs('Data')
+        os.makedirs('loc/run')
+        open('loc/run/WIND', 'w').close()
+        with open('gisrc', 'w') as f:
+            f.write('GISDBASE: %s\nLOCATION_NAME: loc\nMAPSET: run\n' % self.tmpdir)
+        self.gisrc = os.environ.get('GISRC')
+        os.environ['GISRC'] = os.path.join(self.tmpdir, 'gisrc')
+        self.grass = FakeGrass(self.tmpdir)
+        self.grass.write('base', 1)
+        self.session, cities.grass = cities.grass, self.grass
+        self.runs = os.path.join(self.tmpdir, 'runs')
+
+    def tearDown(self):
+        cities.grass = self.session
+        os.environ.pop('WIND_OVERRIDE', None)
+        if self.gisrc is None:
+            del os.environ['GISRC']
+        else:
+            os.environ['GISRC'] = self.gisrc
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def step(self, name, source=None, fail=False):
+        """A node function writing name from source, recording its runs."""
+        def func():
+            with open(self.runs, 'a') as f: # shared by the child processes
+                f.write(name + '\n')
+            if fail:
+                raise ValueError('no ' + name)
+            os.environ['WIND_OVERRIDE'] = name # must not leak to the run
+            value = self.grass.read(source) + name if source else name
+            self.grass.write(name, value)
+            self.grass.write(name + '_scratch', '', 'vector')
+            open('Data/%s.tif' % name, 'w').close()
+            modeldag.published().append({'name': name, 'url': 'old'})
+        return func
+
+    def nodes(self, fail=False):
+        return [Node('a', self.step('a', 'base'), ['a'], rasters=['base']),
+                Node('b', self.step('b', 'a'), ['b'], deps=['a']),
+                Node('c', self.step('c', fail=fail), ['c'], params={'x': 1}),
+                Node('d', self.step('d', 'b'), ['d'], deps=['b', 'c'])]
+
+    def ran(self):
+        with open(self.runs) as f:
+            names = sorted(f.read().split())
+        os.remove(self.runs)
+        return names
+
+    def run_nodes(self, nodes, workers, messages=None):
+        queue = []
+        log = messages.append if messages is not None else None
+        result = execute(self.grass, nodes, queue, log,
+                         republish=lambda layer: dict(layer, url='new'), workers=workers,
+                         statename='Cache/modeldag.json',
+                         childinit=lambda send: send('hello'))
+        return result, queue
+
+    def check_rerun(self, workers):
+        (ran, skipped), queue = self.run_nodes(self.nodes(), workers)
+        self.assertEqual((sorted(ran), skipped), (['a', 'b', 'c', 'd'], []))
+        self.assertEqual(self.ran(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.grass.read('d'), '1abd')
+        self.assertEqual(sorted(l['name'] for l in queue), ['a', 'b', 'c', 'd'])
+        self.assertFalse('WIND_OVERRIDE' in os.environ and workers > 1)
+
+        (ran, skipped), queue = self.run_nodes(self.nodes(), workers)
+        self.assertEqual((ran, skipped), ([], ['a', 'b', 'c', 'd']))
+        self.assertEqual(sorted((l['name'], l['url']) for l in queue),
+                         [('a', 'new'), ('b', 'new'), ('c', 'new'), ('d', 'new')])
+
+        # a new base input reruns its subgraph only
+        os.utime(self.grass.find_file('base', 'cell')['file'], (0, 0))
+        (ran, skipped), queue = self.run_nodes(self.nodes(), workers)
+        self.assertEqual(self.ran(), ['a', 'b', 'd'])
+        self.assertEqual(skipped, ['c'])
+
+        # as does a lost output
+        os.remove('Data/b.tif')
+        self.run_nodes(self.nodes(), workers)
+        self.assertEqual(self.ran(), ['b', 'd'])
+
+    def test_serial(self):
+        self.check_rerun(1)
+
+    def test_processes(self):
+        messages = []
+        self.run_nodes(self.nodes(), 3, messages)
+        self.assertEqual(messages.count('hello'), 4)
+        self.assertEqual(sorted(os.listdir('loc')), ['run'])
+        self.assertTrue(self.grass.find_file('d_scratch', 'vector')['name'])
+        os.remove('Cache/modeldag.json')
+        self.ran()
+        self.check_rerun(3)
+
+    def test_failure(self):
+        for workers in (1, 3):
+            error = RuntimeError if workers > 1 else ValueError
+            self.assertRaises(error, self.run_nodes, self.nodes(fail=True), workers)
+            # d, which depends on c, never starts
+            ran = self.ran()
+            self.assertTrue(set(['a', 'c']) <= set(ran) and 'd' not in ran)
+            self.assertEqual(sorted(os.listdir('loc')), ['run'])
+            # the nodes done are recorded and skipped next time
+            self.run_nodes(self.nodes(), workers)
+            self.assertEqual(self.ran(), ['c', 'd'] if 'b' in ran else ['b', 'c', 'd'])
+            os.remove('Cache/modeldag.json')
+
+    def test_cycle(self):
+        nodes = [Node('a', None, [], deps=['b']), Node('b', None, [], deps=['a'])]
+        self.assertRaises(RuntimeError, modeldag.toposort, nodes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""multicost.py against a plain Dijkstra over (layer, row, col) states.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import heapq
+import unittest
+import numpy as np
+from multicost import multicost, MOVES
+
+
+def reference(cost1, cost2, xover, start, maxcost=None):
+    """r.multicost by the book: a move costs the mean of the two cells
+       times the move length, switching layers is free on xover cells.
+    """
+    nrows, ncols = cost1.shape
+    costs = [cost1, cost2]
+    done, heap = {}, []
+    for r, c in zip(*np.nonzero(start)):
+        for layer in (0, 1):
+            if not np.isnan(costs[layer][r, c]):
+                heapq.heappush(heap, (0.0, layer, r, c))
+    while heap:
+        d, layer, r, c = heapq.heappop(heap)
+        if (layer, r, c) in done or (maxcost is not None and d > maxcost):
+            continue
+        done[(layer, r, c)] = d
+        if xover[r, c] and not np.isnan(costs[1-layer][r, c]):
+            heapq.heappush(heap, (d, 1-layer, r, c))
+        for dr, dc, length in MOVES:
+            rr, cc = r + dr, c + dc
+            if 0 <= rr < nrows and 0 <= cc < ncols and not np.isnan(costs[layer][rr, cc]):
+                step = (costs[layer][r, c] + costs[layer][rr, cc]) / 2.0 * length
+                heapq.heappush(heap, (d + step, layer, rr, cc))
+    out = np.full((nrows, ncols), np.nan)
+    for (layer, r, c), d in done.items():
+        if np.isnan(out[r, c]) or d < out[r, c]:
+            out[r, c] = d
+    return out
+
+
+class MulticostTest(unittest.TestCase):
+
+    def test_random_grids(self):
+        rng = np.random.RandomState(3)
+        for trial in xrange(40):
+            nrows, ncols = rng.randint(3, 25), rng.randint(3, 25)
+            cost1 = rng.rand(nrows, ncols)*2 + 0.05
+            cost1[rng.rand(nrows, ncols) < 0.15] = np.nan
+            cost2 = np.full((nrows, ncols), np.nan)
+            road = rng.rand(nrows, ncols) < 0.3
+            cost2[road] = rng.rand(road.sum())*0.1 + 0.01
+            xover = (rng.rand(nrows, ncols) < 0.1).astype(int)
+            start = rng.rand(nrows, ncols) < 0.02
+            start[rng.randint(nrows), rng.randint(ncols)] = True
+            maxcost = [None, 3.0, 10.0][trial % 3]
+            got = multicost(cost1, cost2, xover, start, maxcost)
+            expected = reference(cost1, cost2, xover, start, maxcost)
+            np.testing.assert_array_equal(np.isnan(got), np.isnan(expected))
+            np.testing.assert_allclose(got[~np.isnan(got)], expected[~np.isnan(expected)],
+                                       rtol=1e-12, atol=1e-12)
+
+    def test_roads_need_a_crossover(self):
+        cost1 = np.ones((1, 5))
+        cost2 = np.full((1, 5), 0.01)
+        start = np.array([[True, False, False, False, False]])
+        got = multicost(cost1, cost2, np.zeros((1, 5)), start)
+        np.testing.assert_allclose(got, [[0, 0.01, 0.02, 0.03, 0.04]])
+        cost2[0, 0] = np.nan # the start is off the road, no crossover
+        got = multicost(cost1, cost2, np.zeros((1, 5)), start)
+        np.testing.assert_allclose(got, [[0, 1, 2, 3, 4]])
+        xover = np.array([[0, 1, 0, 0, 0]])
+        got = multicost(cost1, cost2, xover, start)
+        np.testing.assert_allclose(got, [[0, 1, 1.01, 1.02, 1.03]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""roadgraph.py: parsing, searches and rasterization, without GRASS.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import unittest
+import numpy as np
+import roadgraph as rg
+from multicost import multicost
+
+ASCII = """ORGANIZATION:
+DIGIT DATE:
+MAP SCALE:    1
+VERTI:
+L  3 1
+ 0 0
+ 100 0
+ 100 100
+ 1     1
+L  2 1
+ 100 100
+ 300 100
+ 1     2
+P  1 1
+ 5 5
+ 1 3
+"""
+
+
+def bellman_ford(graph, sources, inits, maxcost=None):
+    dist = np.full(len(graph.xy), np.inf)
+    np.minimum.at(dist, sources, inits)
+    for i in xrange(len(graph.xy)):
+        for a, b, w in zip(graph.u, graph.v, graph.minutes):
+            dist[b] = min(dist[b], dist[a] + w)
+            dist[a] = min(dist[a], dist[b] + w)
+    if maxcost is not None:
+        dist[dist > maxcost] = np.inf
+    return dist
+
+
+class RoadGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        # a chain 0-1-2-3 of class 2 roads, and an interstate 0-3
+        xy = np.array([[0, 15], [1000, 15], [2000, 15], [2990, 15.]])
+        self.graph = rg.RoadGraph(xy, np.array([0, 1, 2, 0]), np.array([1, 2, 3, 3]),
+                                  np.array([1., 1., 1., 5.]), np.array([2, 2, 2, 1]))
+        self.region = dict(n=30., s=0., w=0., e=3000., nsres=30., ewres=30.)
+
+    def test_parse_lines(self):
+        features = rg.parse_lines(ASCII)
+        self.assertEqual(len(features), 2) # the point is left out
+        np.testing.assert_array_equal(features[0][0], [[0, 0], [100, 0], [100, 100]])
+        self.assertEqual([cats for verts, cats in features], [[1], [2]])
+
+    def test_shortest_times(self):
+        t = rg.shortest_times(self.graph, np.array([0]), np.array([0.]))
+        np.testing.assert_array_equal(t, [0, 1, 2, 3])
+        t = rg.shortest_times(self.graph, np.array([0]), np.array([0.]), 1.5)
+        np.testing.assert_array_equal(t, [0, 1, np.inf, np.inf])
+
+    def test_random_graphs(self):
+        rng = np.random.RandomState(1)
+        for trial in xrange(20):
+            n = rng.randint(2, 30)
+            m = rng.randint(1, 3*n)
+            u, v = rng.randint(0, n, m), rng.randint(0, n, m)
+            graph = rg.RoadGraph(rng.rand(n, 2), u, v, rng.rand(m)*5, np.full(m, 2))
+            sources = rng.randint(0, n, rng.randint(1, 3))
+            inits = rng.rand(len(sources))
+            maxcost = [None, 3.0][trial % 2]
+            np.testing.assert_allclose(rg.shortest_times(graph, sources, inits, maxcost),
+                                       bellman_ford(graph, sources, inits, maxcost))
+
+    def test_center_sources(self):
+        sources, inits = rg.center_sources(self.graph, [(50, 15), (1500, 15)], [0.01, 0.01])
+        np.testing.assert_array_equal(sources, [0, 1])
+        np.testing.assert_allclose(inits, [0, (500 - rg.BUFFERDIST)*0.01])
+
+    def test_rasterize_times(self):
+        grid = np.full((1, 100), np.inf)
+        rg.rasterize_times(self.graph, np.array([0, 1, 2, 3.]), self.region, grid)
+        # the minimum over the cell of the times, linear along the chain
+        self.assertEqual(grid[0, 0], 0)
+        self.assertAlmostEqual(grid[0, 33], 1, delta=0.02)
+        self.assertAlmostEqual(grid[0, 99], 3, delta=0.02)
+        self.assertTrue((np.diff(grid[0]) >= 0).all())
+        self.assertAlmostEqual(grid[0, 50], 1.5, delta=0.02)
+
+    def test_buffer_cells(self):
+        grid = np.ones((1, 100))
+        rg.buffer_cells(grid, self.region, [(1515, 15)])
+        np.testing.assert_array_equal(np.flatnonzero(grid[0] == 0), np.arange(44, 57))
+
+    def test_access_leg(self):
+        # unbounded steps give the single layer r.multicost
+        rng = np.random.RandomState(1)
+        for trial in xrange(20):
+            nrows, ncols = rng.randint(5, 25), rng.randint(5, 25)
+            cost = rng.uniform(0.05, 2, (nrows, ncols))
+            cost[rng.rand(nrows, ncols) < 0.1] = np.nan
+            start = (rng.rand(nrows, ncols) < 0.03) & ~np.isnan(cost)
+            expected = multicost(cost, np.full((nrows, ncols), np.nan),
+                                 np.zeros((nrows, ncols)), start, 20)
+            grid = np.where(start, 0.0, np.inf)
+            rg.access_leg(grid, cost, 10000, 20)
+            grid[~np.isfinite(grid)] = np.nan
+            np.testing.assert_array_equal(np.isnan(grid), np.isnan(expected))
+            np.testing.assert_allclose(grid[~np.isnan(grid)], expected[~np.isnan(expected)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Rule semantics of the NumPy recode engine (sfarecode.py), as the
+GRASS 6 floating-point reclass used by r.recode.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import unittest
+import numpy as np
+from sfarecode import parse_rules, RecodeTable, score
+
+
+def table(text):
+    return RecodeTable(*parse_rules(text))
+
+
+def recode_reference(value, text):
+    """One value through the rules, as fpreclass: the last finite rule
+       matching, else the '*:high' rule, else the 'low:*' rule, else null.
+    """
+    rules, left, right = parse_rules(text)
+    for low, high, newlow, newhigh in reversed(rules):
+        if low <= value <= high:
+            if high == low or newhigh == newlow:
+                return newlow
+            return newlow + (value - low) / (high - low) * (newhigh - newlow)
+    if left is not None and value <= left[0]:
+        return left[1]
+    if right is not None and value >= right[0]:
+        return right[1]
+    return np.nan
+
+
+class RecodeRulesTest(unittest.TestCase):
+
+    def assertRecodes(self, text, values, expected):
+        out = table(text).recode(np.array(values, dtype=np.float64))
+        np.testing.assert_allclose(out, expected)
+
+    def test_linear_and_constant(self):
+        self.assertRecodes('0:10:0:1\n10:20:5', [0, 5, 10, 15, 20, 21],
+                           [0, 0.5, 5, 5, 5, np.nan])
+
+    def test_last_finite_rule_wins(self):
+        self.assertRecodes('0:10:1\n5:10:2', [4, 5, 10], [1, 2, 2])
+
+    def test_reversed_bounds(self):
+        self.assertRecodes('10:0:1:0', [0, 2.5, 10], [0, 0.25, 1])
+
+    def test_infinite_rules_after_finite(self):
+        # r.recode gives 0.5 at 50: the finite rule has precedence
+        text = '0:50:1:0.5\n50:*:0.2'
+        self.assertRecodes(text, [0, 50, 50.5, 1000], [1, 0.5, 0.2, 0.2])
+        text = '*:0:3\n0:50:1:0.5'
+        self.assertRecodes(text, [-5, 0, 25], [3, 1, 0.75])
+
+    def test_last_infinite_rule_of_each_side(self):
+        self.assertRecodes('100:*:1\n200:*:2\n*:0:3\n*:-10:4',
+                           [-20, -5, 150, 250], [4, np.nan, np.nan, 2])
+
+    def test_infinite_rule_order(self):
+        # both '*' rules match: the '*:high' one first
+        self.assertRecodes('*:10:1\n0:*:2', [-1, 5, 11], [1, 1, 2])
+
+    def test_null_and_comments(self):
+        text = '# score\n0:10:0:1 # linear\n\nend\n10:20:5'
+        self.assertRecodes(text, [np.nan, 5, 15], [np.nan, 0.5, np.nan])
+
+    def test_invalid_rule(self):
+        self.assertRaises(ValueError, parse_rules, '0:1')
+        self.assertRaises(ValueError, parse_rules, '*:*:1')
+
+    def test_random_against_reference(self):
+        rng = np.random.RandomState(0)
+        for trial in xrange(50):
+            lines = []
+            for i in xrange(rng.randint(1, 6)):
+                low, high = sorted(rng.randint(0, 20, 2))
+                if rng.rand() < 0.5:
+                    lines.append('%d:%d:%g:%g' % (low, high, rng.rand(), rng.rand()))
+                else:
+                    lines.append('%d:%d:%g' % (low, high, rng.rand()))
+            if rng.rand() < 0.5:
+                lines.append('*:%d:%g' % (rng.randint(0, 20), rng.rand()))
+            if rng.rand() < 0.5:
+                lines.append('%d:*:%g' % (rng.randint(0, 20), rng.rand()))
+            rng.shuffle(lines)
+            text = '\n'.join(lines)
+            values = np.concatenate([np.arange(-2, 23), rng.uniform(-2, 22, 50)])
+            expected = [recode_reference(v, text) for v in values]
+            np.testing.assert_allclose(table(text).recode(values), expected,
+                                       err_msg=text)
+
+
+class ScoreTest(unittest.TestCase):
+
+    def test_integer_input_truncates(self):
+        # r.recode writes a CELL map for a CELL input
+        t = table('0:10:0:15')
+        np.testing.assert_array_equal(score(np.array([1.0, 3.0, 10.0]), t, integer=True),
+                                      [1, 4, 15])
+        np.testing.assert_allclose(score(np.array([1.0, 3.0]), t), [1.5, 4.5])
+
+    def test_nullzero_and_weight(self):
+        t = table('0:10:0:1')
+        np.testing.assert_allclose(score(np.array([5.0, 20.0]), t, nullzero=True),
+                                   [0.5, 0.0])
+        np.testing.assert_allclose(score(np.array([5.0, 20.0]), t, weight=2.0),
+                                   [0.25, np.nan])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""weightsweep.py against the probmaps computed one weight set at a time,
+on a small in-memory stand-in of the GRASS layers.
+Run with: python -m unittest discover -s bin -p 'test_*.py'
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from bil import openbil, writebil
+from sfarecode import NODATA, load_table, score
+from parameters import GRAPHS, COMSCORELIST, RESSCORELIST, COSTSCORELIST
+import weightsweep as ws
+
+NROWS, NCOLS = 29, 17
+
+
+class FakeGrass:
+    """The raster exchange used by sfarecode: r.out.gdal writes a layer
+       as EHdr, r.in.gdal reads one back.
+    """
+    def __init__(self, layers):
+        self.layers = layers
+
+    def region(self):
+        return dict(rows=NROWS, cols=NCOLS, w=0.0, n=1000.0, ewres=30.0, nsres=30.0)
+
+    def raster_info(self, layername):
+        return {'datatype': 'CELL' if layername.endswith('_cost') and
+                layername[:-5] in [c for c, s in COSTSCORELIST] else 'DCELL'}
+
+    def run_command(self, cmd, **kw):
+        if cmd == 'r.out.gdal':
+            arr = self.layers[kw['input']]
+            writebil(kw['output'], np.where(np.isnan(arr), NODATA, arr),
+                     15.0, 985.0, 30.0, 30.0)
+        else:
+            arr = np.array(openbil(kw['input'])[1], dtype=np.float64)
+            arr[arr == NODATA] = np.nan
+            self.layers[kw['output']] = arr
+        return 0
+
+
+class WeightSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp(prefix='test_weightsweep_')
+        os.chdir(self.tmpdir)
+        os.makedirs(GRAPHS)
+        rng = np.random.RandomState(0)
+        for scorelist in (COMSCORELIST, RESSCORELIST, COSTSCORELIST):
+            for att, scorename in scorelist:
+                with open(os.path.join(GRAPHS, scorename + '.sfa'), 'w') as f:
+                    f.write('0:50:1:0.5\n50:*:0.2\n%d:%d:0.9\n' %
+                            (rng.randint(0, 60), rng.randint(60, 99)))
+        self.layers = {}
+        for cost, scorename in COSTSCORELIST:
+            self.layers[cost + '_cost'] = rng.randint(0, 400, (NROWS, NCOLS)).astype(float)
+        for name in ['pop_att', 'emp_att'] + [layer for w, layer in ws.ROADWEIGHTS]:
+            arr = rng.uniform(0, 100, (NROWS, NCOLS))
+            arr[rng.rand(NROWS, NCOLS) < 0.05] = np.nan
+            self.layers[name] = arr
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def reference(self, weights, scorelist):
+        """The probmap of genProbmap with the full weight set."""
+        transport = 0
+        for name, layer in ws.ROADWEIGHTS:
+            transport = transport + weights[name] / (self.layers[layer] + 0.1)
+        transport = np.where(np.isnan(transport), 0.0, transport)
+        prob = np.ones((NROWS, NCOLS))
+        for cost, scorename in COSTSCORELIST:
+            prob *= score(self.layers[cost + '_cost'],
+                          load_table(os.path.join(GRAPHS, scorename + '.sfa')),
+                          True, None, True)
+        for att, scorename in scorelist:
+            values = transport if att == 'transport' else self.layers[att + '_att']
+            prob *= score(values, load_table(os.path.join(GRAPHS, scorename + '.sfa')),
+                          False, weights[scorename])
+        return prob
+
+    def test_sweep(self):
+        weightsets = [{}, {'W_STATERD': 10.0, 'pop_com': 0.5},
+                      {'W_RAMP': 0.0, 'transport_res': 2.0, 'emp_res': 0.3}]
+        results = ws.weightsweep(FakeGrass(self.layers), weightsets, 'out',
+                                 processes=1, membudget=20000)
+        for i, weightset in enumerate(weightsets):
+            full = ws.fullweights(weightset)
+            for probmap, scorelist, multiplier in ws.PROBMAPS:
+                expected = self.reference(full, scorelist)
+                valid = expected[~np.isnan(expected)]
+                stats = results[i][probmap]
+                np.testing.assert_allclose([stats['mean'], stats['min'], stats['max']],
+                                           [valid.mean(), valid.min(), valid.max()])
+                self.assertEqual(stats['nonzero'], (valid > 0).sum())
+                got = np.array(openbil('out/%s_%d.bil' % (probmap, i))[1], dtype=np.float64)
+                np.testing.assert_array_equal(got == NODATA, np.isnan(expected))
+                np.testing.assert_allclose(got[got != NODATA], valid, rtol=1e-6)
+
+    def test_unknown_weight(self):
+        self.assertRaises(ValueError, ws.fullweights, {'W_NOPE': 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
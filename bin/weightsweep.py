@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""Probmap sensitivity to the weights: many weight sets in one batch.
+
+Only the last steps of the model depend on the weights:
+transportAttraction (W_STATERD, W_COUNTY, W_ROAD, W_RAMP, W_INTERSECT)
+and the score exponents of genProbmap (WEIGHTS). The sweep exports
+the layers before them once: the road class and intersection costs,
+pop_att, emp_att and the water, forest and slope costs. The parts that
+do not depend on the weights are recoded once into resident .bil files:
+the shared cost score product and the pop/emp scores before their
+exponent. Each worker then takes a share of the weight sets and streams
+the resident layers in row blocks. It evaluates SWEEPBATCH weight sets
+per block at once, broadcast along a leading axis, and computes
+transport_att, its scores and both probmaps, exactly as the model would
+with those weights. Per weight set and probmap it keeps summary
+statistics. With an output directory it also writes the probmaps as
+.bil files, which GLUC can read.
+
+A weight set is a dict of some of the names above, e.g.
+{"W_STATERD": 2000, "pop_res": 1.2}; the other weights keep their value
+in parameters.py. A sweep file is a JSON list of such dicts.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from bil import openbil, createbil
+from rasterstats import blockrows
+from sfarecode import NODATA, load_table, score, exportlayer, createlayer
+import parameters
+from parameters import GRAPHS, WEIGHTS, COMSCORELIST, RESSCORELIST, COSTSCORELIST, \
+                       SWEEPWORKERS, SWEEPBATCH, STATSMEMBUDGET
+
+# the transportAttraction terms: (weight name, cost layer)
+ROADWEIGHTS = [('W_STATERD', 'staterd_cost'), ('W_COUNTY', 'county_cost'),
+               ('W_ROAD', 'road_cost'), ('W_RAMP', 'ramp_cost'),
+               ('W_INTERSECT', 'intersect_cost')]
+# probmap -> (centerscorelist, multiplier of the _percentage map)
+PROBMAPS = [('probmap_com', COMSCORELIST, 10000000),
+            ('probmap_res', RESSCORELIST, 100000)]
+STATS = ['mean', 'std', 'min', 'max', 'nonzero']
+
+
+def fullweights(weightset):
+    """The weight set completed with the values of parameters.py."""
+    full = dict((name, getattr(parameters, name)) for name, layer in ROADWEIGHTS)
+    full.update(WEIGHTS)
+    unknown = set(weightset) - set(full)
+    if unknown:
+        raise ValueError('unknown weights: ' + ', '.join(sorted(unknown)))
+    full.update(weightset)
+    return full
+
+
+def prepare(grass, tmpdir, membudget=STATSMEMBUDGET):
+    """Export the weight independent layers to tmpdir and recode the
+       scores that do not depend on the weights.
+       @output: dict of layer name -> .bil file name: the ROADWEIGHTS
+                costs, 'costscore' (the product of the COSTSCORELIST
+                scores) and '<score>_base' for the pop and emp scores
+                before their exponent
+    """
+    bils = {}
+    for name, layer in ROADWEIGHTS:
+        bils[layer] = os.path.join(tmpdir, layer + '.bil')
+        exportlayer(grass, layer, bils[layer])
+
+    # components of the scores: (input layer, rules, nullzero, output)
+    parts = [(cost + '_cost', scorename, True) for cost, scorename in COSTSCORELIST]
+    bases = sorted(set((att + '_att', scorename)
+                       for probmap, scorelist, multiplier in PROBMAPS
+                       for att, scorename in scorelist if att != 'transport'))
+    layers = sorted(set([p[0] for p in parts] + [b[0] for b in bases]))
+    integer = dict((layer, grass.raster_info(layer)['datatype'] == 'CELL')
+                   for layer in layers)
+    inputs = dict((layer, exportlayer(grass, layer, os.path.join(tmpdir, layer + '.bil')))
+                  for layer in layers)
+
+    outputs = {}
+    for name in ['costscore'] + [scorename + '_base' for att, scorename in bases]:
+        bils[name] = os.path.join(tmpdir, name + '.bil')
+        outputs[name] = createlayer(grass, bils[name])
+    nrows, ncols = inputs[layers[0]].shape
+    step = blockrows(ncols, 8, len(layers) + len(outputs) + 2, membudget)
+    for r in xrange(0, nrows, step):
+        blocks = {}
+        for layer in layers:
+            block = np.array(inputs[layer][r:r+step], dtype=np.float64)
+            block[block == NODATA] = np.nan
+            blocks[layer] = block
+        shared = np.ones(blocks[layers[0]].shape)
+        for layer, scorename, nullzero in parts:
+            shared *= score(blocks[layer], load_table(GRAPHS + '/' + scorename + '.sfa'),
+                            nullzero, None, integer[layer])
+        outputs['costscore'][r:r+step] = np.where(np.isnan(shared), NODATA, shared)
+        for layer, scorename in bases:
+            base = score(blocks[layer], load_table(GRAPHS + '/' + scorename + '.sfa'),
+                         False, None, integer[layer])
+            outputs[scorename + '_base'][r:r+step] = np.where(np.isnan(base), NODATA, base)
+    for out in outputs.values():
+        out.flush()
+    return bils
+
+
+def _readblock(arr, r, step):
+    block = np.array(arr[r:r+step], dtype=np.float64)
+    block[block == NODATA] = np.nan
+    return block
+
+
+def sweep_chunk(args):
+    """Pool worker: evaluate a list of (index, full weight set) over the
+       prepared layers.
+       @output: list of (index, {probmap: {stat: value}})
+    """
+    bils, weightsets, outdir, membudget = args
+    arrays = dict((name, openbil(bilname)) for name, bilname in bils.items())
+    header = arrays['costscore'][0]
+    nrows, ncols = header.nrows, header.ncols
+    step = blockrows(ncols, 8, SWEEPBATCH*4 + len(arrays), membudget)
+
+    results = []
+    for start in xrange(0, len(weightsets), SWEEPBATCH):
+        batch = weightsets[start:start+SWEEPBATCH]
+        k = len(batch)
+        sums = dict((p[0], np.zeros((4, k))) for p in PROBMAPS) # sum, sum^2, nonzero, count
+        mins = dict((p[0], np.full(k, np.inf)) for p in PROBMAPS)
+        maxs = dict((p[0], np.full(k, -np.inf)) for p in PROBMAPS)
+        outs = {}
+        if outdir:
+            for index, weights in batch:
+                for probmap, scorelist, multiplier in PROBMAPS:
+                    bilname = os.path.join(outdir, '%s_%d.bil' % (probmap, index))
+                    outs[(probmap, index)] = createbil(bilname, nrows, ncols, 'float32',
+                        header.ulx, header.uly, header.xdim, header.ydim, NODATA)[1]
+
+        for r in xrange(0, nrows, step):
+            # transportAttraction of each weight set, null to 0
+            trans = None
+            for name, layer in ROADWEIGHTS:
+                w = np.array([weights[name] for index, weights in batch])[:, None, None]
+                term = w / (_readblock(arrays[layer][1], r, step)[None] + 0.1)
+                trans = term if trans is None else trans + term
+            trans[np.isnan(trans)] = 0.0
+            shared = _readblock(arrays['costscore'][1], r, step)
+
+            for probmap, scorelist, multiplier in PROBMAPS:
+                prob = np.repeat(shared[None], k, axis=0)
+                for att, scorename in scorelist:
+                    w = np.array([weights[scorename] for index, weights in batch])[:, None, None]
+                    if att == 'transport':
+                        base = load_table(GRAPHS + '/' + scorename + '.sfa').recode(trans)
+                    else:
+                        base = _readblock(arrays[scorename + '_base'][1], r, step)[None]
+                    with np.errstate(invalid='ignore'):
+                        prob *= np.power(base, w)
+                valid = ~np.isnan(prob)
+                vals = np.where(valid, prob, 0.0)
+                acc = sums[probmap]
+                acc[0] += vals.sum(axis=(1, 2))
+                acc[1] += (vals**2).sum(axis=(1, 2))
+                acc[2] += (vals > 0).sum(axis=(1, 2))
+                acc[3] += valid.sum(axis=(1, 2))
+                mins[probmap] = np.minimum(mins[probmap], np.where(valid, prob, np.inf).min(axis=(1, 2)))
+                maxs[probmap] = np.maximum(maxs[probmap], np.where(valid, prob, -np.inf).max(axis=(1, 2)))
+                if outdir:
+                    for i, (index, weights) in enumerate(batch):
+                        outs[(probmap, index)][r:r+step] = np.where(valid[i], prob[i], NODATA)
+
+        for out in outs.values():
+            out.flush()
+        for i, (index, weights) in enumerate(batch):
+            stats = {}
+            for probmap, scorelist, multiplier in PROBMAPS:
+                total, squares, nonzero, count = sums[probmap][:, i]
+                mean = total / count if count else np.nan
+                stats[probmap] = {
+                    'mean': mean,
+                    'std': np.sqrt(max(squares / count - mean**2, 0.0)) if count else np.nan,
+                    'min': mins[probmap][i], 'max': maxs[probmap][i],
+                    'nonzero': int(nonzero)}
+            results.append((index, stats))
+    return results
+
+
+def weightsweep(grass, weightsets, outdir=None, processes=SWEEPWORKERS,
+                membudget=STATSMEMBUDGET):
+    """Evaluate the probmaps of every weight set on the current region.
+       The intermediate layers (gencentersAttmaps, genOtherAttmaps) must
+       exist.
+       @inputs: weightsets (list of dict), see the module doc
+                outdir (str): write probmap_com_<i>.bil and
+                              probmap_res_<i>.bil there, None for the
+                              statistics only
+                processes (int): 0 uses every core
+       @output: list, per weight set, of {probmap: {stat: value}}
+    """
+    full = [(i, fullweights(w)) for i, w in enumerate(weightsets)]
+    if outdir and not os.path.exists(outdir):
+        os.makedirs(outdir)
+    tmpdir = tempfile.mkdtemp(prefix='weightsweep_')
+    try:
+        bils = prepare(grass, tmpdir, membudget)
+        processes = max(1, min(processes or cpu_count(), len(full)))
+        chunks = [full[i::processes] for i in xrange(processes)]
+        tasks = [(bils, chunk, outdir, membudget // processes) for chunk in chunks if chunk]
+        if len(tasks) > 1:
+            pool = Pool(len(tasks))
+            try:
+                parts = pool.map(sweep_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            parts = map(sweep_chunk, tasks)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return [stats for index, stats in sorted(sum(parts, []))]
+
+
+def writesummary(fname, weightsets, results):
+    """Write one csv row per weight set: its full weights, then the STATS
+       of each probmap.
+    """
+    names = [name for name, layer in ROADWEIGHTS] + sorted(WEIGHTS)
+    with open(fname, 'w') as f:
+        f.write(','.join(['set'] + names + ['%s_%s' % (p[0], s) for p in PROBMAPS
+                                              for s in STATS]) + '\n')
+        for i, (weightset, stats) in enumerate(zip(weightsets, results)):
+            full = fullweights(weightset)
+            f.write(','.join([str(i)] + [repr(full[n]) for n in names] +
+                             [repr(stats[p[0]][s]) for p in PROBMAPS for s in STATS]) + '\n')
+
+
+def main():
+    sys.path.append(os.path.join(os.environ['GISBASE'], 'etc', 'python'))
+    import grass.script as grass
+    with open(sys.argv[1], 'r') as f:
+        weightsets = json.load(f)
+    outdir = sys.argv[3] if len(sys.argv) > 3 else None
+    results = weightsweep(grass, weightsets, outdir)
+    writesummary(sys.argv[2], weightsets, results)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Require Arg1: JSON list of weight sets, Arg2: output csv summary,\n" + \
+              "        Arg3: (optional) directory of the probmap .bil files.\n" + \
+              "Runs in the current GRASS session, after the attraction maps."
+        exit(1)
+    main()
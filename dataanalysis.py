@@ -14,12 +14,12 @@ This script will do:
 #from ggplot import * #ggplot is best to be used with pandas DataFrames
 import sys
 import numpy as np
-import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 from optparse import OptionParser
 from Utils import createdirectorynotexist, extractheader, outfilename
+from rasterstats import maskedhistograms
 import time 
 
 if (len(sys.argv) < 3):
@@ -121,26 +121,26 @@ def plotgraph(x, y, xsize, outfile, name, mapname):
     # save the figure to file
     plt.savefig(outfile)
 
-def frequencyanalysis_attr(attr_res_arr, attr_arr, attr_arr_x, RESCOM, ATTRFREQ, 
+def frequencyanalysis_attr(attr_res_hist, attr_hist, attr_arr_x, RESCOM, ATTRFREQ, 
                            ATTRBASE, ATT=ATT):
+    """attr_res_hist and attr_hist are IntHistograms of the res/com cells
+       and of all non-road cells. Since values are integers, the basket
+       (cur1, cur2] is counted as [cur1+1, cur2+1).
+    """
     xlen = len(attr_arr_x)
-    attr_res_arr_nb         = attr_res_arr[attr_res_arr > ATTRBASE]
-    print "NUM ATTR " + RESCOM + " CELLS CONSIDERED: ", len(attr_res_arr_nb) 
-    attr_res_arr_nbsort     = np.sort(attr_res_arr_nb)
-    attr_res_basketsize_1st = len(attr_res_arr[attr_res_arr == ATTRBASE])
-    attr_basketsize_1st      = len(attr_arr    [attr_arr     == ATTRBASE])
+    print "NUM ATTR " + RESCOM + " CELLS CONSIDERED: ", attr_res_hist.count(ATTRBASE+1) 
+    attr_res_basketsize_1st = attr_res_hist.count(ATTRBASE, ATTRBASE+1)
+    attr_basketsize_1st      = attr_hist.count(ATTRBASE, ATTRBASE+1)
     attr_res_freq = [attr_res_basketsize_1st]
     attr_arr_freq = [attr_basketsize_1st]
     cur1 = attr_arr_x[1]
     for i in xrange(2, xlen): #i is for cur2. in total ATTRBASKETNUM baskets.
         cur2 = attr_arr_x[i]
-        mask = (attr_res_arr > cur1) & (attr_res_arr <= cur2)
-        attr_res_freq.append(len(attr_res_arr[mask]))
-        mask = (attr_arr > cur1) & (attr_arr <= cur2)
-        attr_arr_freq.append(len(attr_arr[mask]))
+        attr_res_freq.append(attr_res_hist.count(cur1+1, cur2+1))
+        attr_arr_freq.append(attr_hist.count(cur1+1, cur2+1))
         cur1 = cur2
-    attr_res_freq.append(len(attr_res_arr[attr_res_arr > cur1]))
-    attr_arr_freq.append(len(attr_arr[attr_arr > cur1]))
+    attr_res_freq.append(attr_res_hist.count(cur1+1))
+    attr_arr_freq.append(attr_hist.count(cur1+1))
     
     print "---------------------attr_"+RESCOM.lower()+"_freq----------------\n",[int(i) for i in attr_res_freq]
     print "---------------------attr_arr_freq----------------\n",[int(i) for i in attr_arr_freq]
@@ -156,25 +156,23 @@ def frequencyanalysis_attr(attr_res_arr, attr_arr, attr_arr_x, RESCOM, ATTRFREQ,
     np.savetxt(outdatafname, outdata_arr,fmt='%5.5f',delimiter=',',
                                          header="x,res/com,original,y", comments='')
 
-def frequencyanalysis_cost(cost_res_arr, cost_arr, cost_arr_x, RESCOM, COSTFREQ, 
+def frequencyanalysis_cost(cost_res_hist, cost_hist, cost_arr_x, RESCOM, COSTFREQ, 
                            COSTMAX, COSTBASE, CST=CST):
+    """cost_res_hist and cost_hist are IntHistograms of the res/com cells
+       and of all non-road cells.
+    """
     xlen = len(cost_arr_x)
-    cost_res_arr_nb          = cost_res_arr[(cost_res_arr < COSTMAX)&(cost_res_arr > COSTBASE)]
-    print "NUM COST " + RESCOM + " CELLS CONSIDERED: ", len(cost_res_arr_nb)
-    cost_res_arr_nbsort      = np.sort(cost_res_arr_nb)
-    cost_res_basketsize_last = len(cost_res_arr[cost_res_arr == COSTMAX])
+    print "NUM COST " + RESCOM + " CELLS CONSIDERED: ", cost_res_hist.count(COSTBASE+1, COSTMAX)
     cost_res_freq = []
     cost_arr_freq = []
     cur1 = cost_arr_x[0]
     for i in xrange(1, xlen): #i is for cur2. in total ATTRBASKETNUM baskets.
         cur2 = cost_arr_x[i]
-        mask = (cost_res_arr >= cur1) & (cost_res_arr < cur2)
-        cost_res_freq.append(len(cost_res_arr[mask]))
-        mask = (cost_arr >= cur1) & (cost_arr < cur2)
-        cost_arr_freq.append(len(cost_arr[mask]))
+        cost_res_freq.append(cost_res_hist.count(cur1, cur2))
+        cost_arr_freq.append(cost_hist.count(cur1, cur2))
         cur1 = cur2
-    cost_res_freq.append(len(cost_res_arr[cost_res_arr >= cur1]))
-    cost_arr_freq.append(len(cost_arr[cost_arr >= cur1]))
+    cost_res_freq.append(cost_res_hist.count(cur1))
+    cost_arr_freq.append(cost_hist.count(cur1))
 
     print "---------------------cost_"+RESCOM.lower()+"_freq----------------\n",[int(i) for i in cost_res_freq]
     print "---------------------cost_arr_freq----------------\n",[int(i) for i in cost_arr_freq]
@@ -198,33 +196,27 @@ def main():
 
     attrbasketnum = int(sys.argv[1])
     costbasketnum = int(sys.argv[2])
-    landroadclassmap = pd.read_csv(LANDROADCLASSMAP, sep=r"\s+", skiprows=6, header=None)
-    attrmap          = pd.read_csv(ATTRMAP, sep=r"\s+", skiprows=6, header=None)
-    attrmap          = attrmap.round().astype(np.int)
-    travelcostmap    = pd.read_csv(TRCOSTMAP, sep=r"\s+", skiprows=6, header=None)
-    travelcostmap    = travelcostmap.round().astype(np.int)
-    
-    # plt.hist(attrmap.values.flatten())
-    # plt.savefig("histogram.png")
-    # exit(1)
-
-    landroad_arr   = landroadclassmap.values.flatten()
-    mask_noroad    = (landroad_arr > ROADCLASSMAX)
-    mask_res       = (landroad_arr > ROADCLASSMAX) & (landroad_arr >= RESIDENTIALMIN)& (landroad_arr <= RESIDENTIALMAX)
-    mask_com       = (landroad_arr > ROADCLASSMAX) & (landroad_arr >= COMMERCIALMIN) & (landroad_arr <= COMMERCIALMAX)
+    # the maps are streamed in row blocks and only exact histograms of
+    # the rounded values are kept for each landuse mask.
+    masks = {
+        'all'   : None,
+        'noroad': lambda lr: (lr > ROADCLASSMAX),
+        'res'   : lambda lr: (lr > ROADCLASSMAX) & (lr >= RESIDENTIALMIN)& (lr <= RESIDENTIALMAX),
+        'com'   : lambda lr: (lr > ROADCLASSMAX) & (lr >= COMMERCIALMIN) & (lr <= COMMERCIALMAX),
+    }
+    attr_hists = maskedhistograms(ATTRMAP, LANDROADCLASSMAP, masks)
+    cost_hists = maskedhistograms(TRCOSTMAP, LANDROADCLASSMAP, masks)
  
-    attr_arr_org   = attrmap.values.flatten()
-    ATTRBASE       = attr_arr_org.min()
+    ATTRBASE       = attr_hists['all'].min()
     
-    attr_arr       = attr_arr_org[mask_noroad]
-    attr_res_arr   = attr_arr_org[mask_res]
-    attr_com_arr   = attr_arr_org[mask_com]
-    cost_arr_org   = travelcostmap.values.flatten()
-    COSTBASE       = cost_arr_org.min()
-    COSTMAX        = cost_arr_org.max()
-    cost_arr       = cost_arr_org[mask_noroad]
-    cost_res_arr   = cost_arr_org[mask_res]
-    cost_com_arr   = cost_arr_org[mask_com]
+    attr_hist      = attr_hists['noroad']
+    attr_res_hist  = attr_hists['res']
+    attr_com_hist  = attr_hists['com']
+    COSTBASE       = cost_hists['all'].min()
+    COSTMAX        = cost_hists['all'].max()
+    cost_hist      = cost_hists['noroad']
+    cost_res_hist  = cost_hists['res']
+    cost_com_hist  = cost_hists['com']
 
     print "ATTRBASE: ", ATTRBASE
     print "COSTBASE: ", ATTRBASE
@@ -233,36 +225,35 @@ def main():
     # find one x axis (quantile or equal interval) for attr_arr, attr_res_arr, attr_com_arr
     # note that, about 63.5% attrmap cells have base value, so we do not consider base value cells
     # when finding x axis for quantile. We will set attrbase as the first x tick.
-    attr_arr_nobase    = attr_arr[attr_arr > ATTRBASE]
-    print "NUM ATTR CELLS CONSIDERED: ", len(attr_arr_nobase)
-    attr_arr_nblen     = len(attr_arr_nobase)
+    attr_hist_nobase   = attr_hist.select(ATTRBASE+1)
+    print "NUM ATTR CELLS CONSIDERED: ", len(attr_hist_nobase)
+    attr_arr_nblen     = len(attr_hist_nobase)
     attrbasketsize     = attr_arr_nblen/attrbasketnum
-    attr_arr_nbsort    = np.sort(attr_arr_nobase)
-    attr_arr_nbsort    = attr_arr_nbsort[0:attr_arr_nblen-1:attrbasketsize] # the x axis tick values 
+    attr_arr_nbsort    = attr_hist_nobase.sortedat(xrange(0, attr_arr_nblen-1, attrbasketsize)) # the x axis tick values 
     attr_arr_x         = [ATTRBASE] + attr_arr_nbsort.tolist()  # need add one basket for base value
     attr_arr_x         = attr_arr_x[0:attrbasketnum+1]                      # merge the last basket to the previous one
     attr_arr_x         = np.unique(attr_arr_x)
     print "---------------------attr_arr_x----------------\n", attr_arr_x
 
-    frequencyanalysis_attr(attr_res_arr, attr_arr, attr_arr_x, RES, ATTRFREQ_RES, ATTRBASE)
-    frequencyanalysis_attr(attr_com_arr, attr_arr, attr_arr_x, COM, ATTRFREQ_COM, ATTRBASE)
+    frequencyanalysis_attr(attr_res_hist, attr_hist, attr_arr_x, RES, ATTRFREQ_RES, ATTRBASE)
+    frequencyanalysis_attr(attr_com_hist, attr_hist, attr_arr_x, COM, ATTRFREQ_COM, ATTRBASE)
 
     # find one x axis (quantile or equal interval) for attr_arr, attr_res_arr, attr_com_arr
     # note that, about 63.5% attrmap cells have base value, so we do not consider base value cells
     # when finding x axis for quantile. We will set attrbase as the first x tick.
-    cost_arr_nobase    = cost_arr[(cost_arr < COSTMAX)&(cost_arr > COSTBASE)]
-    print "NUM COST CELLS CONSIDERED: ", len(cost_arr_nobase)
-    cost_arr_nblen     = len(cost_arr_nobase)
+    cost_hist_nobase   = cost_hist.select(COSTBASE+1, COSTMAX)
+    print "NUM COST CELLS CONSIDERED: ", len(cost_hist_nobase)
+    cost_arr_nblen     = len(cost_hist_nobase)
     costbasketsize     = cost_arr_nblen/costbasketnum
-    cost_arr_nbsort    = np.sort(cost_arr_nobase)
-    cost_arr_nbsort    = cost_arr_nbsort[COSTBASE+1:cost_arr_nblen-1:costbasketsize] # the x axis tick values 
+    cost_arr_nbsort    = cost_hist_nobase.sortedat(xrange(*slice(COSTBASE+1, cost_arr_nblen-1, 
+                                                          costbasketsize).indices(cost_arr_nblen))) # the x axis tick values 
     cost_arr_nbsort    = cost_arr_nbsort[:-1]                                    # merge the last basket to the previous one
     cost_arr_x         = np.insert(cost_arr_nbsort, 0, COSTBASE)
     cost_arr_x         = np.unique(cost_arr_x)
     print "---------------------cost_arr_x----------------\n",cost_arr_x
 
-    frequencyanalysis_cost(cost_res_arr, cost_arr, cost_arr_x, RES, COSTFREQ_RES, COSTMAX, COSTBASE)
-    frequencyanalysis_cost(cost_com_arr, cost_arr, cost_arr_x, COM, COSTFREQ_COM, COSTMAX, COSTBASE)
+    frequencyanalysis_cost(cost_res_hist, cost_hist, cost_arr_x, RES, COSTFREQ_RES, COSTMAX, COSTBASE)
+    frequencyanalysis_cost(cost_com_hist, cost_hist, cost_arr_x, COM, COSTFREQ_COM, COSTMAX, COSTBASE)
 
 if __name__ == "__main__":
     if (len(sys.argv) < 2):
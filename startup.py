@@ -20,7 +20,7 @@ from weblog import RunLog
 from projectiontable import ProjTable
 from Utils import createdirectorynotexist
 import genYearChangemap # parameters are imported in genYearChangemap
-from multicostModel import * # publishSimMap
+from multicostModel import * # publishSimMaps
 from parameters import NUMCOLORS, CHICAGOREGIONCODE
 
 """
@@ -462,17 +462,19 @@ def processProjectionSet(projection):
     return demandstr
 
 def publishResults(title, site, resultsdir):
-    # @flag: denotes to run genSimMap.py or genSimMap_results.py      
-    publishSimMap(title+"_change", site, resultsdir+"/results", 
-        '21 blue is residential change and 23 red is commeritial change', nomin=True, flag=1)
-    publishSimMap(title+"_summary", site, resultsdir+"/details",
-        'year 0 to year last with color blue to red', nomin=True) 
-    publishSimMap(title+"_ppcell", site, resultsdir+"/details",
-        'residential population change per cell', nomin=True)
-    publishSimMap(title+"_empcell", site, resultsdir+"/details",
-        'commertial population change per cell', nomin=True) 
-    publishSimMap(title+"_year", site, resultsdir+"/results",
-        'year that cell cell has been changed', nomin=True, flag=1)
+    # @palette: 'results' colors the maps with the blues of the results maps
+    publishSimMaps([
+        dict(name=title+"_change", url=resultsdir+"/results", nomin=True, palette='results',
+             description='21 blue is residential change and 23 red is commeritial change'),
+        dict(name=title+"_summary", url=resultsdir+"/details", nomin=True,
+             description='year 0 to year last with color blue to red'),
+        dict(name=title+"_ppcell", url=resultsdir+"/details", nomin=True,
+             description='residential population change per cell'),
+        dict(name=title+"_empcell", url=resultsdir+"/details", nomin=True,
+             description='commertial population change per cell'),
+        dict(name=title+"_year", url=resultsdir+"/results", nomin=True, palette='results',
+             description='year that cell cell has been changed'),
+        ], site)
     
     # Add nogrowth map to the results layers on Google API
     simmapTitle = "nogrowth"